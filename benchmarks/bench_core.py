@@ -0,0 +1,229 @@
+"""
+Micro-benchmarks of the hot paths of scheduling and recording.
+
+Inputs are generated offline: schedules are scaled-up copies of
+``tests/data/schedule.xml``. Run with ``uv run python -m benchmarks.bench_core``
+and save the results with ``--output`` to compare them with ``--baseline``
+on another commit.
+"""
+
+import asyncio
+import copy
+import datetime
+import json
+import platform
+import statistics
+import subprocess
+import timeit
+import xml.etree.ElementTree as ET
+from pathlib import Path
+from typing import Annotated, Any, Callable, Optional
+from zoneinfo import ZoneInfo
+
+import typer
+
+from radiko_timeshift_recorder.download import generate_filename_candidates
+from radiko_timeshift_recorder.get_duration import parse_ffprobe_duration
+from radiko_timeshift_recorder.job import Job, Jobs
+from radiko_timeshift_recorder.job_queue import JobQueue
+from radiko_timeshift_recorder.radiko import Program, Schedule
+from radiko_timeshift_recorder.rules import Rule, Rules
+
+SCHEDULE_XML_PATH = Path(__file__).parent.parent / "tests" / "data" / "schedule.xml"
+
+FFPROBE_OUTPUT = json.dumps(
+    {"programs": [], "streams": [{"duration": "3600.023220"}]}, indent=4
+).encode()
+
+app = typer.Typer()
+
+
+def scaled_schedule_xml(num_stations: int, programs_per_station: int) -> bytes:
+    """Copy the stations and programs of the sample schedule up to the given counts."""
+    root = ET.parse(SCHEDULE_XML_PATH).getroot()
+    stations = root.find("stations")
+    assert stations is not None
+    station_template = stations[0]
+    progs_template = station_template.find("progs")
+    assert progs_template is not None
+    prog_template = progs_template.find("prog")
+    assert prog_template is not None
+
+    start = datetime.datetime(2025, 1, 1, 5, 0)
+    for station in list(stations):
+        stations.remove(station)
+
+    for i in range(num_stations):
+        station = copy.deepcopy(station_template)
+        station.set("id", f"STATION{i}")
+        progs = station.find("progs")
+        assert progs is not None
+        for prog in progs.findall("prog"):
+            progs.remove(prog)
+
+        for j in range(programs_per_station):
+            prog = copy.deepcopy(prog_template)
+            ft = start + datetime.timedelta(minutes=15 * j)
+            prog.set("id", f"{i}-{j}")
+            prog.set("ft", ft.strftime("%Y%m%d%H%M%S"))
+            prog.set(
+                "to", (ft + datetime.timedelta(minutes=15)).strftime("%Y%m%d%H%M%S")
+            )
+            prog.set("dur", "900")
+            title = prog.find("title")
+            assert title is not None
+            title.text = f"Program {j} of station {i}"
+            progs.append(prog)
+
+        stations.append(station)
+
+    return ET.tostring(root, encoding="utf-8", xml_declaration=True)
+
+
+def many_rules(num_rules: int, patterns_per_rule: int, stations: list[str]) -> Rules:
+    """Rules that match no program, so every pattern is tried."""
+    return Rules(
+        root=frozenset(
+            Rule(
+                stations=frozenset(stations),
+                title_patterns=frozenset(
+                    f"^No such program {i}-{j}$" for j in range(patterns_per_rule)
+                ),
+            )
+            for i in range(num_rules)
+        )
+    )
+
+
+def sample_job(i: int) -> Job:
+    ft = datetime.datetime(2025, 1, 1, 5, 0, tzinfo=ZoneInfo("Asia/Tokyo"))
+    ft += datetime.timedelta(minutes=i)
+    return Job(
+        program=Program(
+            id=str(i),
+            ft=ft,
+            to=ft + datetime.timedelta(minutes=15),
+            dur=900,
+            title=f"Program {i}",
+            pfm="Performer",
+        ),
+        station_id="TEST",
+    )
+
+
+async def _cycle_job_queue(jobs: list[Job]) -> None:
+    job_queue: JobQueue[Job] = JobQueue()
+    for job in jobs:
+        await job_queue.put(job)
+    for _ in jobs:
+        await job_queue.mark_done(await job_queue.get())
+
+
+def _measure(func: Callable[[], Any], repeat: int, ops: int = 1) -> dict[str, Any]:
+    timer = timeit.Timer(func)
+    number, _ = timer.autorange()
+    per_op = [t / number / ops for t in timer.repeat(repeat=repeat, number=number)]
+    return {
+        "ops": ops,
+        "number": number,
+        "min_seconds_per_op": min(per_op),
+        "median_seconds_per_op": statistics.median(per_op),
+    }
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            capture_output=True,
+            check=True,
+            text=True,
+            cwd=Path(__file__).parent,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+@app.command()
+def main(
+    num_stations: Annotated[int, typer.Option(min=1)] = 50,
+    programs_per_station: Annotated[int, typer.Option(min=1)] = 100,
+    num_rules: Annotated[int, typer.Option(min=1)] = 20,
+    patterns_per_rule: Annotated[int, typer.Option(min=1)] = 25,
+    queue_sizes: Annotated[list[int], typer.Option("--queue-size")] = [
+        10_000,
+        100_000,
+    ],
+    repeat: Annotated[int, typer.Option(min=1)] = 5,
+    output: Annotated[
+        Optional[Path],
+        typer.Option(dir_okay=False, help="Also write the results to this file"),
+    ] = None,
+    baseline: Annotated[
+        Optional[Path],
+        typer.Option(
+            exists=True,
+            dir_okay=False,
+            help="Results of an earlier run to compute speedups against",
+        ),
+    ] = None,
+):
+    schedule_xml = scaled_schedule_xml(num_stations, programs_per_station)
+    schedule = Schedule.from_xml(schedule_xml)
+    jobs = sorted(Jobs.from_schedule(schedule))
+    rules = many_rules(
+        num_rules, patterns_per_rule, [f"STATION{i}" for i in range(num_stations)]
+    )
+    program = jobs[0].program
+
+    benchmarks: dict[str, dict[str, Any]] = {
+        "Schedule.from_xml": _measure(
+            lambda: Schedule.from_xml(schedule_xml), repeat, ops=len(jobs)
+        ),
+        "Jobs.from_schedule": _measure(
+            lambda: Jobs.from_schedule(schedule), repeat, ops=len(jobs)
+        ),
+        "Rules.to_record": _measure(
+            lambda: rules.to_record(station_id="STATION0", program=program), repeat
+        ),
+        "generate_filename_candidates": _measure(
+            lambda: generate_filename_candidates(program), repeat
+        ),
+        "parse_ffprobe_duration": _measure(
+            lambda: parse_ffprobe_duration(FFPROBE_OUTPUT), repeat
+        ),
+    }
+    for queue_size in queue_sizes:
+        queue_jobs = [sample_job(i) for i in range(queue_size)]
+        benchmarks[f"JobQueue[{queue_size}]"] = _measure(
+            lambda: asyncio.run(_cycle_job_queue(queue_jobs)), repeat, ops=queue_size
+        )
+
+    if baseline is not None:
+        baseline_benchmarks = json.loads(baseline.read_text())["benchmarks"]
+        for name, result in benchmarks.items():
+            if name in baseline_benchmarks:
+                result["speedup"] = (
+                    baseline_benchmarks[name]["median_seconds_per_op"]
+                    / result["median_seconds_per_op"]
+                )
+
+    results = {
+        "commit": _git_commit(),
+        "python": platform.python_version(),
+        "params": {
+            "num_stations": num_stations,
+            "programs_per_station": programs_per_station,
+            "num_rules": num_rules,
+            "patterns_per_rule": patterns_per_rule,
+        },
+        "benchmarks": benchmarks,
+    }
+    text = json.dumps(results, indent=2)
+    print(text)
+    if output is not None:
+        output.write_text(text + "\n")
+
+
+if __name__ == "__main__":
+    app()
@@ -0,0 +1,161 @@
+"""
+Benchmark ``download()`` through the worker pool against the local radiko stand-in.
+
+Starts ``benchmarks.fake_radiko`` in a background thread, points the recorder
+at it, and records programs of the fake schedule with the server's workers.
+Needs ffmpeg and ffprobe. Failed attempts are retried after the usual 60
+seconds, so error and stall injection make runs correspondingly longer.
+Run with ``uv run python -m benchmarks.bench_download``.
+"""
+
+import asyncio
+import datetime
+import json
+import os
+import shutil
+import tempfile
+import time
+from pathlib import Path
+from typing import Annotated, Optional
+
+import typer
+
+from benchmarks.fake_radiko import FakeRadikoConfig, create_app
+from benchmarks.servers import ThreadedServer
+from radiko_timeshift_recorder import metrics
+from radiko_timeshift_recorder.download import download
+from radiko_timeshift_recorder.events import EventBus
+from radiko_timeshift_recorder.job import Job, Jobs
+from radiko_timeshift_recorder.job_queue import JobQueue
+from radiko_timeshift_recorder.progress import DownloadProgress
+from radiko_timeshift_recorder.radiko import RADIKO_BASE_URL_ENV
+from radiko_timeshift_recorder.server import worker
+from radiko_timeshift_recorder.watchdog import WatchdogConfig
+
+app = typer.Typer()
+
+
+def _sample(name: str, labels: Optional[dict[str, str]] = None) -> float:
+    return metrics.REGISTRY.get_sample_value(name, labels) or 0.0
+
+
+def _total(name: str) -> float:
+    return sum(
+        sample.value
+        for metric in metrics.REGISTRY.collect()
+        for sample in metric.samples
+        if sample.name == name
+    )
+
+
+async def _record(
+    jobs: list[Job], out_dir: Path, num_workers: int, watchdog: WatchdogConfig
+) -> None:
+    job_queue: JobQueue[Job] = JobQueue()
+    for job in jobs:
+        await job_queue.put(job)
+
+    async def process_job(job: Job, progress: DownloadProgress) -> None:
+        await download(job, out_dir, progress=progress, watchdog=watchdog)
+
+    workers = [
+        asyncio.create_task(worker(i, job_queue, process_job, {}, EventBus()))
+        for i in range(num_workers)
+    ]
+    while job_queue.pending or job_queue.in_progress:
+        await asyncio.sleep(0.1)
+    for task in workers:
+        task.cancel()
+    await asyncio.gather(*workers, return_exceptions=True)
+
+
+def _fake_jobs(count: int) -> list[Job]:
+    """The first programs of yesterday's fake schedule, across all stations."""
+    yesterday = datetime.date.today() - datetime.timedelta(days=1)
+    return sorted(Jobs.from_date(yesterday), key=lambda j: (j.program.ft, j.key))[
+        :count
+    ]
+
+
+@app.command()
+def main(
+    num_jobs: Annotated[int, typer.Option(min=1)] = 20,
+    num_workers: Annotated[int, typer.Option(min=1)] = 3,
+    num_stations: Annotated[int, typer.Option(min=1)] = 10,
+    program_minutes: Annotated[int, typer.Option(min=1)] = 30,
+    segment_seconds: Annotated[float, typer.Option(min=1)] = 5.0,
+    latency: Annotated[float, typer.Option(min=0)] = 0.0,
+    bandwidth: Annotated[
+        Optional[int], typer.Option(min=1, help="Bytes per second per response")
+    ] = None,
+    segment_error_rate: Annotated[float, typer.Option(min=0, max=1)] = 0.0,
+    segment_stall_rate: Annotated[float, typer.Option(min=0, max=1)] = 0.0,
+    stall_seconds: Annotated[float, typer.Option(min=0)] = 30.0,
+    stall_timeout: Annotated[float, typer.Option(min=1)] = 300.0,
+    seed: Annotated[int, typer.Option()] = 0,
+):
+    for command in ("ffmpeg", "ffprobe"):
+        if shutil.which(command) is None:
+            raise typer.BadParameter(f"{command} is required for this benchmark")
+
+    config = FakeRadikoConfig(
+        num_stations=num_stations,
+        program_minutes=program_minutes,
+        segment_seconds=segment_seconds,
+        latency=latency,
+        bandwidth=bandwidth,
+        segment_error_rate=segment_error_rate,
+        segment_stall_rate=segment_stall_rate,
+        stall_seconds=stall_seconds,
+        seed=seed,
+    )
+
+    with (
+        ThreadedServer(create_app(config)) as fake_radiko,
+        tempfile.TemporaryDirectory() as d,
+    ):
+        # Inherited by the fetch-stream processes of each download.
+        os.environ[RADIKO_BASE_URL_ENV] = fake_radiko.base_url
+        jobs = _fake_jobs(num_jobs)
+        out_dir = Path(d)
+
+        failures_before = _total("radiko_job_failures_total")
+        retries_before = _total("radiko_download_retries_total")
+        bytes_before = _sample("radiko_download_bytes_total")
+        start = time.perf_counter()
+        asyncio.run(
+            _record(
+                jobs, out_dir, num_workers, WatchdogConfig(stall_timeout=stall_timeout)
+            )
+        )
+        seconds = time.perf_counter() - start
+
+        recorded = list(out_dir.rglob("*.mp4"))
+        downloaded_bytes = _sample("radiko_download_bytes_total") - bytes_before
+        program_seconds = sum(job.program.dur for job in jobs)
+
+    print(
+        json.dumps(
+            {
+                "config": {
+                    "num_jobs": len(jobs),
+                    "num_workers": num_workers,
+                    **{k: v for k, v in vars(config).items() if v is not None},
+                },
+                "results": {
+                    "seconds": seconds,
+                    "recorded": len(recorded),
+                    "failed": _total("radiko_job_failures_total") - failures_before,
+                    "retries": _total("radiko_download_retries_total") - retries_before,
+                    "jobs_per_second": len(jobs) / seconds,
+                    "mib_per_second": downloaded_bytes / 1024 / 1024 / seconds,
+                    "realtime_factor": program_seconds / seconds,
+                },
+            },
+            indent=2,
+        )
+    )
+
+
+if __name__ == "__main__":
+    app()
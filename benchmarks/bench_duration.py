@@ -0,0 +1,104 @@
+"""
+Compare reading the duration of recordings from their MP4 boxes with ffprobe.
+
+Reads each ``.mp4`` file under the given paths both ways and reports the time
+per file and the largest difference between the two durations. Needs ffprobe.
+Run with ``uv run python -m benchmarks.bench_duration OUT_DIR``.
+"""
+
+import asyncio
+import json
+import shutil
+import statistics
+import time
+from pathlib import Path
+from typing import Annotated, Awaitable, Callable
+
+import typer
+
+from radiko_timeshift_recorder.get_duration import get_duration_with_ffprobe
+from radiko_timeshift_recorder.mp4 import Mp4Error, read_audio_duration
+
+app = typer.Typer()
+
+
+async def _read_natively(path: Path) -> float:
+    return read_audio_duration(path)
+
+
+def _measure(
+    read: Callable[[Path], Awaitable[float]], paths: list[Path], repeat: int
+) -> tuple[dict[str, float], dict[Path, float]]:
+    seconds: list[float] = []
+    durations: dict[Path, float] = {}
+
+    async def run() -> None:
+        for path in paths:
+            start = time.perf_counter()
+            durations[path] = await read(path)
+            seconds.append(time.perf_counter() - start)
+
+    for _ in range(repeat):
+        asyncio.run(run())
+
+    return {
+        "median_seconds_per_file": statistics.median(seconds),
+        "max_seconds_per_file": max(seconds),
+        "total_seconds": sum(seconds) / repeat,
+    }, durations
+
+
+@app.command()
+def main(
+    paths: Annotated[
+        list[Path],
+        typer.Argument(exists=True, help="Recordings, or directories to find them in"),
+    ],
+    limit: Annotated[int, typer.Option(min=1, help="Files to read at most")] = 200,
+    repeat: Annotated[int, typer.Option(min=1)] = 3,
+):
+    if shutil.which("ffprobe") is None:
+        raise typer.BadParameter("ffprobe is required for this benchmark")
+
+    files = sorted(
+        file
+        for path in paths
+        for file in (path.rglob("*.mp4") if path.is_dir() else [path])
+    )[:limit]
+    if not files:
+        raise typer.BadParameter("No .mp4 files found")
+
+    # Files the box reader cannot parse would fall back to ffprobe anyway.
+    supported = []
+    for file in files:
+        try:
+            read_audio_duration(file)
+            supported.append(file)
+        except Mp4Error:
+            pass
+    if not supported:
+        raise typer.BadParameter("None of the files could be read from their boxes")
+
+    native, native_durations = _measure(_read_natively, supported, repeat)
+    ffprobe, ffprobe_durations = _measure(get_duration_with_ffprobe, supported, repeat)
+    differences = [
+        abs(native_durations[file] - ffprobe_durations[file]) for file in supported
+    ]
+
+    print(
+        json.dumps(
+            {
+                "files": len(files),
+                "unsupported_files": len(files) - len(supported),
+                "max_duration_difference_seconds": max(differences, default=0.0),
+                "results": {"native": native, "ffprobe": ffprobe},
+                "speedup": ffprobe["median_seconds_per_file"]
+                / native["median_seconds_per_file"],
+            },
+            indent=2,
+        )
+    )
+
+
+if __name__ == "__main__":
+    app()
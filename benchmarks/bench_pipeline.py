@@ -0,0 +1,115 @@
+"""
+Compare the exec-based download pipeline with the former shell pipeline.
+
+A dummy source writes a fixed number of bytes to stdout in small chunks, like
+streamlink does, and a dummy sink reads them from stdin, like ffmpeg does.
+Run with ``uv run python -m benchmarks.bench_pipeline``.
+"""
+
+import asyncio
+import json
+import resource
+import shlex
+import statistics
+import sys
+import time
+from typing import Annotated, Any, Callable, Coroutine
+
+import typer
+
+from radiko_timeshift_recorder.pipeline import DEFAULT_PIPE_SIZE, run_pipeline
+
+SOURCE_CODE = """
+import os
+chunk = memoryview(b"\\0" * {chunk_size})
+for _ in range({total_bytes} // {chunk_size}):
+    view = chunk
+    while view:
+        view = view[os.write(1, view):]
+"""
+
+SINK_CODE = """
+import os
+n = 0
+while data := os.read(0, {chunk_size}):
+    n += len(data)
+print(f"total_size={{n}}")
+"""
+
+app = typer.Typer()
+
+
+def _commands(
+    total_bytes: int, source_chunk_size: int, sink_chunk_size: int
+) -> tuple[list[str], list[str]]:
+    source = [
+        sys.executable,
+        "-c",
+        SOURCE_CODE.format(total_bytes=total_bytes, chunk_size=source_chunk_size),
+    ]
+    sink = [sys.executable, "-c", SINK_CODE.format(chunk_size=sink_chunk_size)]
+    return source, sink
+
+
+async def _run_shell(source: list[str], sink: list[str]) -> None:
+    proc = await asyncio.create_subprocess_shell(
+        f"{shlex.join(source)} | {shlex.join(sink)}",
+        stdout=asyncio.subprocess.DEVNULL,
+    )
+    if await proc.wait() != 0:
+        raise RuntimeError("Shell pipeline failed")
+
+
+def _measure(
+    run: Callable[[], Coroutine[Any, Any, None]], repeat: int
+) -> dict[str, float]:
+    seconds: list[float] = []
+    switches: list[int] = []
+    for _ in range(repeat):
+        before = resource.getrusage(resource.RUSAGE_CHILDREN)
+        start = time.perf_counter()
+        asyncio.run(run())
+        seconds.append(time.perf_counter() - start)
+        after = resource.getrusage(resource.RUSAGE_CHILDREN)
+        switches.append(
+            (after.ru_nvcsw + after.ru_nivcsw) - (before.ru_nvcsw + before.ru_nivcsw)
+        )
+
+    return {
+        "median_seconds": statistics.median(seconds),
+        "min_seconds": min(seconds),
+        "median_context_switches": statistics.median(switches),
+    }
+
+
+@app.command()
+def main(
+    total_mib: Annotated[int, typer.Option(min=1, help="MiB to push through")] = 256,
+    source_chunk_size: Annotated[int, typer.Option(min=1)] = 16 * 1024,
+    sink_chunk_size: Annotated[int, typer.Option(min=1)] = 32 * 1024,
+    pipe_size: Annotated[int, typer.Option(min=4096)] = DEFAULT_PIPE_SIZE,
+    repeat: Annotated[int, typer.Option(min=1)] = 5,
+):
+    total_bytes = total_mib * 1024 * 1024
+    source, sink = _commands(total_bytes, source_chunk_size, sink_chunk_size)
+
+    async def run_exec() -> None:
+        await run_pipeline(("source", source), ("sink", sink), pipe_size=pipe_size)
+
+    results = {
+        "shell": _measure(lambda: _run_shell(source, sink), repeat),
+        "exec": _measure(run_exec, repeat),
+    }
+    for result in results.values():
+        result["mib_per_second"] = total_mib / result["median_seconds"]
+
+    print(
+        json.dumps(
+            {"total_mib": total_mib, "pipe_size": pipe_size, "results": results},
+            indent=2,
+        )
+    )
+
+
+if __name__ == "__main__":
+    app()
@@ -0,0 +1,229 @@
+"""
+Load test of the job server with a stub ``process_job``.
+
+Runs ``server.app`` in a separate process with ``num_workers`` workers whose
+jobs either sleep or write a synthetic file, then puts thousands of jobs,
+including duplicates, with many concurrent ``POST /job_queue`` requests.
+Reports enqueue latency percentiles for accepted and duplicate (409) jobs and
+how fast the workers drain the queue.
+Run with ``uv run python -m benchmarks.bench_server_load``.
+"""
+
+import asyncio
+import datetime
+import json
+import multiprocessing
+import random
+import statistics
+import tempfile
+import time
+from pathlib import Path
+from typing import Annotated, Any, Optional
+from zoneinfo import ZoneInfo
+
+import httpx
+import typer
+import uvicorn
+from fastapi.encoders import jsonable_encoder
+from prometheus_client.parser import text_string_to_metric_families
+
+from benchmarks.servers import free_port, wait_for_port
+from radiko_timeshift_recorder.job import Job
+from radiko_timeshift_recorder.progress import DownloadProgress
+from radiko_timeshift_recorder.radiko import Program
+from radiko_timeshift_recorder.server import app as fastapi_app
+
+app = typer.Typer()
+
+
+def _serve(
+    port: int,
+    num_workers: int,
+    stub: str,
+    stub_seconds: float,
+    stub_bytes: int,
+    out_dir: str,
+) -> None:
+    async def process_job(job: Job, progress: DownloadProgress) -> None:
+        if stub == "sleep":
+            await asyncio.sleep(stub_seconds)
+            return
+
+        path = Path(out_dir) / f"{job.key}.mp4"
+        await asyncio.to_thread(path.write_bytes, b"\0" * stub_bytes)
+        progress.total_size = stub_bytes
+
+    fastapi_app.state.process_job = process_job
+    fastapi_app.state.num_workers = num_workers
+    uvicorn.run(fastapi_app, host="127.0.0.1", port=port, log_level="warning")
+
+
+def sample_jobs(count: int) -> list[Job]:
+    ft = datetime.datetime(2025, 1, 1, 5, 0, tzinfo=ZoneInfo("Asia/Tokyo"))
+    return [
+        Job(
+            program=Program(
+                id=str(i),
+                ft=ft + datetime.timedelta(minutes=i),
+                to=ft + datetime.timedelta(minutes=i + 30),
+                dur=1800,
+                title=f"Program {i}",
+                pfm="Performer",
+            ),
+            station_id=f"STATION{i % 50}",
+        )
+        for i in range(count)
+    ]
+
+
+def _percentiles(latencies: list[float]) -> dict[str, float]:
+    if len(latencies) < 2:
+        return {"max": max(latencies, default=0.0)}
+    quantiles = statistics.quantiles(latencies, n=100, method="inclusive")
+    return {
+        "p50": quantiles[49],
+        "p90": quantiles[89],
+        "p99": quantiles[98],
+        "max": max(latencies),
+        "mean": statistics.fmean(latencies),
+    }
+
+
+async def _queue_depth(client: httpx.AsyncClient) -> float:
+    response = await client.get("/metrics")
+    response.raise_for_status()
+    depth = 0.0
+    for family in text_string_to_metric_families(response.text):
+        if family.name in ("radiko_jobs_pending", "radiko_jobs_in_progress"):
+            depth += sum(sample.value for sample in family.samples)
+    return depth
+
+
+async def _run_load(
+    base_url: str,
+    jobs: list[Job],
+    concurrency: int,
+    drain_timeout: float,
+) -> dict[str, Any]:
+    latencies: dict[int, list[float]] = {}
+    errors: list[str] = []
+    semaphore = asyncio.Semaphore(concurrency)
+    limits = httpx.Limits(max_connections=concurrency)
+
+    async with httpx.AsyncClient(
+        base_url=base_url, limits=limits, timeout=30
+    ) as client:
+
+        async def put(job: Job) -> None:
+            body = jsonable_encoder(job)
+            async with semaphore:
+                start = time.perf_counter()
+                try:
+                    response = await client.post("/job_queue", json=body)
+                except httpx.HTTPError as e:
+                    errors.append(repr(e))
+                    return
+                latency = time.perf_counter() - start
+            latencies.setdefault(response.status_code, []).append(latency)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(put(job) for job in jobs))
+        enqueue_seconds = time.perf_counter() - start
+
+        drained = True
+        depth_after_enqueue = await _queue_depth(client)
+        while await _queue_depth(client) > 0:
+            if time.perf_counter() - start > enqueue_seconds + drain_timeout:
+                drained = False
+                break
+            await asyncio.sleep(0.1)
+        # From the first request until the workers have processed every job.
+        drain_seconds = time.perf_counter() - start
+
+    accepted = len(latencies.get(201, []))
+    return {
+        "requests": len(jobs),
+        "status_counts": {str(k): len(v) for k, v in sorted(latencies.items())},
+        "errors": len(errors),
+        "first_errors": errors[:5],
+        "enqueue_seconds": enqueue_seconds,
+        "requests_per_second": len(jobs) / enqueue_seconds,
+        "latency_seconds": {
+            str(status): _percentiles(sorted(values))
+            for status, values in sorted(latencies.items())
+        },
+        "queue_depth_after_enqueue": depth_after_enqueue,
+        "drained": drained,
+        "drain_seconds": drain_seconds,
+        "jobs_per_second": accepted / drain_seconds if drained else None,
+    }
+
+
+@app.command()
+def main(
+    num_jobs: Annotated[int, typer.Option(min=1)] = 5000,
+    duplicate_ratio: Annotated[
+        float,
+        typer.Option(min=0, help="Extra requests for already put jobs, per job"),
+    ] = 0.2,
+    concurrency: Annotated[int, typer.Option(min=1)] = 500,
+    num_workers: Annotated[int, typer.Option(min=1)] = 3,
+    stub: Annotated[str, typer.Option(help="sleep or write")] = "sleep",
+    stub_seconds: Annotated[float, typer.Option(min=0)] = 0.01,
+    stub_bytes: Annotated[int, typer.Option(min=0)] = 1024 * 1024,
+    drain_timeout: Annotated[float, typer.Option(min=0)] = 600.0,
+    seed: Annotated[int, typer.Option()] = 0,
+    output: Annotated[
+        Optional[Path],
+        typer.Option(dir_okay=False, help="Also write the results to this file"),
+    ] = None,
+):
+    if stub not in ("sleep", "write"):
+        raise typer.BadParameter("--stub must be sleep or write")
+
+    jobs = sample_jobs(num_jobs)
+    rng = random.Random(seed)
+    requests = jobs + rng.choices(jobs, k=int(num_jobs * duplicate_ratio))
+    rng.shuffle(requests)
+
+    port = free_port()
+    with tempfile.TemporaryDirectory() as out_dir:
+        server = multiprocessing.get_context("spawn").Process(
+            target=_serve,
+            args=(port, num_workers, stub, stub_seconds, stub_bytes, out_dir),
+            daemon=True,
+        )
+        server.start()
+        try:
+            wait_for_port(port)
+            results = asyncio.run(
+                _run_load(
+                    f"http://127.0.0.1:{port}", requests, concurrency, drain_timeout
+                )
+            )
+        finally:
+            server.terminate()
+            server.join()
+
+    text = json.dumps(
+        {
+            "config": {
+                "num_jobs": num_jobs,
+                "duplicate_ratio": duplicate_ratio,
+                "concurrency": concurrency,
+                "num_workers": num_workers,
+                "stub": stub,
+                "stub_seconds": stub_seconds,
+                "stub_bytes": stub_bytes,
+            },
+            "results": results,
+        },
+        indent=2,
+    )
+    print(text)
+    if output is not None:
+        output.write_text(text + "\n")
+
+
+if __name__ == "__main__":
+    app()
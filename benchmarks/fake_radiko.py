@@ -0,0 +1,335 @@
+"""
+Local stand-in for radiko, for benchmarking downloads without the network.
+
+Serves the area, schedule XML, auth and timeshift HLS endpoints used by the
+recorder and streamlink's radiko plugin, with synthetic silent AAC segments.
+Latency, bandwidth, segment errors and mid-segment stalls are configurable.
+
+Run with ``uv run python -m benchmarks.fake_radiko`` and point the recorder at
+it with ``--radiko-base-url http://127.0.0.1:8080`` or ``RADIKO_BASE_URL``.
+"""
+
+import asyncio
+import datetime
+import math
+import random
+from dataclasses import dataclass
+from typing import Annotated, AsyncIterator, Optional
+from urllib.parse import urlencode
+from xml.sax.saxutils import escape
+from zoneinfo import ZoneInfo
+
+import typer
+import uvicorn
+from fastapi import FastAPI, Header, HTTPException, Query, Request, Response
+from fastapi.responses import StreamingResponse
+
+AREA_ID = "JP13"
+AUTH_TOKEN = "fake-radiko-auth-token"
+
+SAMPLE_RATE = 48_000
+SAMPLES_PER_FRAME = 1024
+# raw_data_block of a silent AAC-LC stereo frame.
+_SILENT_AAC_FRAME = bytes([0x21, 0x10, 0x04, 0x60, 0x8C, 0x1C])
+_ADTS_HEADER_SIZE = 7
+_ADTS_SAMPLING_FREQUENCY_INDEX = {48_000: 3, 44_100: 4}
+
+_CHUNK_SIZE = 16 * 1024
+
+
+@dataclass(frozen=True)
+class FakeRadikoConfig:
+    num_stations: int = 10
+    program_minutes: int = 30
+    segment_seconds: float = 5.0
+    bitrate: int = 48_000
+    # Seconds to wait before answering any request.
+    latency: float = 0.0
+    # Bytes per second of each response body; unlimited if None.
+    bandwidth: Optional[int] = None
+    # Fraction of segment requests answered with 503.
+    segment_error_rate: float = 0.0
+    # Fraction of segment responses that pause halfway for stall_seconds.
+    segment_stall_rate: float = 0.0
+    stall_seconds: float = 30.0
+    seed: Optional[int] = None
+
+    def station_ids(self) -> list[str]:
+        return [f"FAKE{i}" for i in range(self.num_stations)]
+
+
+def adts_frame(bitrate: int) -> bytes:
+    """A silent ADTS frame, padded so that a stream of them has ``bitrate``."""
+    frame_length = max(
+        _ADTS_HEADER_SIZE + len(_SILENT_AAC_FRAME),
+        bitrate * SAMPLES_PER_FRAME // SAMPLE_RATE // 8,
+    )
+    profile = 1  # AAC LC
+    channel_config = 2
+    header = (
+        (0xFFF << 44)  # syncword
+        | (1 << 40)  # protection_absent
+        | (profile << 38)
+        | (_ADTS_SAMPLING_FREQUENCY_INDEX[SAMPLE_RATE] << 34)
+        | (channel_config << 30)
+        | (frame_length << 13)
+        | (0x7FF << 2)  # buffer fullness: variable bitrate
+    )
+    payload = _SILENT_AAC_FRAME.ljust(frame_length - _ADTS_HEADER_SIZE, b"\0")
+    return header.to_bytes(_ADTS_HEADER_SIZE, "big") + payload
+
+
+def frames_between(start: float, end: float) -> int:
+    """
+    Number of frames in ``[start, end)`` seconds since the epoch.
+
+    Counting from a fixed origin keeps the total duration of consecutive
+    segments exact however the segment boundaries fall.
+    """
+    frames_per_second = SAMPLE_RATE / SAMPLES_PER_FRAME
+    return math.floor(end * frames_per_second) - math.floor(start * frames_per_second)
+
+
+def _parse_timestamp(value: str) -> datetime.datetime:
+    return datetime.datetime.strptime(value.replace("_", ""), "%Y%m%d%H%M%S").replace(
+        tzinfo=ZoneInfo("Asia/Tokyo")
+    )
+
+
+def _format_timestamp(value: datetime.datetime) -> str:
+    return value.strftime("%Y%m%d%H%M%S")
+
+
+def schedule_xml(
+    config: FakeRadikoConfig, date: datetime.date, stations: list[str]
+) -> str:
+    """Programs of ``program_minutes`` each from 05:00 on ``date`` to 05:00 the next day."""
+    day_start = datetime.datetime.combine(
+        date, datetime.time(5), tzinfo=ZoneInfo("Asia/Tokyo")
+    )
+    program_length = datetime.timedelta(minutes=config.program_minutes)
+    num_programs = datetime.timedelta(days=1) // program_length
+
+    station_elements = []
+    for station_id in stations:
+        progs = []
+        for i in range(num_programs):
+            ft = day_start + i * program_length
+            to = ft + program_length
+            progs.append(
+                f'<prog id="{station_id}-{_format_timestamp(ft)}" master_id="" '
+                f'ft="{_format_timestamp(ft)}" to="{_format_timestamp(to)}" '
+                f'ftl="{ft:%H%M}" tol="{to:%H%M}" dur="{config.program_minutes * 60}">'
+                f"<title>{escape(f'Fake program {ft:%H:%M}')}</title>"
+                f"<pfm>{escape(f'Fake performer {i % 7}')}</pfm>"
+                "</prog>"
+            )
+        station_elements.append(
+            f'<station id="{station_id}"><name>{station_id}</name>'
+            f"<progs><date>{date:%Y%m%d}</date>{''.join(progs)}</progs></station>"
+        )
+
+    return (
+        '<?xml version="1.0" encoding="UTF-8"?>'
+        "<radiko><ttl>1800</ttl><srvtime>0</srvtime>"
+        f"<stations>{''.join(station_elements)}</stations></radiko>"
+    )
+
+
+def media_playlist(
+    config: FakeRadikoConfig,
+    station_id: str,
+    ft: datetime.datetime,
+    to: datetime.datetime,
+    seek: Optional[datetime.datetime] = None,
+) -> str:
+    start = ft.timestamp()
+    end = to.timestamp()
+    # Like radiko, from the segment holding the seek time.
+    skipped = 0
+    if seek is not None:
+        skipped = int(max(0.0, seek.timestamp() - start) // config.segment_seconds)
+        start = min(start + skipped * config.segment_seconds, end)
+    lines = [
+        "#EXTM3U",
+        "#EXT-X-VERSION:3",
+        f"#EXT-X-TARGETDURATION:{math.ceil(config.segment_seconds)}",
+        f"#EXT-X-MEDIA-SEQUENCE:{skipped}",
+        "#EXT-X-PLAYLIST-TYPE:VOD",
+    ]
+    while start < end:
+        duration = min(config.segment_seconds, end - start)
+        segment_start = datetime.datetime.fromtimestamp(start, ZoneInfo("Asia/Tokyo"))
+        lines += [
+            f"#EXT-X-PROGRAM-DATE-TIME:{segment_start.isoformat(timespec='milliseconds')}",
+            f"#EXTINF:{duration:.3f},",
+            f"/tf/segments/{station_id}/{segment_start:%Y%m%d_%H%M%S}.aac"
+            f"?{urlencode({'start': start, 'duration': duration})}",
+        ]
+        start += duration
+    lines.append("#EXT-X-ENDLIST")
+    return "\n".join(lines) + "\n"
+
+
+def create_app(config: FakeRadikoConfig) -> FastAPI:
+    app = FastAPI()
+    rng = random.Random(config.seed)
+    frame = adts_frame(config.bitrate)
+
+    def check_token(token: Optional[str]) -> None:
+        if token != AUTH_TOKEN:
+            raise HTTPException(status_code=403, detail="Invalid auth token")
+
+    async def throttled(body: bytes, stall: bool) -> AsyncIterator[bytes]:
+        halves = [body[: len(body) // 2], body[len(body) // 2 :]]
+        for i, part in enumerate(halves if stall else [body]):
+            if i > 0:
+                await asyncio.sleep(config.stall_seconds)
+            for offset in range(0, len(part), _CHUNK_SIZE):
+                chunk = part[offset : offset + _CHUNK_SIZE]
+                yield chunk
+                if config.bandwidth is not None:
+                    await asyncio.sleep(len(chunk) / config.bandwidth)
+
+    @app.middleware("http")
+    async def add_latency(request: Request, call_next):
+        if config.latency > 0:
+            await asyncio.sleep(config.latency)
+        return await call_next(request)
+
+    @app.get("/area")
+    async def area() -> Response:
+        return Response(
+            f"document.write('<span class=\"{AREA_ID}\">TOKYO JAPAN</span>');",
+            media_type="application/javascript",
+        )
+
+    @app.get("/v2/api/auth1")
+    async def auth1() -> Response:
+        return Response(
+            "please send a part of key",
+            headers={
+                "X-Radiko-AuthToken": AUTH_TOKEN,
+                "X-Radiko-KeyOffset": "0",
+                "X-Radiko-KeyLength": "16",
+            },
+        )
+
+    @app.get("/v2/api/auth2")
+    async def auth2(
+        token: Optional[str] = Header(default=None, alias="X-Radiko-AuthToken")
+    ) -> Response:
+        check_token(token)
+        return Response(f"{AREA_ID},TOKYO,tokyo Japan")
+
+    @app.get("/v3/program/date/{date}/{area_id}.xml")
+    async def program_by_date(date: str, area_id: str) -> Response:
+        parsed_date = datetime.datetime.strptime(date, "%Y%m%d").date()
+        return Response(
+            schedule_xml(config, parsed_date, config.station_ids()),
+            media_type="application/xml",
+        )
+
+    @app.get("/v3/program/station/date/{date}/{station_id}.xml")
+    async def program_by_station(date: str, station_id: str) -> Response:
+        parsed_date = datetime.datetime.strptime(date, "%Y%m%d").date()
+        return Response(
+            schedule_xml(config, parsed_date, [station_id]),
+            media_type="application/xml",
+        )
+
+    @app.get("/tf/playlist.m3u8")
+    async def playlist(
+        request: Request,
+        token: Optional[str] = Header(default=None, alias="X-Radiko-AuthToken"),
+    ) -> Response:
+        check_token(token)
+        bandwidth = config.bitrate
+        return Response(
+            "#EXTM3U\n"
+            f'#EXT-X-STREAM-INF:BANDWIDTH={bandwidth},CODECS="mp4a.40.2"\n'
+            f"/tf/media.m3u8?{request.url.query}\n",
+            media_type="application/vnd.apple.mpegurl",
+        )
+
+    @app.get("/tf/media.m3u8")
+    async def media(
+        station_id: str,
+        ft: str,
+        to: str,
+        seek: Optional[str] = None,
+        token: Optional[str] = Header(default=None, alias="X-Radiko-AuthToken"),
+    ) -> Response:
+        check_token(token)
+        return Response(
+            media_playlist(
+                config,
+                station_id,
+                _parse_timestamp(ft),
+                _parse_timestamp(to),
+                _parse_timestamp(seek) if seek is not None else None,
+            ),
+            media_type="application/vnd.apple.mpegurl",
+        )
+
+    @app.get("/tf/segments/{station_id}/{timestamp}.aac")
+    async def segment(
+        station_id: str,
+        timestamp: str,
+        start: float = Query(),
+        duration: float = Query(gt=0),
+    ) -> Response:
+        if rng.random() < config.segment_error_rate:
+            raise HTTPException(status_code=503, detail="Injected segment error")
+
+        body = frame * frames_between(start, start + duration)
+        stall = rng.random() < config.segment_stall_rate
+        if config.bandwidth is None and not stall:
+            return Response(body, media_type="audio/aac")
+        return StreamingResponse(
+            throttled(body, stall),
+            media_type="audio/aac",
+            headers={"Content-Length": str(len(body))},
+        )
+
+    return app
+
+
+cli = typer.Typer()
+
+
+@cli.command()
+def main(
+    host: Annotated[str, typer.Option()] = "127.0.0.1",
+    port: Annotated[int, typer.Option()] = 8080,
+    num_stations: Annotated[int, typer.Option(min=1)] = 10,
+    program_minutes: Annotated[int, typer.Option(min=1, max=1440)] = 30,
+    # Segments are cached by their start time in whole seconds.
+    segment_seconds: Annotated[float, typer.Option(min=1)] = 5.0,
+    bitrate: Annotated[int, typer.Option(min=1)] = 48_000,
+    latency: Annotated[float, typer.Option(min=0)] = 0.0,
+    bandwidth: Annotated[
+        Optional[int], typer.Option(min=1, help="Bytes per second per response")
+    ] = None,
+    segment_error_rate: Annotated[float, typer.Option(min=0, max=1)] = 0.0,
+    segment_stall_rate: Annotated[float, typer.Option(min=0, max=1)] = 0.0,
+    stall_seconds: Annotated[float, typer.Option(min=0)] = 30.0,
+    seed: Annotated[Optional[int], typer.Option()] = None,
+):
+    config = FakeRadikoConfig(
+        num_stations=num_stations,
+        program_minutes=program_minutes,
+        segment_seconds=segment_seconds,
+        bitrate=bitrate,
+        latency=latency,
+        bandwidth=bandwidth,
+        segment_error_rate=segment_error_rate,
+        segment_stall_rate=segment_stall_rate,
+        stall_seconds=stall_seconds,
+        seed=seed,
+    )
+    uvicorn.run(create_app(config), host=host, port=port)
+
+
+if __name__ == "__main__":
+    cli()
@@ -1,9 +1,14 @@
-from typing import Annotated
+import cProfile
+import os
+from pathlib import Path
+from typing import Annotated, Optional
 
 import logzero
 import typer
 from logzero import logger
 
+from radiko_timeshift_recorder import tracing
+from radiko_timeshift_recorder.commands.fetch_stream import app as fetch_stream_app
 from radiko_timeshift_recorder.commands.gen_json_schema_for_rules import (
     app as gen_json_schema_for_rules_app,
 )
@@ -14,12 +19,15 @@ from radiko_timeshift_recorder.commands.put_jobs_from_schedule_by_rules import (
     app as put_jobs_from_schedule_by_rules_app,
 )
 from radiko_timeshift_recorder.commands.run_server import app as run_server_app
+from radiko_timeshift_recorder.commands.verify_library import app as verify_library_app
+from radiko_timeshift_recorder.radiko import RADIKO_BASE_URL_ENV
 
 app = typer.Typer()
 
 
 @app.callback()
 def main(
+    ctx: typer.Context,
     log_json: Annotated[
         bool,
         typer.Option(
@@ -27,16 +35,68 @@ def main(
             is_flag=True,
         ),
     ] = False,
+    trace_file: Annotated[
+        Optional[Path],
+        typer.Option(
+            dir_okay=False,
+            help=(
+                "Append spans of each stage (queue wait, download, validation, "
+                "schedule fetch, ...) to this file as OTLP/JSON lines."
+            ),
+        ),
+    ] = None,
+    radiko_base_url: Annotated[
+        Optional[str],
+        typer.Option(
+            envvar=RADIKO_BASE_URL_ENV,
+            help=(
+                "Base URL of the radiko API and streams, e.g. of a local stand-in "
+                "for benchmarks. Default: https://radiko.jp."
+            ),
+        ),
+    ] = None,
+    profile: Annotated[
+        Optional[Path],
+        typer.Option(
+            dir_okay=False,
+            help=(
+                "Profile the command with cProfile and write the stats to this "
+                "file on exit, for pstats or snakeviz."
+            ),
+        ),
+    ] = None,
 ) -> None:
     if log_json:
         logzero.json(enable=True)
         logger.info("JSON logging enabled.")
 
+    if radiko_base_url is not None:
+        # Set for child processes such as fetch-stream as well.
+        os.environ[RADIKO_BASE_URL_ENV] = radiko_base_url
+        logger.info(f"Using radiko at {radiko_base_url}.")
+
+    if trace_file is not None:
+        tracing.configure(trace_file)
+        logger.info(f"Tracing to {trace_file}.")
+
+    if profile is not None:
+        profiler = cProfile.Profile()
+
+        def dump_profile() -> None:
+            profiler.disable()
+            profiler.dump_stats(profile)
+            logger.info(f"Wrote profile to {profile}.")
+
+        ctx.call_on_close(dump_profile)
+        profiler.enable()
+
 
+app.add_typer(fetch_stream_app)
 app.add_typer(gen_json_schema_for_rules_app)
 app.add_typer(put_job_from_url_app)
 app.add_typer(put_jobs_from_schedule_by_rules_app)
 app.add_typer(run_server_app)
+app.add_typer(verify_library_app)
 
 if __name__ == "__main__":
     app()
@@ -0,0 +1,97 @@
+"""Admission of jobs to workers by the free space of the volumes they write to."""
+
+import asyncio
+import shutil
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Iterator, Optional, Sequence
+
+from logzero import logger
+
+from radiko_timeshift_recorder import metrics
+from radiko_timeshift_recorder.job import Job
+
+DEFAULT_MIN_FREE_BYTES = 1024**3
+# Bytes per second of a recording before any has been observed. radiko streams
+# AAC at 48 kbps; this leaves room for the MP4 container.
+DEFAULT_BYTE_RATE = 8_000
+# Recordings are estimated this much larger than the observed byte rate.
+ESTIMATE_MARGIN = 1.2
+# Weight of the latest recording in the observed byte rate.
+BYTE_RATE_SMOOTHING = 0.2
+# Free space also changes outside the server, so waiting workers recheck it.
+POLL_INTERVAL = 30.0
+
+
+class DiskSpaceAdmission:
+    """
+    Reserves an estimate of each job's size on ``paths`` before it is started.
+
+    Workers wait in ``wait_for_space`` before taking a job, and start a job
+    they take only if the free space of all of ``paths``, minus the
+    reservations of running jobs and the estimate of the job, is at least
+    ``min_free_bytes``. Otherwise they give it back to the queue.
+    """
+
+    def __init__(
+        self,
+        paths: Sequence[Path],
+        min_free_bytes: int = DEFAULT_MIN_FREE_BYTES,
+        byte_rate: float = DEFAULT_BYTE_RATE,
+        poll_interval: float = POLL_INTERVAL,
+    ) -> None:
+        self.paths = list(paths)
+        self.min_free_bytes = min_free_bytes
+        self.byte_rate = byte_rate
+        self.poll_interval = poll_interval
+        self.reserved: dict[Job, int] = {}
+        self._released = asyncio.Event()
+
+    def estimate_bytes(self, job: Job) -> int:
+        return int(job.program.dur * self.byte_rate * ESTIMATE_MARGIN)
+
+    def available_bytes(self) -> int:
+        """Free space left on the fullest of ``paths`` after all reservations."""
+        free = min(shutil.disk_usage(path).free for path in self.paths)
+        return free - sum(self.reserved.values())
+
+    def has_space(self, job: Optional[Job] = None) -> bool:
+        needed = self.estimate_bytes(job) if job is not None else 0
+        return self.available_bytes() - needed >= self.min_free_bytes
+
+    async def wait_for_space(self, job: Optional[Job] = None) -> None:
+        if self.has_space(job):
+            return
+
+        logger.warning(
+            f"Less than {self.min_free_bytes} bytes free on {self.paths}; "
+            "waiting before starting more jobs"
+        )
+        started_at = time.monotonic()
+        while not self.has_space(job):
+            self._released.clear()
+            try:
+                await asyncio.wait_for(self._released.wait(), self.poll_interval)
+            except TimeoutError:
+                pass
+        metrics.ADMISSION_WAIT_SECONDS.observe(time.monotonic() - started_at)
+
+    @contextmanager
+    def reserve(self, job: Job) -> Iterator[None]:
+        self.reserved[job] = self.estimate_bytes(job)
+        metrics.DISK_RESERVED_BYTES.set(sum(self.reserved.values()))
+        try:
+            yield
+        finally:
+            del self.reserved[job]
+            metrics.DISK_RESERVED_BYTES.set(sum(self.reserved.values()))
+            self._released.set()
+
+    def observe(self, job: Job, size: int) -> None:
+        """Update the byte rate used for estimates from a finished recording."""
+        if size <= 0 or job.program.dur <= 0:
+            return
+        self.byte_rate += BYTE_RATE_SMOOTHING * (
+            size / job.program.dur - self.byte_rate
+        )
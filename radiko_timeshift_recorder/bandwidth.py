@@ -0,0 +1,194 @@
+"""Limits on the bytes per second that downloads stream, which may change by the time of day."""
+
+import datetime
+import re
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Awaitable, Callable, Iterator, Optional, Sequence
+from zoneinfo import ZoneInfo
+
+from logzero import logger
+from pydantic import BaseModel
+
+from radiko_timeshift_recorder.upstream import TokenBucket
+
+# Buckets hold this many seconds of their rate, so that the chunks streamed
+# between two throttle calls pass without waiting.
+BURST_SECONDS = 0.5
+# The reported rate is averaged over this many seconds.
+RATE_WINDOW_SECONDS = 10.0
+
+_WINDOW_PATTERN = re.compile(
+    r"(?P<start>\d{1,2}:\d{2})-(?P<end>\d{1,2}:\d{2})=(?P<limit>\d+|unlimited)"
+)
+
+Throttle = Callable[[int], Awaitable[None]]
+
+
+class BandwidthWindow(BaseModel):
+    """A daily time window, in Japan time, with its own total limit."""
+
+    start: datetime.time
+    end: datetime.time
+    # Bytes per second, or None for unlimited.
+    limit: Optional[int]
+
+    def contains(self, t: datetime.time) -> bool:
+        if self.start == self.end:
+            # The whole day, e.g. 00:00-24:00.
+            return True
+        if self.start < self.end:
+            return self.start <= t < self.end
+        # The window spans midnight, e.g. 22:00-06:00.
+        return t >= self.start or t < self.end
+
+
+def _parse_time(value: str) -> datetime.time:
+    hour, minute = (int(part) for part in value.split(":"))
+    # 24:00 ends a window at midnight.
+    return (
+        datetime.time(0, 0)
+        if (hour, minute) == (24, 0)
+        else datetime.time(hour, minute)
+    )
+
+
+def parse_bandwidth_window(value: str) -> BandwidthWindow:
+    """
+    Parse ``HH:MM-HH:MM=LIMIT``, where ``LIMIT`` is bytes per second or
+    ``unlimited``, e.g. ``09:00-18:00=500000`` or ``22:00-06:00=unlimited``.
+    """
+    match = _WINDOW_PATTERN.fullmatch(value.strip())
+    if match is None:
+        raise ValueError(
+            f"Invalid bandwidth window {value!r}; expected HH:MM-HH:MM=BYTES or "
+            "HH:MM-HH:MM=unlimited"
+        )
+    limit = match["limit"]
+    return BandwidthWindow(
+        start=_parse_time(match["start"]),
+        end=_parse_time(match["end"]),
+        limit=None if limit == "unlimited" else int(limit),
+    )
+
+
+class BandwidthStatus(BaseModel):
+    # Bytes per second; None for unlimited.
+    limit: Optional[int]
+    job_limit: Optional[int]
+    bytes_per_second: float
+    streams: int
+
+
+class BandwidthShaper:
+    """
+    Limits the bytes per second of each download and of all of them together.
+
+    The total limit is that of the first window of ``schedule`` containing the
+    current time, or ``limit`` outside all of them. Downloads call the throttle
+    of ``stream()`` with the size of each chunk before passing it on. Without
+    a per-job limit or a current total limit there is no throttle, and
+    downloads pipe their stream directly; those started in an unlimited
+    window stay unlimited until they finish.
+    """
+
+    def __init__(
+        self,
+        *,
+        limit: Optional[int] = None,
+        job_limit: Optional[int] = None,
+        schedule: Sequence[BandwidthWindow] = (),
+    ) -> None:
+        self.default_limit = limit
+        self.job_limit = job_limit
+        self.schedule = list(schedule)
+        self.limit: Optional[int] = None
+        self.streams = 0
+        self._bucket: Optional[TokenBucket] = None
+        # (time.monotonic(), bytes) of recent chunks.
+        self._chunks: deque[tuple[float, int]] = deque()
+        self._update_limit()
+
+    def limit_at(self, now: datetime.datetime) -> Optional[int]:
+        t = now.astimezone(ZoneInfo("Asia/Tokyo")).time()
+        for window in self.schedule:
+            if window.contains(t):
+                return window.limit
+        return self.default_limit
+
+    def current_limit(self) -> Optional[int]:
+        """The total limit now, in bytes per second, or None for unlimited."""
+        self._update_limit()
+        return self.limit
+
+    def _update_limit(self) -> None:
+        limit = self.limit_at(datetime.datetime.now(ZoneInfo("Asia/Tokyo")))
+        if limit == self.limit:
+            return
+
+        logger.info(
+            "Download bandwidth limit set to "
+            + (f"{limit} bytes per second" if limit is not None else "unlimited")
+        )
+        self.limit = limit
+        if limit is None:
+            self._bucket = None
+        elif self._bucket is None:
+            self._bucket = TokenBucket(limit, burst=limit * BURST_SECONDS)
+        else:
+            self._bucket.set_max_rate(limit, burst=limit * BURST_SECONDS)
+
+    def _record(self, size: int) -> None:
+        now = time.monotonic()
+        self._chunks.append((now, size))
+        while self._chunks and self._chunks[0][0] < now - RATE_WINDOW_SECONDS:
+            self._chunks.popleft()
+
+    def bytes_per_second(self) -> float:
+        cutoff = time.monotonic() - RATE_WINDOW_SECONDS
+        return sum(size for at, size in self._chunks if at >= cutoff) / (
+            RATE_WINDOW_SECONDS
+        )
+
+    @contextmanager
+    def stream(self) -> Iterator[Optional[Throttle]]:
+        """
+        Make a throttle for one download, counted while it streams, or None
+        if nothing limits it now.
+        """
+        if self.job_limit is None and self.current_limit() is None:
+            self.streams += 1
+            try:
+                yield None
+            finally:
+                self.streams -= 1
+            return
+
+        job_bucket = (
+            TokenBucket(self.job_limit, burst=self.job_limit * BURST_SECONDS)
+            if self.job_limit is not None
+            else None
+        )
+
+        async def throttle(size: int) -> None:
+            if job_bucket is not None:
+                await job_bucket.acquire(size)
+            self._update_limit()
+            if self._bucket is not None:
+                await self._bucket.acquire(size)
+            self._record(size)
+
+        self.streams += 1
+        try:
+            yield throttle
+        finally:
+            self.streams -= 1
+
+    def status(self) -> BandwidthStatus:
+        return BandwidthStatus(
+            limit=self.current_limit(),
+            job_limit=self.job_limit,
+            bytes_per_second=self.bytes_per_second(),
+            streams=self.streams,
+        )
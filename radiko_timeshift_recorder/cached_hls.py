@@ -0,0 +1,93 @@
+"""Streamlink HLS reader that serves segments from a ``SegmentCache``."""
+
+import re
+from typing import Optional
+from zoneinfo import ZoneInfo
+
+from logzero import logger
+from requests import Response
+from streamlink.exceptions import StreamError
+from streamlink.stream.hls import HLSStream, HLSStreamReader, HLSStreamWriter
+from streamlink.stream.hls.segment import HLSSegment
+
+from radiko_timeshift_recorder.radiko import StationId
+from radiko_timeshift_recorder.segment_cache import (
+    SegmentCache,
+    SegmentTimestamp,
+    segment_timestamp_from_uri,
+)
+
+_STATION_ID_PATTERN = re.compile(r"radiko\.jp/(?:#!/)?(?:live|ts)/([a-zA-Z0-9-]+)")
+
+
+def station_id_from_url(url: str) -> StationId:
+    match = _STATION_ID_PATTERN.search(url)
+    if not match:
+        raise ValueError(f"Failed to parse station ID from URL: {url}")
+    return StationId(match.group(1).upper())
+
+
+def segment_timestamp(segment: HLSSegment) -> Optional[SegmentTimestamp]:
+    if segment.date is not None:
+        return SegmentTimestamp(
+            segment.date.astimezone(ZoneInfo("Asia/Tokyo")).strftime("%Y%m%d%H%M%S")
+        )
+    return segment_timestamp_from_uri(segment.uri)
+
+
+def _cached_response(data: bytes) -> Response:
+    response = Response()
+    response.status_code = 200
+    response._content = data
+    response._content_consumed = True  # type: ignore[attr-defined]
+    return response
+
+
+class CachingHLSStreamWriter(HLSStreamWriter):
+    reader: "CachingHLSStreamReader"
+
+    def fetch(self, segment: HLSSegment) -> Optional[Response]:
+        # Encrypted segments depend on per-session keys, so only plaintext
+        # segments with a known timestamp can be shared.
+        timestamp = segment_timestamp(segment)
+        if timestamp is None or (segment.key and segment.key.method != "NONE"):
+            return super().fetch(segment)
+
+        cache = self.reader.segment_cache
+        station_id = self.reader.station_id
+
+        cached = cache.get(station_id, timestamp)
+        if cached is not None:
+            logger.debug(f"Segment cache hit: {station_id} {timestamp}")
+            return _cached_response(cached)
+
+        try:
+            response = self._fetch(
+                segment.uri,
+                stream=False,
+                **self.create_request_params(segment.num, segment, False),
+            )
+        except StreamError as e:
+            logger.error(f"Failed to fetch segment {segment.num}: {e}")
+            return None
+
+        if response is not None:
+            cache.put(station_id, timestamp, response.content)
+
+        return response
+
+
+class CachingHLSStreamReader(HLSStreamReader):
+    __writer__ = CachingHLSStreamWriter
+
+    def __init__(
+        self,
+        stream: HLSStream,
+        segment_cache: SegmentCache,
+        station_id: StationId,
+        name: Optional[str] = None,
+    ) -> None:
+        # The writer is created in the base initializer and reads these.
+        self.segment_cache = segment_cache
+        self.station_id = station_id
+        super().__init__(stream, name=name)
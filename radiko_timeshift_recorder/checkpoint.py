@@ -0,0 +1,44 @@
+"""Jobs left unfinished at shutdown, saved to be put again on the next start."""
+
+import os
+import tempfile
+from pathlib import Path
+from typing import Iterable
+
+from logzero import logger
+from pydantic import ValidationError
+
+from radiko_timeshift_recorder.job import Job
+
+
+def save_checkpoint(path: Path, jobs: Iterable[Job]) -> int:
+    """Atomically replace ``path`` with ``jobs``, one JSON per line."""
+    count = 0
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with tempfile.NamedTemporaryFile(
+        mode="w",
+        encoding="utf-8",
+        dir=path.parent,
+        prefix=f".{path.name}.",
+        delete=False,
+    ) as f:
+        for job in jobs:
+            f.write(job.model_dump_json() + "\n")
+            count += 1
+    os.replace(f.name, path)
+    return count
+
+
+def load_checkpoint(path: Path) -> list[Job]:
+    """Jobs saved at ``path``, or none if there is no checkpoint."""
+    if not path.exists():
+        return []
+
+    jobs = []
+    with path.open(encoding="utf-8") as f:
+        for line_number, line in enumerate(f, start=1):
+            try:
+                jobs.append(Job.model_validate_json(line))
+            except ValidationError:
+                logger.warning(f"Skipping invalid line {line_number} of {path}")
+    return jobs
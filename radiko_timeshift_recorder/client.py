@@ -1,7 +1,11 @@
+from typing import Optional
+
 import requests
 from fastapi.encoders import jsonable_encoder
 
 from radiko_timeshift_recorder.job import Job
+from radiko_timeshift_recorder.job_queue import Priority
+from radiko_timeshift_recorder.library import LibraryEntry
 
 
 class Client:
@@ -17,14 +21,39 @@ class Client:
         if self.session:
             self.session.close()
 
-    def put_job(self, job: Job):
+    def put_job(self, job: Job, priority: Priority = Priority.RULES):
         if not self.session:
             raise RuntimeError("Session not initialized. Use 'with' statement.")
 
         response = self.session.post(
             url=f"{self.base_url}/job_queue",
             headers={"Content-Type": "application/json"},
+            params={"priority": priority.value},
             json=jsonable_encoder(job),
         )
 
         response.raise_for_status()
+
+    def get_library_keys(self) -> Optional[set[str]]:
+        """Keys of the recorded jobs, or ``None`` if the server has no library index."""
+        if not self.session:
+            raise RuntimeError("Session not initialized. Use 'with' statement.")
+
+        response = self.session.get(url=f"{self.base_url}/library")
+        if response.status_code == 404:
+            return None
+
+        response.raise_for_status()
+        return {LibraryEntry.model_validate(entry).key for entry in response.json()}
+
+    def rebuild_library(self) -> Optional[int]:
+        """Rescan the server's output directory, or ``None`` if it has no library index."""
+        if not self.session:
+            raise RuntimeError("Session not initialized. Use 'with' statement.")
+
+        response = self.session.post(url=f"{self.base_url}/library/rebuild")
+        if response.status_code == 404:
+            return None
+
+        response.raise_for_status()
+        return response.json()["entries"]
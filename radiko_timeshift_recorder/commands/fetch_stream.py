@@ -0,0 +1,84 @@
+import sys
+from contextlib import closing
+from pathlib import Path
+from typing import Annotated, Optional
+
+import typer
+from logzero import logger
+from streamlink import Streamlink
+from streamlink.stream.hls import HLSStream
+from streamlink.stream.stream import StreamIO
+
+from radiko_timeshift_recorder.cached_hls import (
+    CachingHLSStreamReader,
+    station_id_from_url,
+)
+from radiko_timeshift_recorder.radiko import mount_radiko_base_url
+from radiko_timeshift_recorder.segment_cache import DEFAULT_MAX_BYTES, SegmentCache
+from radiko_timeshift_recorder.timefree import SeekingRadiko
+
+app = typer.Typer()
+
+_READ_CHUNK_SIZE = 64 * 1024
+
+
+@app.command(hidden=True)
+def fetch_stream(
+    url: Annotated[str, typer.Argument(help="URL of the program to fetch")],
+    segment_cache_dir: Annotated[
+        Optional[Path],
+        typer.Option(
+            file_okay=False,
+            dir_okay=True,
+            help="Directory of the HLS segment cache shared between downloads",
+        ),
+    ] = None,
+    segment_cache_max_bytes: Annotated[
+        int,
+        typer.Option(min=1, help="Maximum total size of the segment cache in bytes"),
+    ] = DEFAULT_MAX_BYTES,
+    start_offset: Annotated[
+        float,
+        typer.Option(min=0, help="Seconds after the beginning of the program to start"),
+    ] = 0,
+):
+    """Write the best stream of URL to stdout, like `streamlink URL best --stdout`."""
+    try:
+        session = Streamlink()
+        mount_radiko_base_url(session.http)
+        streams = (
+            SeekingRadiko(session, url, start_offset).streams()
+            if start_offset
+            else session.streams(url)
+        )
+        if "best" not in streams:
+            logger.error(f"No playable streams found for URL: {url}")
+            raise typer.Exit(1)
+
+        stream = streams["best"]
+        segment_cache: Optional[SegmentCache] = None
+        reader: StreamIO
+        if segment_cache_dir is not None and isinstance(stream, HLSStream):
+            segment_cache = SegmentCache(segment_cache_dir, segment_cache_max_bytes)
+            reader = CachingHLSStreamReader(
+                stream,
+                segment_cache=segment_cache,
+                station_id=station_id_from_url(url),
+            )
+            reader.open()
+        else:
+            reader = stream.open()
+
+        with closing(reader):
+            out = sys.stdout.buffer
+            while chunk := reader.read(_READ_CHUNK_SIZE):
+                out.write(chunk)
+            out.flush()
+
+        if segment_cache is not None:
+            segment_cache.evict()
+    except typer.Exit:
+        raise
+    except Exception:
+        logger.exception(f"Failed to fetch stream: {url}")
+        raise typer.Exit(1)
@@ -6,6 +6,7 @@ from requests import HTTPError
 
 from radiko_timeshift_recorder.client import Client
 from radiko_timeshift_recorder.job import fetch_job_by_url
+from radiko_timeshift_recorder.job_queue import Priority
 
 app = typer.Typer()
 
@@ -27,7 +28,8 @@ def put_job_from_url(
 
         with Client(server_url) as client:
             try:
-                client.put_job(job)
+                # Someone is waiting for this one, so it goes ahead of bulk jobs.
+                client.put_job(job, Priority.INTERACTIVE)
             except HTTPError as e:
                 if e.response.status_code == 409:
                     logger.info(f"Job already exists: {job}")
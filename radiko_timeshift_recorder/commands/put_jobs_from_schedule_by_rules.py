@@ -5,8 +5,10 @@ import typer
 from logzero import logger
 from requests import HTTPError
 
+from radiko_timeshift_recorder import tracing
 from radiko_timeshift_recorder.client import Client
 from radiko_timeshift_recorder.job import Job, fetch_all_jobs
+from radiko_timeshift_recorder.job_queue import Priority
 from radiko_timeshift_recorder.rules import Rules
 
 app = typer.Typer()
@@ -28,6 +30,15 @@ def put_jobs_from_schedule_by_rules(
         str,
         typer.Option(help="URL of the server"),
     ] = "http://localhost:8000",
+    priority: Annotated[
+        Priority,
+        typer.Option(
+            help=(
+                "Lane of the job queue to put jobs in, e.g. backfill for a one-off "
+                "run over old schedules that should not hold up regular runs"
+            ),
+        ),
+    ] = Priority.RULES,
 ):
     try:
         try:
@@ -37,18 +48,21 @@ def put_jobs_from_schedule_by_rules(
             raise typer.Exit(1)
 
         try:
-            jobs = fetch_all_jobs()
+            with tracing.span("fetch_all_jobs"):
+                jobs = list(fetch_all_jobs())
         except Exception:
             logger.exception(f"Failed to fetch jobs from schedule: {rules_yaml_paths}")
             raise typer.Exit(1)
 
         try:
-            jobs_to_record = [
-                job
-                for job in sorted(jobs)
-                if job.is_ready_to_process
-                and rules.to_record(station_id=job.station_id, program=job.program)
-            ]
+            with tracing.span("match_rules") as span:
+                jobs_to_record = [
+                    job
+                    for job in sorted(jobs)
+                    if job.is_ready_to_process
+                    and rules.to_record(station_id=job.station_id, program=job.program)
+                ]
+                span.set_attribute("jobs_to_record", len(jobs_to_record))
         except Exception:
             logger.exception(f"Failed to filter jobs by rules: {rules_yaml_paths}")
             raise typer.Exit(1)
@@ -56,14 +70,36 @@ def put_jobs_from_schedule_by_rules(
         jobs_succeed: list[Job] = []
         jobs_already_exist: list[Job] = []
         jobs_failed: list[Job] = []
+        jobs_recorded: list[Job] = []
+        jobs_deferred: list[Job] = []
         with Client(server_url) as client:
-            for job in jobs_to_record:
+            try:
+                recorded_keys = client.get_library_keys()
+            except Exception:
+                # Not fatal: the server still skips recorded jobs on its own.
+                logger.exception("Failed to get the library of recorded jobs")
+                recorded_keys = None
+
+            for i, job in enumerate(jobs_to_record):
+                if recorded_keys is not None and job.key in recorded_keys:
+                    logger.debug(f"Job already recorded: {job}")
+                    jobs_recorded.append(job)
+                    continue
+
                 try:
-                    client.put_job(job)
+                    client.put_job(job, priority)
                 except HTTPError as e:
                     if e.response.status_code == 409:
                         logger.debug(f"Job already exists: {job}")
                         jobs_already_exist.append(job)
+                    elif e.response.status_code == 429:
+                        # The rest are put by a later run once the queue drains.
+                        jobs_deferred = jobs_to_record[i:]
+                        logger.warning(
+                            "Job queue is full, retry after "
+                            f"{e.response.headers.get('Retry-After')} seconds"
+                        )
+                        break
                     else:
                         logger.exception(f"Failed to put job: {job}")
                         jobs_failed.append(job)
@@ -79,11 +115,21 @@ def put_jobs_from_schedule_by_rules(
         if jobs_succeed:
             logger.info(f"Successfully put {len(jobs_succeed)} jobs.")
 
+        if jobs_recorded:
+            logger.info(
+                f"Skipped {len(jobs_recorded)} jobs because they are already recorded."
+            )
+
         if jobs_already_exist:
             logger.info(
                 f"Skipped {len(jobs_already_exist)} jobs because they already exist."
             )
 
+        if jobs_deferred:
+            logger.warning(
+                f"Deferred {len(jobs_deferred)} jobs because the job queue is full."
+            )
+
         if jobs_failed:
             logger.error(f"Failed to put {len(jobs_failed)} jobs.")
             raise typer.Exit(1)
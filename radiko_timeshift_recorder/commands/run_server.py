@@ -1,13 +1,45 @@
 from pathlib import Path
-from typing import Annotated
+from typing import Annotated, Optional
 
 import typer
 import uvicorn
 from logzero import logger
 
+from radiko_timeshift_recorder.admission import (
+    DEFAULT_MIN_FREE_BYTES,
+    DiskSpaceAdmission,
+)
+from radiko_timeshift_recorder.bandwidth import (
+    BandwidthShaper,
+    BandwidthWindow,
+    parse_bandwidth_window,
+)
 from radiko_timeshift_recorder.download import DEFAULT_OUTPUT_FILE_MODE, download
 from radiko_timeshift_recorder.fs_unix import parse_unix_mode_string
+from radiko_timeshift_recorder.job import Job
+from radiko_timeshift_recorder.job_queue import JobQueue
+from radiko_timeshift_recorder.job_store import DEFAULT_LEASE_SECONDS, SqliteJobQueue
+from radiko_timeshift_recorder.library import LibraryIndex
+from radiko_timeshift_recorder.radiko import SCHEDULE_REQUEST_RATE
+from radiko_timeshift_recorder.segment_cache import (
+    DEFAULT_MAX_BYTES as DEFAULT_SEGMENT_CACHE_MAX_BYTES,
+)
+from radiko_timeshift_recorder.segment_cache import SegmentCache
+from radiko_timeshift_recorder.server import DEFAULT_DRAIN_TIMEOUT
 from radiko_timeshift_recorder.server import app as fastapi_app
+from radiko_timeshift_recorder.server import get_job_queue
+from radiko_timeshift_recorder.upstream import (
+    DEFAULT_STREAM_START_BURST,
+    DEFAULT_STREAM_START_RATE,
+    TokenBucket,
+    UpstreamLimiter,
+)
+from radiko_timeshift_recorder.watchdog import (
+    DEFAULT_DEADLINE_FACTOR,
+    DEFAULT_DEADLINE_MARGIN,
+    DEFAULT_STALL_TIMEOUT,
+    WatchdogConfig,
+)
 
 app = typer.Typer()
 
@@ -27,8 +59,51 @@ def run_server(
     host: Annotated[str, typer.Option(help="Host to run the server on")] = "127.0.0.1",
     port: Annotated[int, typer.Option(help="Port to run the server on")] = 8000,
     num_workers: Annotated[
-        int, typer.Option(min=1, help="Number of workers to run")
+        int,
+        typer.Option(
+            min=1, help="Number of workers to run, or the minimum with --max-workers"
+        ),
     ] = 3,
+    max_workers: Annotated[
+        Optional[int],
+        typer.Option(
+            min=1,
+            help=(
+                "Start more workers, up to this many, while jobs are pending. "
+                "Change at runtime with PUT /admin/workers."
+            ),
+        ),
+    ] = None,
+    max_bandwidth: Annotated[
+        Optional[int],
+        typer.Option(
+            min=1,
+            help=(
+                "Limit the total bytes per second of all downloads. Unlimited if "
+                "not set. Workers are not added beyond what the current limit "
+                "can feed at the observed download speed."
+            ),
+        ),
+    ] = None,
+    max_job_bandwidth: Annotated[
+        Optional[int],
+        typer.Option(
+            min=1,
+            help="Limit the bytes per second of each download. Unlimited if not set.",
+        ),
+    ] = None,
+    bandwidth_schedule: Annotated[
+        Optional[list[BandwidthWindow]],
+        typer.Option(
+            parser=parse_bandwidth_window,
+            metavar="HH:MM-HH:MM=BYTES|unlimited",
+            help=(
+                "Total bytes per second of downloads in a daily window in Japan "
+                "time, instead of --max-bandwidth, e.g. 22:00-06:00=unlimited. "
+                "Can be given several times; the first matching window applies."
+            ),
+        ),
+    ] = None,
     output_file_mode: Annotated[
         str,
         typer.Option(
@@ -38,15 +113,252 @@ def run_server(
             ),
         ),
     ] = "644",
+    segment_cache_dir: Annotated[
+        Optional[Path],
+        typer.Option(
+            file_okay=False,
+            dir_okay=True,
+            help=(
+                "Directory to cache HLS segments in, so overlapping programs on "
+                "the same station reuse them. Disabled if not set."
+            ),
+        ),
+    ] = None,
+    segment_cache_max_bytes: Annotated[
+        int,
+        typer.Option(min=1, help="Maximum total size of the segment cache in bytes"),
+    ] = DEFAULT_SEGMENT_CACHE_MAX_BYTES,
+    stall_timeout: Annotated[
+        float,
+        typer.Option(
+            min=1,
+            help="Seconds without download progress before a download is aborted and retried",
+        ),
+    ] = DEFAULT_STALL_TIMEOUT,
+    deadline_factor: Annotated[
+        float,
+        typer.Option(
+            min=0,
+            help=(
+                "Abort and retry a download that takes longer than this many times "
+                f"the program duration plus {DEFAULT_DEADLINE_MARGIN:.0f} seconds"
+            ),
+        ),
+    ] = DEFAULT_DEADLINE_FACTOR,
+    scratch_dir: Annotated[
+        Optional[Path],
+        typer.Option(
+            exists=True,
+            file_okay=False,
+            dir_okay=True,
+            writable=True,
+            help=(
+                "Directory to record and validate files in before moving them to "
+                "--out-dir, e.g. a local disk or tmpfs when --out-dir is a network "
+                "share. Defaults to --out-dir itself."
+            ),
+        ),
+    ] = None,
+    min_free_bytes: Annotated[
+        int,
+        typer.Option(
+            min=0,
+            help=(
+                "Leave jobs queued while the free space of --out-dir or "
+                "--scratch-dir, minus the estimated size of running recordings "
+                "and the job's own, is below this many bytes"
+            ),
+        ),
+    ] = DEFAULT_MIN_FREE_BYTES,
+    max_queue_size: Annotated[
+        Optional[int],
+        typer.Option(
+            min=1,
+            help="Reject new jobs with 429 while this many are pending. Unbounded if not set.",
+        ),
+    ] = None,
+    max_streams: Annotated[
+        Optional[int],
+        typer.Option(
+            min=1,
+            help=(
+                "Maximum streams to download from radiko at once, halved "
+                "temporarily after upstream errors. Defaults to the maximum "
+                "number of workers, following changes through /admin/workers."
+            ),
+        ),
+    ] = None,
+    max_streams_per_station: Annotated[
+        Optional[int],
+        typer.Option(
+            min=1, help="Maximum streams to download at once from each station"
+        ),
+    ] = None,
+    stream_start_rate: Annotated[
+        float,
+        typer.Option(
+            min=0.001,
+            help=(
+                "Maximum streams started per second, in bursts of up to "
+                f"{DEFAULT_STREAM_START_BURST}. Lowered temporarily after upstream "
+                "errors. Only covers the downloads of this server: the schedule "
+                "requests of put-jobs-from-schedule-by-rules and verify-library are "
+                f"limited to {SCHEDULE_REQUEST_RATE} per second in each of those "
+                "processes separately."
+            ),
+        ),
+    ] = DEFAULT_STREAM_START_RATE,
+    fair_queuing: Annotated[
+        bool,
+        typer.Option(
+            help=(
+                "Take pending jobs from each station in turn instead of strictly "
+                "by end time, so a station with a large backlog does not occupy "
+                "every worker. Not supported with --job-store."
+            ),
+        ),
+    ] = False,
+    job_store: Annotated[
+        Optional[Path],
+        typer.Option(
+            file_okay=True,
+            dir_okay=False,
+            help=(
+                "SQLite database to share jobs in with other run-server nodes, "
+                "e.g. on a shared volume. Jobs are kept in memory if not set."
+            ),
+        ),
+    ] = None,
+    node_id: Annotated[
+        Optional[str],
+        typer.Option(
+            help="Name of this node in the job store. Defaults to the host name and PID."
+        ),
+    ] = None,
+    lease_seconds: Annotated[
+        float,
+        typer.Option(
+            min=1,
+            help=(
+                "Seconds a job stays claimed by a node after its last heartbeat, "
+                "before another node may take it over"
+            ),
+        ),
+    ] = DEFAULT_LEASE_SECONDS,
+    drain_timeout: Annotated[
+        float,
+        typer.Option(
+            min=0,
+            help=(
+                "Seconds to let running downloads finish on shutdown before they "
+                "are cancelled. Allow for it in the stop timeout of the container "
+                "or service manager."
+            ),
+        ),
+    ] = DEFAULT_DRAIN_TIMEOUT,
+    checkpoint_file: Annotated[
+        Optional[Path],
+        typer.Option(
+            file_okay=True,
+            dir_okay=False,
+            help=(
+                "File to save pending and cancelled jobs to on shutdown, which are "
+                "put again on the next start. Not needed with --job-store."
+            ),
+        ),
+    ] = None,
+    library_index: Annotated[
+        Optional[Path],
+        typer.Option(
+            file_okay=True,
+            dir_okay=False,
+            help=(
+                "File to index recorded programs in, so recorded jobs are skipped "
+                "without checking the output directory, which is only checked for "
+                "jobs missing from the index. Built from a scan of --out-dir if "
+                "missing. Disabled if not set."
+            ),
+        ),
+    ] = None,
 ):
+    if fair_queuing and job_store is not None:
+        raise typer.BadParameter("--fair-queuing is not supported with --job-store")
+
     try:
         file_mode = parse_unix_mode_string(output_file_mode)
-        fastapi_app.state.process_job = lambda job: download(
+        segment_cache = (
+            SegmentCache(segment_cache_dir, segment_cache_max_bytes)
+            if segment_cache_dir is not None
+            else None
+        )
+        watchdog = WatchdogConfig(
+            stall_timeout=stall_timeout, deadline_factor=deadline_factor
+        )
+        library = (
+            LibraryIndex.open(library_index, out_dir)
+            if library_index is not None
+            else None
+        )
+        fastapi_app.state.library = library
+        limiter = UpstreamLimiter(
+            # Finite, so that upstream errors have a limit to lower.
+            max_streams=(
+                max_streams
+                if max_streams is not None
+                else max(num_workers, max_workers or 0)
+            ),
+            max_streams_per_station=max_streams_per_station,
+            stream_starts=TokenBucket(
+                max_rate=stream_start_rate, burst=DEFAULT_STREAM_START_BURST
+            ),
+        )
+        fastapi_app.state.admission = DiskSpaceAdmission(
+            [out_dir] + ([scratch_dir] if scratch_dir is not None else []),
+            min_free_bytes=min_free_bytes,
+        )
+        fastapi_app.state.max_queue_size = max_queue_size
+        shaper = (
+            BandwidthShaper(
+                limit=max_bandwidth,
+                job_limit=max_job_bandwidth,
+                schedule=bandwidth_schedule or [],
+            )
+            if max_bandwidth is not None
+            or max_job_bandwidth is not None
+            or bandwidth_schedule
+            else None
+        )
+        fastapi_app.state.bandwidth_shaper = shaper
+        fastapi_app.state.process_job = lambda job, progress: download(
             job=job,
             out_dir=out_dir,
             output_file_mode=file_mode,
+            segment_cache=segment_cache,
+            progress=progress,
+            watchdog=watchdog,
+            library=library,
+            scratch_dir=scratch_dir,
+            limiter=limiter,
+            shaper=shaper,
         )
+        if fair_queuing:
+            fair_job_queue: JobQueue[Job] = JobQueue(
+                fair_key=lambda job: job.station_id
+            )
+            fastapi_app.dependency_overrides[get_job_queue] = lambda: fair_job_queue
+        if job_store is not None:
+            shared_job_queue = SqliteJobQueue(
+                job_store, node_id=node_id, lease_seconds=lease_seconds
+            )
+            fastapi_app.dependency_overrides[get_job_queue] = lambda: shared_job_queue
         fastapi_app.state.num_workers = num_workers
+        fastapi_app.state.drain_timeout = drain_timeout
+        fastapi_app.state.checkpoint_path = checkpoint_file
+        fastapi_app.state.max_workers = max_workers
+        # Unless set, the stream limit is the worker pool's to change.
+        fastapi_app.state.worker_stream_limiter = (
+            limiter if max_streams is None else None
+        )
         uvicorn.run(app=fastapi_app, host=host, port=port)
     except Exception:
         logger.exception("Failed to run server")
@@ -0,0 +1,183 @@
+from pathlib import Path
+from typing import Annotated, Optional
+
+import typer
+from logzero import logger
+from requests import HTTPError
+
+from radiko_timeshift_recorder import tracing
+from radiko_timeshift_recorder.client import Client
+from radiko_timeshift_recorder.job import Job, fetch_all_jobs
+from radiko_timeshift_recorder.job_queue import Priority
+from radiko_timeshift_recorder.library import LibraryEntry, LibraryIndex, scan_library
+from radiko_timeshift_recorder.verify import (
+    DEFAULT_MAX_WORKERS,
+    DurationCache,
+    expected_durations,
+    recordable_jobs,
+    restore,
+    set_aside,
+    verify_entries,
+)
+
+app = typer.Typer()
+
+
+@app.command()
+def verify_library(
+    out_dir: Annotated[
+        Path,
+        typer.Option(
+            exists=True,
+            file_okay=False,
+            dir_okay=True,
+            help="Directory of the recordings to verify",
+        ),
+    ],
+    library_index: Annotated[
+        Optional[Path],
+        typer.Option(
+            file_okay=True,
+            dir_okay=False,
+            help=(
+                "Library index of the server, for the program durations of "
+                "recordings no longer in the schedule"
+            ),
+        ),
+    ] = None,
+    cache_file: Annotated[
+        Optional[Path],
+        typer.Option(
+            file_okay=True,
+            dir_okay=False,
+            help=(
+                "File to cache durations in by file size and mtime, so that "
+                "later runs only read new or changed recordings"
+            ),
+        ),
+    ] = None,
+    max_workers: Annotated[
+        int, typer.Option(min=1, help="Recordings to read at once")
+    ] = DEFAULT_MAX_WORKERS,
+    schedule: Annotated[
+        bool,
+        typer.Option(help="Fetch the schedule of the past days for program durations"),
+    ] = True,
+    requeue: Annotated[
+        bool,
+        typer.Option(
+            help=(
+                "Rename broken recordings of programs still in the timeshift "
+                "window with a .broken suffix and put their jobs again"
+            ),
+        ),
+    ] = False,
+    server_url: Annotated[
+        str,
+        typer.Option(help="URL of the server to put jobs to with --requeue"),
+    ] = "http://localhost:8000",
+    priority: Annotated[
+        Priority,
+        typer.Option(help="Lane of the job queue to put jobs in with --requeue"),
+    ] = Priority.BACKFILL,
+):
+    try:
+        with tracing.span("scan_library") as span:
+            entries = scan_library(out_dir)
+            span.set_attribute("entries", len(entries))
+        logger.info(f"Found {len(entries)} recordings in {out_dir}")
+
+        indexed: list[LibraryEntry] = []
+        if library_index is not None and library_index.exists():
+            index = LibraryIndex(library_index, out_dir)
+            index.load()
+            indexed = list(index.entries.values())
+
+        jobs: list[Job] = []
+        if schedule:
+            try:
+                with tracing.span("fetch_all_jobs"):
+                    jobs = list(fetch_all_jobs())
+            except Exception:
+                # Durations from the library index are still checked.
+                logger.exception("Failed to fetch jobs from schedule")
+
+        cache = DurationCache.open(cache_file)
+        with tracing.span("verify_entries"):
+            results = verify_entries(
+                entries,
+                expected_durations(indexed, jobs),
+                cache,
+                max_workers=max_workers,
+            )
+        # Recordings that are gone are dropped from the cache.
+        cache.save(Path(entry.path) for entry in entries)
+
+        for result in results:
+            if result.state == "truncated":
+                logger.warning(
+                    f"Duration {result.duration} of {result.entry.path} differs "
+                    f"from the program duration {result.expected_duration}"
+                )
+            elif result.state == "unreadable":
+                logger.warning(f"Failed to read {result.entry.path}: {result.error}")
+
+        counts = {
+            state: sum(1 for r in results if r.state == state)
+            for state in ("ok", "truncated", "unreadable", "unknown")
+        }
+        logger.info(
+            "Verified recordings: "
+            + ", ".join(f"{count} {state}" for state, count in counts.items())
+        )
+
+        broken = [result for result in results if result.is_broken]
+        if not broken:
+            return
+        if not requeue:
+            raise typer.Exit(1)
+
+        recordable = recordable_jobs(broken, jobs)
+        logger.info(
+            f"{len(recordable)} of {len(broken)} broken recordings can still be "
+            "recorded again"
+        )
+        jobs_failed: list[Job] = []
+        with Client(server_url) as client:
+            set_aside_paths = {
+                job: set_aside(Path(result.entry.path)) for result, job in recordable
+            }
+            try:
+                if recordable:
+                    # The index would skip the jobs as recorded.
+                    client.rebuild_library()
+            except Exception:
+                for result, job in recordable:
+                    restore(set_aside_paths[job], Path(result.entry.path))
+                raise
+
+            for result, job in recordable:
+                try:
+                    client.put_job(job, priority)
+                except HTTPError as e:
+                    if e.response.status_code == 409:
+                        logger.debug(f"Job already exists: {job}")
+                        continue
+                    logger.exception(f"Failed to put job: {job}")
+                    jobs_failed.append(job)
+                    # Found broken again by the next run.
+                    restore(set_aside_paths[job], Path(result.entry.path))
+                except Exception:
+                    logger.exception(f"Failed to put job: {job}")
+                    jobs_failed.append(job)
+                    restore(set_aside_paths[job], Path(result.entry.path))
+                else:
+                    logger.info(f"Put job to record {result.entry.path} again: {job}")
+
+        if jobs_failed or len(recordable) < len(broken):
+            raise typer.Exit(1)
+    except typer.Exit:
+        raise
+    except Exception:
+        logger.exception(f"Failed to verify library: {out_dir}")
+        raise typer.Exit(1)
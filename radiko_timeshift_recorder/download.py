@@ -1,20 +1,48 @@
 import asyncio
 import errno
 import logging
+import math
 import os
-import shlex
+import shutil
+import sys
 import tempfile
+import time
+from contextlib import nullcontext
 from pathlib import Path
 from typing import Optional
 
 import tenacity
 from logzero import logger
 
+from radiko_timeshift_recorder import metrics, tracing
+from radiko_timeshift_recorder.bandwidth import BandwidthShaper
 from radiko_timeshift_recorder.get_duration import get_duration
 from radiko_timeshift_recorder.job import Job
-from radiko_timeshift_recorder.radiko import Program
+from radiko_timeshift_recorder.library import LibraryIndex
+from radiko_timeshift_recorder.pipeline import PipelineError, run_pipeline
+from radiko_timeshift_recorder.process_output import OutputTail, pump_lines
+from radiko_timeshift_recorder.progress import DownloadProgress
+from radiko_timeshift_recorder.radiko import Program, is_radiko_base_url_overridden
+from radiko_timeshift_recorder.segment_cache import SegmentCache
+from radiko_timeshift_recorder.upstream import (
+    UpstreamError,
+    UpstreamLimiter,
+    is_upstream_error,
+)
+from radiko_timeshift_recorder.watchdog import (
+    DEFAULT_STALL_TIMEOUT,
+    WatchdogConfig,
+    run_with_watchdog,
+)
 
 DEFAULT_OUTPUT_FILE_MODE = 0o644
+# Recordings may differ this much from the duration of their program.
+DURATION_TOLERANCE_SECONDS = 1.0
+# Recordings off by at most this much, a few radiko segments of 5 seconds, are
+# trimmed or completed with the rest of the stream instead of downloaded again.
+# Recordings further off, e.g. with duplicated segments or from the wrong
+# stream, are not trusted.
+MAX_SALVAGE_SECONDS = 30.0
 
 
 def generate_filename_candidates(program: Program) -> tuple[str, ...]:
@@ -26,81 +54,467 @@ def generate_filename_candidates(program: Program) -> tuple[str, ...]:
     return tuple(" - ".join(name_parts[:i]) for i in range(len(name_parts), 0, -1))
 
 
-async def download_stream(url: str, out_filepath: Path) -> None:
-    # Pipe streamlink's output directly to ffmpeg.
-    # This helps prevent issues where the end of the stream might be cut off
-    # if saved directly by streamlink alone.
-    proc = await asyncio.create_subprocess_shell(
-        cmd=" ".join(
-            [
-                "python",
-                "-m",
-                "streamlink",
-                shlex.quote(url),
-                "best",
-                "--stdout",
-                "|",
-                "ffmpeg",
-                "-hide_banner",
-                "-i",
-                "-",
-                "-codec",
-                "copy",
-                "-format",
-                "mp4",
-                "-y",
-                shlex.quote(str(out_filepath.resolve())),
-            ]
-        ),
-        stdout=asyncio.subprocess.PIPE,
+def streamlink_command(
+    url: str,
+    *,
+    segment_cache: Optional[SegmentCache] = None,
+    start_offset: int = 0,
+) -> list[str]:
+    if (
+        segment_cache is None
+        and not is_radiko_base_url_overridden()
+        and not start_offset
+    ):
+        return [
+            sys.executable,
+            "-m",
+            "streamlink",
+            url,
+            "best",
+            "--stdout",
+        ]
+
+    # Segments are shared through the cache, requests are sent to another
+    # radiko base URL, and programs are started partway through, by our own
+    # streamlink-based fetcher, which otherwise behaves like
+    # `streamlink URL best --stdout`.
+    command = [sys.executable, "-m", "radiko_timeshift_recorder", "fetch-stream", url]
+    if segment_cache is not None:
+        command += [
+            "--segment-cache-dir",
+            str(segment_cache.root.resolve()),
+            "--segment-cache-max-bytes",
+            str(segment_cache.max_bytes),
+        ]
+    if start_offset:
+        command += ["--start-offset", str(start_offset)]
+    return command
+
+
+def ffmpeg_command(out_filepath: Path) -> list[str]:
+    return [
+        "ffmpeg",
+        "-hide_banner",
+        "-nostats",
+        "-progress",
+        "pipe:1",
+        "-i",
+        "-",
+        "-codec",
+        "copy",
+        "-format",
+        "mp4",
+        "-y",
+        str(out_filepath.resolve()),
+    ]
+
+
+def trim_command(in_filepath: Path, out_filepath: Path, duration: float) -> list[str]:
+    return [
+        "ffmpeg",
+        "-hide_banner",
+        "-nostats",
+        "-i",
+        str(in_filepath.resolve()),
+        "-t",
+        f"{duration:.3f}",
+        "-codec",
+        "copy",
+        "-format",
+        "mp4",
+        "-y",
+        str(out_filepath.resolve()),
+    ]
+
+
+def concat_list(filepaths: list[Path]) -> str:
+    """Input of ffmpeg's concat demuxer, which quotes paths like a shell."""
+    return "".join(
+        "file '{}'\n".format(str(filepath.resolve()).replace("'", "'\\''"))
+        for filepath in filepaths
+    )
+
+
+def concat_command(list_filepath: Path, out_filepath: Path) -> list[str]:
+    return [
+        "ffmpeg",
+        "-hide_banner",
+        "-nostats",
+        "-f",
+        "concat",
+        "-safe",
+        "0",
+        "-i",
+        str(list_filepath.resolve()),
+        "-codec",
+        "copy",
+        "-format",
+        "mp4",
+        "-y",
+        str(out_filepath.resolve()),
+    ]
+
+
+async def run_ffmpeg(command: list[str]) -> None:
+    logger.debug(f"Running ffmpeg command: {' '.join(command)}")
+
+    proc = await asyncio.create_subprocess_exec(
+        *command,
+        stdin=asyncio.subprocess.DEVNULL,
+        stdout=asyncio.subprocess.DEVNULL,
         stderr=asyncio.subprocess.PIPE,
     )
 
-    stdout, stderr = await proc.communicate()
+    stderr_tail = OutputTail()
+    assert proc.stderr is not None
+    try:
+        await pump_lines(proc.stderr, stderr_tail.append)
+        await proc.wait()
+    except BaseException:
+        if proc.returncode is None:
+            proc.kill()
+            await proc.wait()
+        raise
 
     if proc.returncode != 0:
-        logger.debug(f"stdout: {stdout.decode().strip()}")
-        logger.debug(f"stderr: {stderr.decode().strip()}")
         raise RuntimeError(
-            f"Failed to download stream {url}: {stderr.decode().strip()}"
+            f"ffmpeg exited with {proc.returncode}: {stderr_tail.text()}"
         )
 
 
+async def download_stream(
+    url: str,
+    out_filepath: Path,
+    *,
+    segment_cache: Optional[SegmentCache] = None,
+    progress: Optional[DownloadProgress] = None,
+    stall_timeout: float = DEFAULT_STALL_TIMEOUT,
+    deadline: Optional[float] = None,
+    shaper: Optional[BandwidthShaper] = None,
+    start_offset: int = 0,
+) -> None:
+    if progress is None:
+        progress = DownloadProgress()
+    progress.reset()
+
+    with tracing.span("download_stream", url=url) as span:
+        # The span's events split it into streamlink startup (until
+        # first_output), streaming (until source_exited) and ffmpeg finalisation.
+        def on_progress_line(line: str) -> None:
+            total_size = progress.total_size
+            progress.update_from_ffmpeg_line(line)
+            if progress.total_size > total_size:
+                if total_size == 0:
+                    span.add_event("first_output")
+                metrics.DOWNLOAD_BYTES.inc(progress.total_size - total_size)
+
+        def on_source_exit(returncode: int) -> None:
+            span.add_event("source_exited", returncode=returncode)
+
+        # Pipe streamlink's output directly to ffmpeg.
+        # This helps prevent issues where the end of the stream might be cut off
+        # if saved directly by streamlink alone.
+        with shaper.stream() if shaper is not None else nullcontext() as throttle:
+            try:
+                await run_with_watchdog(
+                    run_pipeline(
+                        (
+                            "streamlink",
+                            streamlink_command(
+                                url,
+                                segment_cache=segment_cache,
+                                start_offset=start_offset,
+                            ),
+                        ),
+                        ("ffmpeg", ffmpeg_command(out_filepath)),
+                        on_sink_stdout_line=on_progress_line,
+                        on_source_exit=on_source_exit,
+                        throttle=throttle,
+                    ),
+                    progress,
+                    stall_timeout=stall_timeout,
+                    deadline=deadline,
+                )
+            except PipelineError as e:
+                message = f"Failed to download stream {url}: {e}"
+                if any(
+                    result.name == "streamlink"
+                    and is_upstream_error(result.stderr_tail.text())
+                    for result in e.failed
+                ):
+                    raise UpstreamError(message) from e
+                raise RuntimeError(message) from e
+
+        span.set_attribute("bytes_written", progress.total_size)
+
+
+def rename_without_overwriting(source: Path, target: Path) -> None:
+    """
+    Rename ``source`` to ``target``, raising ``FileExistsError`` instead of
+    replacing an existing ``target``.
+
+    The file is linked into place, which fails if ``target`` exists, so no
+    separate lookup is needed. Only on filesystems without hard links is
+    ``target`` looked up before it is replaced.
+    """
+    exists_error = FileExistsError(errno.EEXIST, os.strerror(errno.EEXIST), str(target))
+    try:
+        target.hardlink_to(source)
+    except FileExistsError as e:
+        # The error names the source as its filename.
+        raise exists_error from e
+    except OSError as e:
+        if e.errno not in (errno.EPERM, errno.EOPNOTSUPP, errno.ENOTSUP):
+            raise
+        if target.exists():
+            raise exists_error from e
+        source.replace(target)
+        return
+    source.unlink()
+
+
 def try_rename_with_candidates(
     temp_filepath: Path, out_filepath_candidates: list[Path]
 ) -> Path:
     if not out_filepath_candidates:
         raise ValueError("out_filepath_candidates list cannot be empty.")
 
-    name_too_long_exception: Optional[OSError] = None
-    for out_filepath_candidate in out_filepath_candidates:
+    with tracing.span("try_rename_with_candidates") as span:
+        name_too_long_exception: Optional[OSError] = None
+        for i, out_filepath_candidate in enumerate(out_filepath_candidates):
+            try:
+                rename_without_overwriting(temp_filepath, out_filepath_candidate)
+                span.set_attribute("candidates_tried", i + 1)
+                return out_filepath_candidate
+            except OSError as e:
+                if e.errno == errno.ENAMETOOLONG:
+                    name_too_long_exception = e
+                    continue
+                else:
+                    raise e
+
+        if name_too_long_exception:
+            raise name_too_long_exception
+
+    raise RuntimeError(
+        "try_rename_with_candidates reached an unexpected state. This should not happen."
+    )
+
+
+def move_with_candidates(
+    temp_filepath: Path, out_filepath_candidates: list[Path]
+) -> Path:
+    """
+    Move ``temp_filepath`` to the first of ``out_filepath_candidates`` whose
+    name is not too long, like ``try_rename_with_candidates``.
+
+    If it is on another filesystem, it is first copied next to the candidates
+    so that the recording still appears there with a single atomic rename.
+    """
+    with tracing.span("move_with_candidates") as span:
         try:
-            temp_filepath.replace(out_filepath_candidate)
-            return out_filepath_candidate
+            return try_rename_with_candidates(temp_filepath, out_filepath_candidates)
         except OSError as e:
-            if e.errno == errno.ENAMETOOLONG:
-                name_too_long_exception = e
-                continue
+            if e.errno != errno.EXDEV:
+                raise
+        span.set_attribute("cross_device", True)
+
+        with tempfile.NamedTemporaryFile(
+            mode="w+b",
+            suffix=temp_filepath.suffix,
+            dir=out_filepath_candidates[0].parent,
+            delete=True,
+        ) as staged_file:
+            staged_filepath = Path(staged_file.name)
+            # Uses sendfile(2) where available, so the copy is not buffered here.
+            shutil.copyfile(temp_filepath, staged_filepath)
+            os.fsync(staged_file.fileno())
+            out_filepath = try_rename_with_candidates(
+                staged_filepath, out_filepath_candidates
+            )
+
+        temp_filepath.unlink(missing_ok=True)
+        return out_filepath
+
+
+_log_before_retry = tenacity.before_sleep_log(logger=logger, log_level=logging.INFO)
+
+
+def _before_retry(retry_state: tenacity.RetryCallState) -> None:
+    _log_before_retry(retry_state)
+    exception = retry_state.outcome.exception() if retry_state.outcome else None
+    if exception is not None:
+        metrics.DOWNLOAD_RETRIES.labels(cause=metrics.failure_cause(exception)).inc()
+
+        progress = retry_state.kwargs.get("progress")
+        if isinstance(progress, DownloadProgress):
+            progress.record_retry(exception)
+
+
+async def _stream_job(
+    job: Job,
+    out_filepath: Path,
+    *,
+    dur: int,
+    start_offset: int = 0,
+    segment_cache: Optional[SegmentCache] = None,
+    progress: Optional[DownloadProgress] = None,
+    watchdog: WatchdogConfig = WatchdogConfig(),
+    limiter: Optional[UpstreamLimiter] = None,
+    shaper: Optional[BandwidthShaper] = None,
+) -> None:
+    """Download ``dur`` seconds of ``job`` from ``start_offset`` on."""
+    async with limiter.stream(job.station_id) if limiter is not None else nullcontext():
+        started_at = time.monotonic()
+        try:
+            await download_stream(
+                job.url,
+                out_filepath,
+                segment_cache=segment_cache,
+                progress=progress,
+                stall_timeout=watchdog.stall_timeout,
+                deadline=watchdog.deadline_for(dur),
+                shaper=shaper,
+                start_offset=start_offset,
+            )
+        except UpstreamError:
+            # Other errors, e.g. of ffmpeg, the disk or stalls, are not a
+            # reason to hit radiko less hard.
+            if limiter is not None:
+                await limiter.record_failure()
+            raise
+        if limiter is not None:
+            await limiter.record_success()
+    metrics.DOWNLOAD_REALTIME_RATIO.observe((time.monotonic() - started_at) / dur)
+
+
+async def salvage_recording(
+    job: Job,
+    temp_filepath: Path,
+    recorded_dur: float,
+    *,
+    segment_cache: Optional[SegmentCache] = None,
+    watchdog: WatchdogConfig = WatchdogConfig(),
+    limiter: Optional[UpstreamLimiter] = None,
+    shaper: Optional[BandwidthShaper] = None,
+) -> float:
+    """
+    Bring a recording of ``recorded_dur`` seconds to the duration of its
+    program without downloading it again, and return its new duration.
+
+    A recording too long by at most ``MAX_SALVAGE_SECONDS`` is trimmed, and
+    one short by at most as much is completed with the rest of the stream,
+    both copying the audio as is. Other recordings, and those that
+    could not be salvaged, are left as they are.
+
+    The tail is streamed without the progress of the job, which keeps
+    describing the recording being completed.
+    """
+    shortfall = job.program.dur - recorded_dur
+    if -MAX_SALVAGE_SECONDS <= shortfall < -DURATION_TOLERANCE_SECONDS:
+        kind = "trim"
+    elif DURATION_TOLERANCE_SECONDS < shortfall <= MAX_SALVAGE_SECONDS:
+        kind = "tail"
+    else:
+        return recorded_dur
+
+    with (
+        tracing.span("salvage", kind=kind),
+        tempfile.TemporaryDirectory(
+            dir=temp_filepath.parent, prefix=".salvage-"
+        ) as work_dir,
+    ):
+        salvaged_filepath = Path(work_dir) / f"salvaged{temp_filepath.suffix}"
+        try:
+            if kind == "trim":
+                await run_ffmpeg(
+                    trim_command(temp_filepath, salvaged_filepath, job.program.dur)
+                )
             else:
-                raise e
+                # radiko starts the tail at the segment holding its seek time.
+                # Seeking up to the tolerance early makes it the first segment
+                # missing from the recording; an overlap or gap left by a
+                # partly written segment, or a tail that is the whole program,
+                # fails the check below.
+                tail_filepath = Path(work_dir) / f"tail{temp_filepath.suffix}"
+                await _stream_job(
+                    job,
+                    tail_filepath,
+                    dur=math.ceil(shortfall),
+                    start_offset=max(0, int(recorded_dur - DURATION_TOLERANCE_SECONDS)),
+                    segment_cache=segment_cache,
+                    watchdog=watchdog,
+                    limiter=limiter,
+                    shaper=shaper,
+                )
+                list_filepath = Path(work_dir) / "concat.txt"
+                list_filepath.write_text(
+                    concat_list([temp_filepath, tail_filepath]), encoding="utf-8"
+                )
+                await run_ffmpeg(concat_command(list_filepath, salvaged_filepath))
+            salvaged_dur = await get_duration(salvaged_filepath)
+        except Exception as e:
+            logger.warning(f"Failed to salvage the recording of {job.key}: {e}")
+            metrics.SALVAGES.labels(kind=kind, result="failed").inc()
+            return recorded_dur
 
-    if name_too_long_exception:
-        raise name_too_long_exception
+        if abs(salvaged_dur - job.program.dur) > DURATION_TOLERANCE_SECONDS:
+            logger.warning(
+                f"Salvaged recording of {job.key} lasts {salvaged_dur} seconds "
+                f"instead of {job.program.dur}"
+            )
+            metrics.SALVAGES.labels(kind=kind, result="failed").inc()
+            return recorded_dur
 
-    raise RuntimeError(
-        "try_rename_with_candidates reached an unexpected state. This should not happen."
+        os.replace(salvaged_filepath, temp_filepath)
+
+    logger.info(
+        f"Salvaged the recording of {job.key} of {recorded_dur} seconds by {kind}"
     )
+    metrics.SALVAGES.labels(kind=kind, result="salvaged").inc()
+    return salvaged_dur
 
 
 @tenacity.retry(
     stop=tenacity.stop_after_attempt(max_attempt_number=3),
     wait=tenacity.wait_fixed(wait=60),
-    before_sleep=tenacity.before_sleep_log(logger=logger, log_level=logging.INFO),
+    before_sleep=_before_retry,
 )
-async def _download_and_validate_stream(job: Job, temp_filepath: Path) -> None:
-    await download_stream(job.url, temp_filepath)
-    recorded_dur = await get_duration(temp_filepath)
-    if abs(recorded_dur - job.program.dur) > 1:
+async def _download_and_validate_stream(
+    job: Job,
+    temp_filepath: Path,
+    *,
+    segment_cache: Optional[SegmentCache] = None,
+    progress: Optional[DownloadProgress] = None,
+    watchdog: WatchdogConfig = WatchdogConfig(),
+    limiter: Optional[UpstreamLimiter] = None,
+    shaper: Optional[BandwidthShaper] = None,
+) -> None:
+    await _stream_job(
+        job,
+        temp_filepath,
+        dur=job.program.dur,
+        segment_cache=segment_cache,
+        progress=progress,
+        watchdog=watchdog,
+        limiter=limiter,
+        shaper=shaper,
+    )
+
+    with metrics.VALIDATION_SECONDS.time(), tracing.span("get_duration"):
+        recorded_dur = await get_duration(temp_filepath)
+    if abs(recorded_dur - job.program.dur) > DURATION_TOLERANCE_SECONDS:
+        # Only recordings that cannot be salvaged are downloaded again.
+        recorded_dur = await salvage_recording(
+            job,
+            temp_filepath,
+            recorded_dur,
+            segment_cache=segment_cache,
+            watchdog=watchdog,
+            limiter=limiter,
+            shaper=shaper,
+        )
+    if abs(recorded_dur - job.program.dur) > DURATION_TOLERANCE_SECONDS:
         raise RuntimeError(
             f"Recorded duration {recorded_dur} differs from the program duration {job.program.dur}."
         )
@@ -111,38 +525,87 @@ async def download(
     out_dir: Path,
     *,
     output_file_mode: int = DEFAULT_OUTPUT_FILE_MODE,
+    segment_cache: Optional[SegmentCache] = None,
+    progress: Optional[DownloadProgress] = None,
+    watchdog: WatchdogConfig = WatchdogConfig(),
+    library: Optional[LibraryIndex] = None,
+    scratch_dir: Optional[Path] = None,
+    limiter: Optional[UpstreamLimiter] = None,
+    shaper: Optional[BandwidthShaper] = None,
 ) -> None:
-    program_dir = out_dir / job.station_id / job.program.title
-    filename_candidates = generate_filename_candidates(job.program)
-    suffix = ".mp4"
+    """
+    Record ``job`` under ``out_dir`` unless it is already recorded.
 
-    out_filepath_candidates = [
-        program_dir.joinpath(filename).with_suffix(suffix)
-        for filename in filename_candidates
-    ]
+    Already recorded programs are looked up in the ``library`` index, if
+    given, and the new recording is added to it. Each filename candidate is
+    only checked on disk without a complete index. Existing recordings are
+    never overwritten: one missing from the index, e.g. added by hand since
+    the last rebuild, is kept and added to the index instead of the new one.
 
-    for filepath_to_check_existence in out_filepath_candidates:
-        if filepath_to_check_existence.exists():
-            logger.info(
-                f"File {filepath_to_check_existence} already exists. Skipping download."
-            )
+    With a ``scratch_dir``, the recording is written and validated there, e.g.
+    on a local disk when ``out_dir`` is a network share, and moved into
+    ``out_dir`` once it is complete.
+
+    With a ``limiter``, each attempt waits for it before streaming from radiko.
+    With a ``shaper``, the stream is throttled to its bandwidth limits.
+    """
+    with tracing.span("download", job_key=job.key):
+        program_dir = out_dir / job.station_id / job.program.title
+        filename_candidates = generate_filename_candidates(job.program)
+        suffix = ".mp4"
+
+        out_filepath_candidates = [
+            program_dir.joinpath(filename).with_suffix(suffix)
+            for filename in filename_candidates
+        ]
+
+        if library is not None and library.contains(job):
+            logger.info(f"{job.key} is already in the library. Skipping download.")
             return
+        if library is None or not library.complete:
+            for filepath_to_check_existence in out_filepath_candidates:
+                if filepath_to_check_existence.exists():
+                    logger.info(
+                        f"File {filepath_to_check_existence} already exists. Skipping download."
+                    )
+                    return
 
-    program_dir.mkdir(parents=True, exist_ok=True)
+        program_dir.mkdir(parents=True, exist_ok=True)
 
-    with tempfile.NamedTemporaryFile(
-        mode="w+b",
-        suffix=suffix,
-        dir=program_dir,
-        delete=True,
-    ) as tmp_file:
-        temp_filepath = Path(tmp_file.name)
+        with tempfile.NamedTemporaryFile(
+            mode="w+b",
+            suffix=suffix,
+            dir=scratch_dir if scratch_dir is not None else program_dir,
+            delete=True,
+        ) as tmp_file:
+            temp_filepath = Path(tmp_file.name)
 
-        await _download_and_validate_stream(job, temp_filepath)
+            await _download_and_validate_stream(
+                job,
+                temp_filepath,
+                segment_cache=segment_cache,
+                progress=progress,
+                watchdog=watchdog,
+                limiter=limiter,
+                shaper=shaper,
+            )
 
-        out_filepath = try_rename_with_candidates(
-            temp_filepath, out_filepath_candidates
-        )
+            try:
+                out_filepath = await asyncio.to_thread(
+                    move_with_candidates, temp_filepath, out_filepath_candidates
+                )
+            except FileExistsError as e:
+                logger.info(
+                    f"File {e.filename} already exists. Discarding the new recording."
+                )
+                if library is not None:
+                    await asyncio.to_thread(library.add, job, Path(e.filename))
+                return
 
-    os.chmod(out_filepath, output_file_mode)
-    logger.info(f"Downloaded {job} to {out_filepath}")
+        with tracing.span("chmod"):
+            os.chmod(out_filepath, output_file_mode)
+        if progress is not None:
+            progress.file_size = out_filepath.stat().st_size
+        if library is not None:
+            await asyncio.to_thread(library.add, job, out_filepath)
+        logger.info(f"Downloaded {job} to {out_filepath}")
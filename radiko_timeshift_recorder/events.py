@@ -0,0 +1,140 @@
+"""In-memory bus of job lifecycle events, streamed to clients at ``GET /events``."""
+
+import asyncio
+import datetime
+from collections import deque
+from contextlib import contextmanager
+from typing import Any, Iterator, Literal, Optional
+from zoneinfo import ZoneInfo
+
+from fastapi.encoders import jsonable_encoder
+from pydantic import AwareDatetime, BaseModel
+
+from radiko_timeshift_recorder.job import Job
+
+DEFAULT_HISTORY_SIZE = 1000
+DEFAULT_SUBSCRIBER_BUFFER_SIZE = 100
+
+EventType = Literal["enqueued", "started", "progress", "retried", "completed", "failed"]
+
+
+class JobEvent(BaseModel):
+    id: int
+    type: EventType
+    time: AwareDatetime
+    job_key: str
+    data: dict[str, Any] = {}
+
+    def to_sse(self) -> str:
+        return f"id: {self.id}\nevent: {self.type}\ndata: {self.model_dump_json()}\n\n"
+
+
+class Subscription:
+    """
+    Events for one subscriber, buffered up to ``buffer_size``.
+
+    A subscriber that falls behind is closed instead of blocking publishers:
+    it receives what is already buffered and can then resubscribe from the
+    last event id it saw.
+    """
+
+    def __init__(self, buffer_size: int, backlog: list[JobEvent]) -> None:
+        self.buffer_size = buffer_size
+        self.buffer: deque[JobEvent] = deque(backlog)
+        self.closed = False
+        self.overflowed = False
+        self._wakeup = asyncio.Event()
+
+    def push(self, event: JobEvent) -> None:
+        if self.closed:
+            return
+
+        if len(self.buffer) >= self.buffer_size:
+            self.overflowed = True
+            self.close()
+            return
+
+        self.buffer.append(event)
+        self._wakeup.set()
+
+    def close(self) -> None:
+        self.closed = True
+        self._wakeup.set()
+
+    async def get(self, timeout: Optional[float] = None) -> Optional[JobEvent]:
+        """
+        Return the next event, or ``None`` once closed and drained.
+
+        Raises ``TimeoutError`` if no event arrives within ``timeout`` seconds.
+        """
+        while not self.buffer:
+            if self.closed:
+                return None
+            self._wakeup.clear()
+            await asyncio.wait_for(self._wakeup.wait(), timeout=timeout)
+
+        return self.buffer.popleft()
+
+
+class EventBus:
+    def __init__(
+        self,
+        history_size: int = DEFAULT_HISTORY_SIZE,
+        subscriber_buffer_size: int = DEFAULT_SUBSCRIBER_BUFFER_SIZE,
+    ) -> None:
+        self.history: deque[JobEvent] = deque(maxlen=history_size)
+        self.subscriber_buffer_size = subscriber_buffer_size
+        self.subscriptions: set[Subscription] = set()
+        self.closed = False
+        self._next_id = 1
+
+    def publish(self, event_type: EventType, job: Job, **data: Any) -> JobEvent:
+        event = JobEvent(
+            id=self._next_id,
+            type=event_type,
+            time=datetime.datetime.now(ZoneInfo("Asia/Tokyo")),
+            job_key=job.key,
+            data=jsonable_encoder(data),
+        )
+        self._next_id += 1
+
+        self.history.append(event)
+        for subscription in self.subscriptions:
+            subscription.push(event)
+
+        return event
+
+    @contextmanager
+    def subscribe(self, last_event_id: Optional[int] = None) -> Iterator[Subscription]:
+        """
+        Subscribe to events published after ``last_event_id``.
+
+        Events still in the history are replayed first. An id newer than any
+        known event (e.g. from before a server restart) replays the whole
+        history. Subscriptions to a closed bus end after the replay.
+        """
+        backlog: list[JobEvent] = []
+        if last_event_id is not None:
+            if last_event_id >= self._next_id:
+                last_event_id = 0
+            backlog = [event for event in self.history if event.id > last_event_id]
+
+        subscription = Subscription(
+            buffer_size=self.subscriber_buffer_size + len(backlog),
+            backlog=backlog,
+        )
+        if self.closed:
+            subscription.close()
+        else:
+            self.subscriptions.add(subscription)
+
+        try:
+            yield subscription
+        finally:
+            self.subscriptions.discard(subscription)
+
+    def close(self) -> None:
+        """End all subscriptions, e.g. on shutdown. Publishing still records history."""
+        self.closed = True
+        for subscription in self.subscriptions:
+            subscription.close()
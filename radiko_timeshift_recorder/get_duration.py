@@ -4,6 +4,16 @@ from pathlib import Path
 
 from logzero import logger
 
+from radiko_timeshift_recorder.mp4 import Mp4Error, read_audio_duration
+from radiko_timeshift_recorder.process_output import (
+    OutputTail,
+    pump_lines,
+    read_bounded,
+)
+
+# ffprobe prints a few hundred bytes of JSON for a single stream entry.
+_MAX_FFPROBE_OUTPUT_BYTES = 1024 * 1024
+
 
 class FFprobeError(RuntimeError):
     pass
@@ -23,6 +33,18 @@ def parse_ffprobe_duration(stdout: bytes) -> float:
 
 
 async def get_duration(filepath: Path) -> float:
+    """
+    Seconds of the audio stream of ``filepath``, read from its MP4 boxes, or by
+    ffprobe if they cannot be read.
+    """
+    try:
+        return await asyncio.to_thread(read_audio_duration, filepath)
+    except (Mp4Error, OSError) as e:
+        logger.debug(f"Falling back to ffprobe for {filepath}: {e}")
+    return await get_duration_with_ffprobe(filepath)
+
+
+async def get_duration_with_ffprobe(filepath: Path) -> float:
     command = [
         "ffprobe",
         "-v",
@@ -44,14 +66,18 @@ async def get_duration(filepath: Path) -> float:
         stderr=asyncio.subprocess.PIPE,
     )
 
-    stdout, stderr = await proc.communicate()
+    stderr_tail = OutputTail()
+    assert proc.stdout is not None and proc.stderr is not None
+    stdout, _ = await asyncio.gather(
+        read_bounded(proc.stdout, _MAX_FFPROBE_OUTPUT_BYTES),
+        pump_lines(proc.stderr, stderr_tail.append),
+    )
+    await proc.wait()
 
     if proc.returncode != 0:
-        logger.debug(f"stdout: {stdout.decode().strip()}")
-        logger.debug(f"stderr: {stderr.decode().strip()}")
-        raise FFprobeError(
-            f"Failed to run ffprobe on {filepath}: {stderr.decode().strip()}"
-        )
+        logger.debug(f"stdout: {stdout.decode(errors='replace').strip()}")
+        logger.debug(f"stderr: {stderr_tail.text()}")
+        raise FFprobeError(f"Failed to run ffprobe on {filepath}: {stderr_tail.text()}")
 
     try:
         return parse_ffprobe_duration(stdout)
@@ -37,6 +37,11 @@ class Job(BaseModel):
         # Check if the program has already finished
         return self.program.to < datetime.datetime.now(ZoneInfo("Asia/Tokyo"))
 
+    @property
+    def key(self) -> str:
+        # Identifies the job in the server API, e.g. TBS_20250101050000.
+        return f"{self.station_id}_{self.program.ft.strftime('%Y%m%d%H%M%S')}"
+
     @property
     def url(self) -> str:
         return f"https://radiko.jp/#!/ts/{self.station_id}/{self.program.ft.strftime('%Y%m%d%H%M%S')}"
@@ -1,5 +1,20 @@
 import asyncio
-from typing import Any, Generic, Protocol, TypeVar
+import copy
+import heapq
+import time
+from enum import Enum
+from typing import (
+    AbstractSet,
+    Any,
+    Callable,
+    Generic,
+    Hashable,
+    Iterable,
+    Mapping,
+    Optional,
+    Protocol,
+    TypeVar,
+)
 
 
 class _SupportsLt(Protocol):
@@ -13,29 +28,218 @@ class JobAlreadyExistsError(Exception):
     pass
 
 
+class Priority(str, Enum):
+    """Lane of the job queue, by who asked for the job."""
+
+    INTERACTIVE = "interactive"
+    RULES = "rules"
+    BACKFILL = "backfill"
+
+    def outranks(self, other: "Priority") -> bool:
+        lanes = list(Priority)
+        return lanes.index(self) < lanes.index(other)
+
+
+# Jobs each lane gets for every job of the backfill lane, while all lanes have
+# jobs. Lower lanes are never starved.
+DEFAULT_LANE_WEIGHTS: Mapping[Priority, int] = {
+    Priority.INTERACTIVE: 16,
+    Priority.RULES: 4,
+    Priority.BACKFILL: 1,
+}
+
+
+class LaneScheduler:
+    """
+    Smooth weighted round robin between the lanes that have jobs.
+
+    Each pick credits every waiting lane with its weight and takes from the
+    lane with the most credit, which then pays the total weight of the
+    waiting lanes. A lane of weight w among lanes of total weight W is picked
+    w out of every W times, spread evenly.
+    """
+
+    def __init__(self, weights: Mapping[Priority, int] = DEFAULT_LANE_WEIGHTS):
+        self.weights = dict(weights)
+        self.credits: dict[Priority, int] = {lane: 0 for lane in Priority}
+
+    def pick(self, lanes: Iterable[Priority]) -> Priority:
+        waiting = sorted(set(lanes), key=list(Priority).index)
+        if not waiting:
+            raise ValueError("No lane has jobs")
+        for lane in waiting:
+            self.credits[lane] += self.weights[lane]
+        # Ties go to the higher lane.
+        picked = max(waiting, key=lambda lane: self.credits[lane])
+        self.credits[picked] -= sum(self.weights[lane] for lane in waiting)
+        return picked
+
+    def order(self, lanes: Mapping[Priority, list[T]]) -> list[T]:
+        """Interleave lanes of sorted jobs in the order this scheduler picks them."""
+        scheduler = copy.deepcopy(self)
+        remaining = {lane: list(reversed(jobs)) for lane, jobs in lanes.items() if jobs}
+        ordered = []
+        while remaining:
+            lane = scheduler.pick(remaining)
+            ordered.append(remaining[lane].pop())
+            if not remaining[lane]:
+                del remaining[lane]
+        return ordered
+
+
+class JobQueueBackend(Protocol[T]):
+    """What the server needs of a job queue; ``JobQueue`` or a shared job store."""
+
+    @property
+    def pending(self) -> AbstractSet[T]: ...
+
+    @property
+    def in_progress(self) -> AbstractSet[T]: ...
+
+    @property
+    def enqueued_at(self) -> Mapping[T, float]: ...
+
+    @property
+    def priorities(self) -> Mapping[T, Priority]: ...
+
+    async def put(self, job: T, priority: Priority = Priority.RULES) -> bool: ...
+
+    async def get(self) -> T: ...
+
+    async def mark_done(self, job: T) -> None: ...
+
+    async def requeue(self, job: T) -> None: ...
+
+    def pending_in_order(self) -> list[T]: ...
+
+    def qsize(self) -> int: ...
+
+
+class Lane(Generic[T]):
+    """
+    Jobs of one priority, ordered by the jobs themselves.
+
+    With ``fair_key``, jobs are kept in one sub-queue per key, e.g. per
+    station, and ``pop`` takes from the sub-queues in turn, so that a key
+    with many jobs does not hold up the others.
+    """
+
+    def __init__(self, fair_key: Optional[Callable[[T], Hashable]] = None) -> None:
+        self.fair_key = fair_key
+        # Sub-queues in the order of their turns.
+        self.queues: dict[Hashable, list[T]] = {}
+
+    def __len__(self) -> int:
+        return sum(len(queue) for queue in self.queues.values())
+
+    def push(self, job: T) -> None:
+        key = self.fair_key(job) if self.fair_key is not None else None
+        heapq.heappush(self.queues.setdefault(key, []), job)
+
+    def remove(self, job: T) -> None:
+        key = self.fair_key(job) if self.fair_key is not None else None
+        queue = self.queues[key]
+        queue.remove(job)
+        heapq.heapify(queue)
+        if not queue:
+            del self.queues[key]
+
+    def pop(self) -> T:
+        key, queue = next(iter(self.queues.items()))
+        job = heapq.heappop(queue)
+        # The sub-queue goes to the back for its next turn.
+        del self.queues[key]
+        if queue:
+            self.queues[key] = queue
+        return job
+
+    def in_order(self) -> list[T]:
+        """Jobs in the order ``pop`` takes them."""
+        queues = [sorted(queue, reverse=True) for queue in self.queues.values()]
+        ordered = []
+        while queues:
+            ordered += [queue.pop() for queue in queues]
+            queues = [queue for queue in queues if queue]
+        return ordered
+
+
 class JobQueue(Generic[T]):
-    def __init__(self) -> None:
-        self.queue: asyncio.PriorityQueue[T] = asyncio.PriorityQueue()
+    """
+    Jobs in one ``Lane`` per ``Priority``. ``get`` takes from the lanes by
+    ``scheduler``, and within each lane round robin between the values of
+    ``fair_key`` if it is given.
+    """
+
+    def __init__(
+        self,
+        scheduler: Optional[LaneScheduler] = None,
+        *,
+        fair_key: Optional[Callable[[T], Hashable]] = None,
+    ) -> None:
+        self.lanes: dict[Priority, Lane[T]] = {
+            lane: Lane(fair_key) for lane in Priority
+        }
+        self.scheduler = scheduler if scheduler is not None else LaneScheduler()
         self.pending: set[T] = set()
         self.in_progress: set[T] = set()
+        # Wall-clock time each pending or in-progress job was put.
+        self.enqueued_at: dict[T, float] = {}
+        self.priorities: dict[T, Priority] = {}
+        self._put_event = asyncio.Event()
+
+    async def put(self, job: T, priority: Priority = Priority.RULES) -> bool:
+        """
+        Queue ``job`` in the lane of ``priority`` and return True, or return
+        False if it was pending in a lower lane and has been moved up instead.
+        """
+        if job in self.pending and priority.outranks(self.priorities[job]):
+            self.lanes[self.priorities[job]].remove(job)
+            self.lanes[priority].push(job)
+            self.priorities[job] = priority
+            return False
 
-    async def put(self, job: T) -> None:
         if job in self.pending or job in self.in_progress:
             raise JobAlreadyExistsError(
                 f"Job {job} already exists in queue or is in progress."
             )
 
-        await self.queue.put(job)
+        self.lanes[priority].push(job)
         self.pending.add(job)
+        self.enqueued_at[job] = time.time()
+        self.priorities[job] = priority
+        self._put_event.set()
+        return True
 
     async def get(self) -> T:
-        job = await self.queue.get()
+        while not self.pending:
+            self._put_event.clear()
+            await self._put_event.wait()
+
+        priority = self.scheduler.pick(
+            priority for priority, lane in self.lanes.items() if lane
+        )
+        job = self.lanes[priority].pop()
         self.pending.remove(job)
         self.in_progress.add(job)
         return job
 
-    def mark_done(self, job: T) -> None:
+    async def mark_done(self, job: T) -> None:
+        self.in_progress.remove(job)
+        del self.enqueued_at[job]
+        del self.priorities[job]
+
+    async def requeue(self, job: T) -> None:
+        """Give back a job taken by ``get`` without working on it."""
         self.in_progress.remove(job)
+        self.lanes[self.priorities[job]].push(job)
+        self.pending.add(job)
+        self._put_event.set()
+
+    def pending_in_order(self) -> list[T]:
+        """Pending jobs in the order workers will get them."""
+        return self.scheduler.order(
+            {priority: lane.in_order() for priority, lane in self.lanes.items()}
+        )
 
     def qsize(self) -> int:
-        return self.queue.qsize()
+        return len(self.pending)
@@ -0,0 +1,419 @@
+"""
+Job queue in an SQLite database shared by several recorder nodes.
+
+Each node takes jobs under a lease that it renews while it works on them.
+Jobs whose lease has expired, e.g. because their node crashed, are pending
+again and are taken by the next node that asks for a job.
+"""
+
+import asyncio
+import os
+import socket
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing
+from pathlib import Path
+from typing import Any, Callable, NamedTuple, Optional, TypeVar
+
+from logzero import logger
+
+from radiko_timeshift_recorder.job import Job
+from radiko_timeshift_recorder.job_queue import (
+    JobAlreadyExistsError,
+    LaneScheduler,
+    Priority,
+)
+
+DEFAULT_LEASE_SECONDS = 120.0
+# How often get() looks for jobs put by other nodes, and the view of the
+# queue is refreshed.
+DEFAULT_POLL_INTERVAL = 5.0
+# SQLite waits this long for the lock of another node before giving up, so
+# that the thread of the store is never blocked for long ...
+BUSY_TIMEOUT_SECONDS = 1.0
+# ... and operations are tried again for this long.
+LOCK_RETRY_SECONDS = 30.0
+LOCK_RETRY_INTERVAL = 0.5
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    job TEXT PRIMARY KEY,
+    program_to REAL NOT NULL,
+    program_ft REAL NOT NULL,
+    enqueued_at REAL NOT NULL,
+    owner TEXT,
+    lease_expires_at REAL,
+    priority TEXT NOT NULL DEFAULT 'rules'
+)
+"""
+# Databases made before jobs had priorities.
+_ADD_PRIORITY = "ALTER TABLE jobs ADD COLUMN priority TEXT NOT NULL DEFAULT 'rules'"
+# Pending jobs have no owner or an expired lease.
+_PENDING = "(owner IS NULL OR lease_expires_at < :now)"
+# Same as the order of Job.
+_ORDER = "ORDER BY program_to, program_ft"
+# Lanes by rank, highest first, for comparing priorities in SQL.
+_PRIORITY_RANK = (
+    "CASE priority "
+    + " ".join(f"WHEN '{lane.value}' THEN {rank}" for rank, lane in enumerate(Priority))
+    + " END"
+)
+
+V = TypeVar("V")
+
+
+class _QueuedJob(NamedTuple):
+    job: Job
+    priority: Priority
+    enqueued_at: float
+    # None while no node has the job.
+    lease_expires_at: Optional[float]
+
+    def is_pending(self, now: float) -> bool:
+        return self.lease_expires_at is None or self.lease_expires_at < now
+
+
+def _is_locked(e: sqlite3.OperationalError) -> bool:
+    # Extended result codes keep the primary code in their lowest byte.
+    return (e.sqlite_errorcode & 0xFF) in (sqlite3.SQLITE_BUSY, sqlite3.SQLITE_LOCKED)
+
+
+def default_node_id() -> str:
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+
+class SqliteJobQueue:
+    """
+    ``JobQueue`` backed by an SQLite database, for several nodes at once.
+
+    A job is identified by its JSON, so putting a job that is pending or in
+    progress on any node raises ``JobAlreadyExistsError`` as ``JobQueue`` does.
+    ``renew_leases`` must run while the node has workers.
+
+    The database is only used from a thread of its own, so that waiting for
+    the lock of another node never blocks the event loop. ``pending`` and the
+    other views of the queue are read from a copy of the table, which is
+    refreshed after each change by this node and every ``poll_interval``.
+    """
+
+    def __init__(
+        self,
+        path: Path,
+        *,
+        node_id: Optional[str] = None,
+        lease_seconds: float = DEFAULT_LEASE_SECONDS,
+        poll_interval: float = DEFAULT_POLL_INTERVAL,
+        scheduler: Optional[LaneScheduler] = None,
+    ) -> None:
+        self.path = path
+        self.node_id = node_id if node_id is not None else default_node_id()
+        self.lease_seconds = lease_seconds
+        self.poll_interval = poll_interval
+        # Each node takes from the lanes by its own scheduler.
+        self.scheduler = scheduler if scheduler is not None else LaneScheduler()
+        # Jobs leased by this node.
+        self.leased: set[Job] = set()
+        # Claims and requeues still running after get was cancelled.
+        self._returning: set[asyncio.Future[Any]] = set()
+        self._put_event = asyncio.Event()
+        self._executor = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="job-store"
+        )
+        # Parsed jobs by their JSON, so that refreshes only parse new jobs.
+        self._parsed: dict[str, Job] = {}
+        self._jobs: list[_QueuedJob] = []
+
+        # Autocommit, so that each claim runs in its own BEGIN IMMEDIATE.
+        # No WAL: it does not work on network filesystems. The connection is
+        # created here but used from the thread of the executor.
+        self._connection = sqlite3.connect(
+            path,
+            timeout=BUSY_TIMEOUT_SECONDS,
+            isolation_level=None,
+            check_same_thread=False,
+        )
+        self._connection.execute(_SCHEMA)
+        columns = {
+            row[1] for row in self._connection.execute("PRAGMA table_info(jobs)")
+        }
+        if "priority" not in columns:
+            self._connection.execute(_ADD_PRIORITY)
+        self._refresh()
+
+    def close(self) -> None:
+        self._executor.shutdown()
+        self._connection.close()
+
+    async def _run(self, operation: Callable[[], V]) -> V:
+        """Run ``operation`` in the thread of the database, retrying while it is locked."""
+        loop = asyncio.get_running_loop()
+        deadline = time.monotonic() + LOCK_RETRY_SECONDS
+        while True:
+            try:
+                return await loop.run_in_executor(self._executor, operation)
+            except sqlite3.OperationalError as e:
+                if not _is_locked(e) or time.monotonic() >= deadline:
+                    raise
+                logger.debug(f"Job store {self.path} is locked; retrying: {e}")
+            await asyncio.sleep(LOCK_RETRY_INTERVAL)
+
+    def _job(self, job_json: str) -> Job:
+        job = self._parsed.get(job_json)
+        if job is None:
+            job = self._parsed[job_json] = Job.model_validate_json(job_json)
+        return job
+
+    def _refresh(self) -> None:
+        rows = self._connection.execute(
+            "SELECT job, priority, enqueued_at, owner, lease_expires_at "
+            f"FROM jobs {_ORDER}"
+        ).fetchall()
+        jobs = []
+        parsed = {}
+        for job_json, priority, enqueued_at, owner, lease_expires_at in rows:
+            job = parsed[job_json] = self._job(job_json)
+            jobs.append(
+                _QueuedJob(
+                    job=job,
+                    priority=Priority(priority),
+                    enqueued_at=enqueued_at,
+                    lease_expires_at=lease_expires_at if owner is not None else None,
+                )
+            )
+        self._parsed = parsed
+        self._jobs = jobs
+
+    def _refresh_after_write(self) -> None:
+        # The write is done, so the operation must not be retried for this.
+        try:
+            self._refresh()
+        except sqlite3.OperationalError as e:
+            logger.debug(f"Failed to refresh the jobs of {self.path}: {e}")
+
+    async def refresh(self) -> None:
+        """Read the jobs of all nodes again."""
+        await self._run(self._refresh)
+
+    @property
+    def pending(self) -> set[Job]:
+        now = time.time()
+        return {job.job for job in self._jobs if job.is_pending(now)}
+
+    @property
+    def in_progress(self) -> set[Job]:
+        now = time.time()
+        return {job.job for job in self._jobs if not job.is_pending(now)}
+
+    @property
+    def enqueued_at(self) -> dict[Job, float]:
+        return {job.job: job.enqueued_at for job in self._jobs}
+
+    @property
+    def priorities(self) -> dict[Job, Priority]:
+        return {job.job: job.priority for job in self._jobs}
+
+    def pending_in_order(self) -> list[Job]:
+        now = time.time()
+        lanes: dict[Priority, list[Job]] = {}
+        for job in self._jobs:
+            if job.is_pending(now):
+                lanes.setdefault(job.priority, []).append(job.job)
+        return self.scheduler.order(lanes)
+
+    def qsize(self) -> int:
+        return len(self.pending)
+
+    def _insert(self, job: Job, priority: Priority) -> bool:
+        try:
+            self._connection.execute(
+                "INSERT INTO jobs (job, program_to, program_ft, enqueued_at, priority) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (
+                    job.model_dump_json(),
+                    job.program.to.timestamp(),
+                    job.program.ft.timestamp(),
+                    time.time(),
+                    priority.value,
+                ),
+            )
+        except sqlite3.IntegrityError:
+            # Pending in a lower lane, unless some node has taken it.
+            cursor = self._connection.execute(
+                f"UPDATE jobs SET priority = :priority WHERE job = :job "
+                f"AND {_PENDING} AND {_PRIORITY_RANK} > :rank",
+                {
+                    "priority": priority.value,
+                    "job": job.model_dump_json(),
+                    "now": time.time(),
+                    "rank": list(Priority).index(priority),
+                },
+            )
+            if cursor.rowcount == 0:
+                raise JobAlreadyExistsError(
+                    f"Job {job} already exists in queue or is in progress."
+                )
+            self._refresh_after_write()
+            return False
+        self._refresh_after_write()
+        return True
+
+    async def put(self, job: Job, priority: Priority = Priority.RULES) -> bool:
+        """
+        Queue ``job`` in the lane of ``priority`` and return True, or return
+        False if it was pending in a lower lane and has been moved up instead.
+        """
+        queued = await self._run(lambda: self._insert(job, priority))
+        self._put_event.set()
+        return queued
+
+    def _claim(self) -> Optional[Job]:
+        now = time.time()
+        with closing(self._connection.cursor()) as cursor:
+            # Lock the database for writing before reading, so that no other
+            # node claims the same job in between.
+            cursor.execute("BEGIN IMMEDIATE")
+            try:
+                lanes = [
+                    Priority(priority)
+                    for (priority,) in cursor.execute(
+                        f"SELECT DISTINCT priority FROM jobs WHERE {_PENDING}",
+                        {"now": now},
+                    )
+                ]
+                if not lanes:
+                    cursor.execute("COMMIT")
+                    return None
+
+                row = cursor.execute(
+                    f"SELECT job, owner FROM jobs WHERE {_PENDING} "
+                    f"AND priority = :priority {_ORDER} LIMIT 1",
+                    {"now": now, "priority": self.scheduler.pick(lanes).value},
+                ).fetchone()
+
+                job_json, previous_owner = row
+                cursor.execute(
+                    "UPDATE jobs SET owner = ?, lease_expires_at = ? WHERE job = ?",
+                    (self.node_id, now + self.lease_seconds, job_json),
+                )
+                cursor.execute("COMMIT")
+            except BaseException:
+                cursor.execute("ROLLBACK")
+                raise
+
+        job = self._job(job_json)
+        self.leased.add(job)
+        self._refresh_after_write()
+        if previous_owner is not None:
+            logger.warning(
+                f"Reclaimed job with an expired lease of {previous_owner}: {job}"
+            )
+        return job
+
+    async def get(self) -> Job:
+        while True:
+            self._put_event.clear()
+            # The claim runs on in the thread of the database if get is
+            # cancelled, e.g. when the worker pool shrinks, so it is shielded
+            # and a job it takes is given back.
+            claim = asyncio.ensure_future(self._run(self._claim))
+            try:
+                job = await asyncio.shield(claim)
+            except asyncio.CancelledError:
+                self._returning.add(claim)
+                claim.add_done_callback(self._return_claimed)
+                raise
+            except sqlite3.OperationalError as e:
+                logger.warning(f"Failed to take a job from {self.path}: {e}")
+                job = None
+            if job is not None:
+                return job
+
+            try:
+                await asyncio.wait_for(self._put_event.wait(), self.poll_interval)
+            except TimeoutError:
+                pass
+
+    def _return_claimed(self, claim: "asyncio.Future[Optional[Job]]") -> None:
+        self._returning.discard(claim)
+        if claim.cancelled() or claim.exception() is not None:
+            return
+        job = claim.result()
+        if job is not None:
+            task = asyncio.ensure_future(self.requeue(job))
+            self._returning.add(task)
+            task.add_done_callback(self._returning.discard)
+
+    def _requeue(self, job: Job) -> None:
+        self.leased.discard(job)
+        self._connection.execute(
+            "UPDATE jobs SET owner = NULL, lease_expires_at = NULL "
+            "WHERE job = ? AND owner = ?",
+            (job.model_dump_json(), self.node_id),
+        )
+        self._refresh_after_write()
+
+    async def requeue(self, job: Job) -> None:
+        """Give back a job taken by ``get`` without working on it."""
+        try:
+            # Finished even if the caller is cancelled, so the lease is not kept.
+            await asyncio.shield(self._run(lambda: self._requeue(job)))
+        except sqlite3.OperationalError as e:
+            # Pending again once its lease expires.
+            logger.warning(f"Failed to give back job to {self.path}: {e}")
+            return
+        self._put_event.set()
+
+    def _delete(self, job: Job) -> None:
+        self.leased.discard(job)
+        self._connection.execute(
+            "DELETE FROM jobs WHERE job = ? AND owner = ?",
+            (job.model_dump_json(), self.node_id),
+        )
+        self._refresh_after_write()
+
+    async def mark_done(self, job: Job) -> None:
+        await self._run(lambda: self._delete(job))
+
+    def renew(self) -> None:
+        """Extend the leases of the jobs this node is working on."""
+        expires_at = time.time() + self.lease_seconds
+        for job in self.leased:
+            cursor = self._connection.execute(
+                "UPDATE jobs SET lease_expires_at = ? WHERE job = ? AND owner = ?",
+                (expires_at, job.model_dump_json(), self.node_id),
+            )
+            if cursor.rowcount == 0:
+                logger.warning(f"Lost the lease of job to another node: {job}")
+        self._refresh_after_write()
+
+    async def renew_leases(self) -> None:
+        """
+        Renew leases well before they expire, and refresh the view of the
+        queue every ``poll_interval`` in between, until cancelled.
+        """
+        renew_interval = self.lease_seconds / 3
+        renewed_at = time.monotonic()
+        while True:
+            await asyncio.sleep(min(self.poll_interval, renew_interval))
+            try:
+                if time.monotonic() - renewed_at >= renew_interval:
+                    await self._run(self.renew)
+                    renewed_at = time.monotonic()
+                else:
+                    await self.refresh()
+            except sqlite3.OperationalError as e:
+                # Renewed at the next turn, well before the leases expire.
+                logger.warning(f"Failed to update the jobs in {self.path}: {e}")
+
+    def _release(self) -> None:
+        self._connection.execute(
+            "UPDATE jobs SET owner = NULL, lease_expires_at = NULL WHERE owner = ?",
+            (self.node_id,),
+        )
+        self.leased.clear()
+        self._refresh_after_write()
+
+    async def release(self) -> None:
+        """Return the jobs this node is working on to the other nodes, e.g. on shutdown."""
+        await self._run(self._release)
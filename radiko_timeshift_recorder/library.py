@@ -0,0 +1,177 @@
+"""Index of recorded programs, so finished work is skipped without touching the output tree."""
+
+import datetime
+import os
+import tempfile
+import threading
+from pathlib import Path
+from typing import Iterable, Optional
+from zoneinfo import ZoneInfo
+
+from logzero import logger
+from pydantic import AwareDatetime, BaseModel, ValidationError
+
+from radiko_timeshift_recorder.job import Job
+from radiko_timeshift_recorder.radiko import StationId
+
+# Recordings are named "<ft> - <title>[ - <pfm>].mp4" by generate_filename_candidates.
+_FILENAME_FT_FORMAT = "%Y-%m-%d %H-%M-%S"
+_FILENAME_FT_LENGTH = len("2025-01-01 05-00-00")
+
+LibraryKey = tuple[StationId, datetime.datetime]
+
+
+class LibraryEntry(BaseModel):
+    station_id: StationId
+    ft: AwareDatetime
+    path: str
+    # Seconds of the program, known for recordings added by the recorder but
+    # not for those found by a scan.
+    dur: Optional[int] = None
+
+    @property
+    def key(self) -> str:
+        # Same as Job.key, e.g. TBS_20250101050000.
+        return f"{self.station_id}_{self.ft.strftime('%Y%m%d%H%M%S')}"
+
+
+def entry_from_path(out_dir: Path, path: Path) -> Optional[LibraryEntry]:
+    """
+    Parse a recording at ``out_dir/<station_id>/<title>/<filename>.mp4``.
+
+    Returns ``None`` for other files, such as temporary files of downloads in
+    progress.
+    """
+    relative = path.relative_to(out_dir)
+    if len(relative.parts) != 3 or path.suffix != ".mp4":
+        return None
+
+    try:
+        ft = datetime.datetime.strptime(
+            path.name[:_FILENAME_FT_LENGTH], _FILENAME_FT_FORMAT
+        ).replace(tzinfo=ZoneInfo("Asia/Tokyo"))
+    except ValueError:
+        return None
+
+    return LibraryEntry(station_id=relative.parts[0], ft=ft, path=str(path))
+
+
+def scan_library(out_dir: Path) -> list[LibraryEntry]:
+    entries = []
+    for path in out_dir.glob("*/*/*.mp4"):
+        entry = entry_from_path(out_dir, path)
+        if entry is not None:
+            entries.append(entry)
+    return entries
+
+
+class LibraryIndex:
+    """
+    Recorded programs keyed by ``(station_id, ft)``, held in memory.
+
+    The index is persisted as an append-only JSON lines file, which is read
+    once on startup. ``rebuild`` replaces it with a scan of ``out_dir``, e.g.
+    after recordings were added or removed by hand. Safe to use from the event
+    loop and a thread running ``rebuild`` at the same time.
+
+    Once the index has been loaded or built from a scan, it is ``complete``
+    and programs missing from it need not be looked for on disk.
+    """
+
+    def __init__(self, path: Path, out_dir: Path) -> None:
+        self.path = path
+        self.out_dir = out_dir
+        self.entries: dict[LibraryKey, LibraryEntry] = {}
+        self._lock = threading.Lock()
+        # Entries added while a rebuild is scanning, which the scan may miss.
+        self._added_during_rebuild: Optional[list[LibraryEntry]] = None
+        self.complete = False
+
+    @classmethod
+    def open(cls, path: Path, out_dir: Path) -> "LibraryIndex":
+        """Load the index at ``path``, building it from ``out_dir`` if it is missing."""
+        index = cls(path, out_dir)
+        if path.exists():
+            index.load()
+        else:
+            index.rebuild()
+        return index
+
+    def load(self) -> None:
+        entries: dict[LibraryKey, LibraryEntry] = {}
+        with self.path.open(encoding="utf-8") as f:
+            for line_number, line in enumerate(f, start=1):
+                try:
+                    entry = LibraryEntry.model_validate_json(line)
+                except ValidationError:
+                    # A line cut short by a crash; later lines are still valid.
+                    logger.warning(
+                        f"Skipping invalid line {line_number} of {self.path}"
+                    )
+                    continue
+                entries[(entry.station_id, entry.ft)] = entry
+
+        with self._lock:
+            self.entries = entries
+            # The file is only ever written by a rebuild and appended to.
+            self.complete = True
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def contains(self, job: Job) -> bool:
+        return (job.station_id, job.program.ft) in self.entries
+
+    def add(self, job: Job, path: Path) -> None:
+        entry = LibraryEntry(
+            station_id=job.station_id,
+            ft=job.program.ft,
+            path=str(path),
+            dur=job.program.dur,
+        )
+        with self._lock:
+            self.entries[(entry.station_id, entry.ft)] = entry
+            if self._added_during_rebuild is not None:
+                self._added_during_rebuild.append(entry)
+            with self.path.open("a", encoding="utf-8") as f:
+                f.write(entry.model_dump_json() + "\n")
+
+    def rebuild(self) -> int:
+        """Replace the index with a scan of ``out_dir`` and return its size."""
+        with self._lock:
+            self._added_during_rebuild = []
+
+        try:
+            scanned = scan_library(self.out_dir)
+        finally:
+            with self._lock:
+                added, self._added_during_rebuild = self._added_during_rebuild, None
+
+        entries = {(e.station_id, e.ft): e for e in [*scanned, *(added or [])]}
+        with self._lock:
+            # A scan cannot tell the durations of the programs; keep the known ones.
+            for key, entry in entries.items():
+                known = self.entries.get(key)
+                if entry.dur is None and known is not None and known.path == entry.path:
+                    entries[key] = entry.model_copy(update={"dur": known.dur})
+            self._write(entries.values())
+            self.entries = entries
+            self.complete = True
+
+        logger.info(
+            f"Rebuilt the library index {self.path} with {len(entries)} entries"
+        )
+        return len(entries)
+
+    def _write(self, entries: Iterable[LibraryEntry]) -> None:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with tempfile.NamedTemporaryFile(
+            mode="w",
+            encoding="utf-8",
+            dir=self.path.parent,
+            prefix=f".{self.path.name}.",
+            delete=False,
+        ) as f:
+            for entry in entries:
+                f.write(entry.model_dump_json() + "\n")
+        os.replace(f.name, self.path)
@@ -0,0 +1,146 @@
+"""Prometheus metrics of the job server, exposed at ``GET /metrics``."""
+
+import tenacity
+from prometheus_client import CollectorRegistry, Counter, Gauge, Histogram
+
+REGISTRY = CollectorRegistry()
+
+JOB_QUEUE_SIZE = Gauge(
+    "radiko_job_queue_size",
+    "Number of jobs in the priority queue.",
+    registry=REGISTRY,
+)
+JOBS_PENDING = Gauge(
+    "radiko_jobs_pending",
+    "Number of jobs waiting for a worker.",
+    registry=REGISTRY,
+)
+JOBS_IN_PROGRESS = Gauge(
+    "radiko_jobs_in_progress",
+    "Number of jobs being processed by a worker.",
+    registry=REGISTRY,
+)
+WORKERS = Gauge(
+    "radiko_workers",
+    "Number of running workers.",
+    registry=REGISTRY,
+)
+WORKERS_BUSY = Gauge(
+    "radiko_workers_busy",
+    "Number of workers processing a job.",
+    registry=REGISTRY,
+)
+WORKER_BUSY_RATIO = Gauge(
+    "radiko_worker_busy_ratio",
+    "Fraction of workers processing a job.",
+    registry=REGISTRY,
+)
+
+JOB_QUEUE_WAIT_SECONDS = Histogram(
+    "radiko_job_queue_wait_seconds",
+    "Time from putting a job to a worker taking it.",
+    buckets=(1, 10, 60, 300, 900, 1800, 3600, 7200, 14400, 43200, 86400),
+    registry=REGISTRY,
+)
+JOB_PROCESSING_SECONDS = Histogram(
+    "radiko_job_processing_seconds",
+    "Time a worker spends on a job, including retries.",
+    buckets=(1, 10, 30, 60, 120, 300, 600, 1200, 1800, 3600, 7200, 14400),
+    registry=REGISTRY,
+)
+JOB_FAILURES = Counter(
+    "radiko_job_failures",
+    "Jobs that failed after all retries, by exception type.",
+    ["cause"],
+    registry=REGISTRY,
+)
+
+DOWNLOAD_BYTES = Counter(
+    "radiko_download_bytes",
+    "Bytes of recordings written by ffmpeg.",
+    registry=REGISTRY,
+)
+DOWNLOAD_REALTIME_RATIO = Histogram(
+    "radiko_download_realtime_ratio",
+    "Wall-clock download time divided by the program duration.",
+    buckets=(0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1, 2),
+    registry=REGISTRY,
+)
+DOWNLOAD_RETRIES = Counter(
+    "radiko_download_retries",
+    "Download attempts that failed and will be retried, by exception type.",
+    ["cause"],
+    registry=REGISTRY,
+)
+VALIDATION_SECONDS = Histogram(
+    "radiko_validation_seconds",
+    "Time to read the duration of a recording for validation.",
+    buckets=(0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10),
+    registry=REGISTRY,
+)
+SALVAGES = Counter(
+    "radiko_salvages",
+    "Recordings of the wrong duration trimmed or completed with their missing "
+    "tail instead of being downloaded again, by kind and result.",
+    ["kind", "result"],
+    registry=REGISTRY,
+)
+
+DISK_RESERVED_BYTES = Gauge(
+    "radiko_disk_reserved_bytes",
+    "Estimated size of the recordings of running jobs.",
+    registry=REGISTRY,
+)
+ADMISSION_WAIT_SECONDS = Histogram(
+    "radiko_admission_wait_seconds",
+    "Time workers waited for free disk space before taking a job.",
+    buckets=(1, 10, 60, 300, 900, 1800, 3600, 7200, 14400, 43200, 86400),
+    registry=REGISTRY,
+)
+JOBS_REJECTED = Counter(
+    "radiko_jobs_rejected",
+    "Jobs rejected because the queue was full.",
+    registry=REGISTRY,
+)
+
+UPSTREAM_STREAMS = Gauge(
+    "radiko_upstream_streams",
+    "Number of streams being downloaded from radiko.",
+    registry=REGISTRY,
+)
+UPSTREAM_STREAM_LIMIT = Gauge(
+    "radiko_upstream_stream_limit",
+    "Current limit of concurrent streams, lowered after upstream errors.",
+    registry=REGISTRY,
+)
+UPSTREAM_STREAM_START_RATE = Gauge(
+    "radiko_upstream_stream_start_rate",
+    "Current limit of stream starts per second, lowered after upstream errors.",
+    registry=REGISTRY,
+)
+UPSTREAM_WAIT_SECONDS = Histogram(
+    "radiko_upstream_wait_seconds",
+    "Time downloads waited for the upstream limiter before starting a stream.",
+    buckets=(0.1, 1, 5, 10, 30, 60, 300, 900, 1800, 3600),
+    registry=REGISTRY,
+)
+
+BANDWIDTH_BYTES_PER_SECOND = Gauge(
+    "radiko_bandwidth_bytes_per_second",
+    "Total bytes per second of shaped downloads over the last few seconds.",
+    registry=REGISTRY,
+)
+BANDWIDTH_LIMIT = Gauge(
+    "radiko_bandwidth_limit_bytes_per_second",
+    "Current limit of the total bytes per second of downloads, +Inf if unlimited.",
+    registry=REGISTRY,
+)
+
+
+def failure_cause(exception: BaseException) -> str:
+    """Name the exception type, looking through tenacity's ``RetryError``."""
+    if isinstance(exception, tenacity.RetryError):
+        last_exception = exception.last_attempt.exception()
+        if last_exception is not None:
+            exception = last_exception
+    return type(exception).__name__
@@ -0,0 +1,171 @@
+"""
+Reader of the duration of the audio track of an MP4 file from its boxes.
+
+Only the box headers of the top level are read until ``moov``, so a recording
+of any length takes a few small reads. Files it cannot make sense of, such as
+fragmented MP4, raise ``Mp4Error`` so the caller can fall back to ffprobe.
+"""
+
+import struct
+from pathlib import Path
+from typing import BinaryIO, Iterator, Optional
+
+# moov holds the sample tables of the whole file, which for an hour of AAC is
+# a few hundred KiB.
+_MAX_MOOV_SIZE = 64 * 1024 * 1024
+
+
+class Mp4Error(ValueError):
+    pass
+
+
+def _boxes(data: bytes) -> Iterator[tuple[bytes, bytes]]:
+    """(type, payload) of the boxes in ``data``."""
+    end = len(data)
+    offset = 0
+    while offset + 8 <= end:
+        size, box_type = struct.unpack_from(">I4s", data, offset)
+        header_size = 8
+        if size == 1:
+            if offset + 16 > end:
+                raise Mp4Error("Truncated box header")
+            (size,) = struct.unpack_from(">Q", data, offset + 8)
+            header_size = 16
+        elif size == 0:
+            size = end - offset
+        if size < header_size or offset + size > end:
+            raise Mp4Error(f"Invalid size of box {box_type!r}")
+        yield box_type, data[offset + header_size : offset + size]
+        offset += size
+
+
+def _child(data: bytes, box_type: bytes) -> Optional[bytes]:
+    return next((payload for t, payload in _boxes(data) if t == box_type), None)
+
+
+def _read_moov(f: BinaryIO) -> bytes:
+    """Seek over the top-level boxes, e.g. mdat, to read the payload of moov."""
+    while header := f.read(8):
+        if len(header) < 8:
+            break
+        size, box_type = struct.unpack(">I4s", header)
+        header_size = 8
+        if size == 1:
+            (size,) = struct.unpack(">Q", f.read(8))
+            header_size = 16
+        elif size == 0:
+            # The last box runs to the end of the file.
+            if box_type != b"moov":
+                break
+            return f.read(_MAX_MOOV_SIZE)
+        if size < header_size:
+            raise Mp4Error(f"Invalid size of top-level box {box_type!r}")
+
+        if box_type == b"moov":
+            if size - header_size > _MAX_MOOV_SIZE:
+                raise Mp4Error(f"moov box of {size} bytes is too large")
+            payload = f.read(size - header_size)
+            if len(payload) < size - header_size:
+                raise Mp4Error("Truncated moov box")
+            return payload
+        f.seek(size - header_size, 1)
+
+    raise Mp4Error("No moov box")
+
+
+def _full_box_version(payload: bytes) -> int:
+    if not payload:
+        raise Mp4Error("Empty full box")
+    return payload[0]
+
+
+def _timescale_and_duration(payload: bytes) -> tuple[int, int]:
+    """Timescale and duration of an mvhd or mdhd box, which share their layout."""
+    try:
+        if _full_box_version(payload) == 1:
+            timescale, duration = struct.unpack_from(">IQ", payload, 4 + 16)
+            unknown = duration == 2**64 - 1
+        else:
+            timescale, duration = struct.unpack_from(">II", payload, 4 + 8)
+            unknown = duration == 2**32 - 1
+    except struct.error as e:
+        raise Mp4Error(f"Truncated header box: {e}") from e
+    if timescale == 0 or unknown:
+        raise Mp4Error("Header box has no duration")
+    return timescale, duration
+
+
+def _edits(edts: bytes) -> list[tuple[int, int]]:
+    """
+    Duration in the movie timescale and media time of the non-empty edits of
+    an edit list.
+    """
+    elst = _child(edts, b"elst")
+    if elst is None:
+        return []
+    try:
+        version = _full_box_version(elst)
+        (count,) = struct.unpack_from(">I", elst, 4)
+        entry_format = ">QqI" if version == 1 else ">IiI"
+        entry_size = struct.calcsize(entry_format)
+        entries = [
+            struct.unpack_from(entry_format, elst, 8 + i * entry_size)
+            for i in range(count)
+        ]
+    except struct.error as e:
+        raise Mp4Error(f"Truncated elst box: {e}") from e
+    # Edits with a media time of -1 are empty and delay the track instead.
+    return [
+        (duration, media_time)
+        for duration, media_time, _ in entries
+        if media_time != -1
+    ]
+
+
+def _is_audio_track(mdia: bytes) -> bool:
+    hdlr = _child(mdia, b"hdlr")
+    return hdlr is not None and hdlr[8:12] == b"soun"
+
+
+def audio_duration_from_moov(moov: bytes) -> float:
+    """Seconds of the first audio track, as ffprobe reports it for the stream."""
+    if _child(moov, b"mvex") is not None:
+        raise Mp4Error("Fragmented MP4 is not supported")
+
+    mvhd = _child(moov, b"mvhd")
+    if mvhd is None:
+        raise Mp4Error("No mvhd box")
+    movie_timescale, _ = _timescale_and_duration(mvhd)
+
+    for box_type, trak in _boxes(moov):
+        if box_type != b"trak":
+            continue
+        mdia = _child(trak, b"mdia")
+        if mdia is None or not _is_audio_track(mdia):
+            continue
+
+        mdhd = _child(mdia, b"mdhd")
+        if mdhd is None:
+            raise Mp4Error("No mdhd box in the audio track")
+        timescale, duration = _timescale_and_duration(mdhd)
+
+        edts = _child(trak, b"edts")
+        edits = _edits(edts) if edts is not None else []
+        edited = sum(edit_duration for edit_duration, _ in edits)
+        if not edited:
+            return duration / timescale
+        # ffmpeg rounds edits up to the movie timescale, usually milliseconds,
+        # while ffprobe counts the samples of the track from the first edit.
+        return min(edited / movie_timescale, (duration - edits[0][1]) / timescale)
+
+    raise Mp4Error("No audio track")
+
+
+def read_audio_duration(path: Path) -> float:
+    """Seconds of the first audio track of the MP4 file at ``path``."""
+    try:
+        with path.open("rb") as f:
+            moov = _read_moov(f)
+        return audio_duration_from_moov(moov)
+    except struct.error as e:
+        raise Mp4Error(f"Malformed MP4 file {path}: {e}") from e
@@ -0,0 +1,177 @@
+"""Two-process pipeline wired together without a shell."""
+
+import asyncio
+import fcntl
+import os
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable, Optional, Sequence
+
+from logzero import logger
+
+from radiko_timeshift_recorder.process_output import OutputTail, pump_lines
+
+# Large enough to hold a couple of seconds of even a high bitrate stream, so
+# the source and sink are not woken up for every 64 KiB (the Linux default).
+DEFAULT_PIPE_SIZE = 1024 * 1024
+# Bytes relayed at a time when the stream is throttled.
+RELAY_CHUNK_SIZE = 64 * 1024
+
+
+class PipelineError(RuntimeError):
+    def __init__(
+        self, message: str, failed: Sequence["PipelineProcessResult"] = ()
+    ) -> None:
+        super().__init__(message)
+        # Processes that exited with an error.
+        self.failed = list(failed)
+
+
+@dataclass
+class PipelineProcessResult:
+    name: str
+    returncode: Optional[int] = None
+    stderr_tail: OutputTail = field(default_factory=OutputTail)
+
+    def describe(self) -> str:
+        return f"{self.name} exited with {self.returncode}: {self.stderr_tail.text()}"
+
+
+def create_pipe(size: int = DEFAULT_PIPE_SIZE) -> tuple[int, int]:
+    """
+    Create a pipe and try to resize its buffer to ``size`` bytes.
+
+    Resizing uses ``F_SETPIPE_SZ`` and is only available on Linux; where it is
+    missing or the size exceeds ``/proc/sys/fs/pipe-max-size`` for an
+    unprivileged process, the pipe keeps its default size.
+    """
+    read_fd, write_fd = os.pipe()
+
+    f_setpipe_sz: Optional[int] = getattr(fcntl, "F_SETPIPE_SZ", None)
+    if f_setpipe_sz is not None:
+        try:
+            fcntl.fcntl(write_fd, f_setpipe_sz, size)
+        except OSError as e:
+            logger.debug(f"Failed to set pipe size to {size}: {e}")
+
+    return read_fd, write_fd
+
+
+async def run_pipeline(
+    source: tuple[str, Sequence[str]],
+    sink: tuple[str, Sequence[str]],
+    *,
+    pipe_size: int = DEFAULT_PIPE_SIZE,
+    on_sink_stdout_line: Optional[Callable[[str], None]] = None,
+    on_source_exit: Optional[Callable[[int], None]] = None,
+    throttle: Optional[Callable[[int], Awaitable[None]]] = None,
+) -> tuple[PipelineProcessResult, PipelineProcessResult]:
+    """
+    Run ``source | sink`` where each side is a ``(name, argv)`` pair.
+
+    Both processes are exec'd directly and connected by a pipe of
+    ``pipe_size`` bytes. The exit status and stderr tail of each process is
+    returned, and ``PipelineError`` is raised if either of them failed.
+    ``on_source_exit`` is called with the source's exit status as soon as it
+    exits, while the sink may still be draining the pipe.
+
+    With a ``throttle``, the stream is relayed through this process instead,
+    and ``throttle`` is awaited with the size of each chunk before it is
+    passed on to the sink.
+    """
+    source_name, source_command = source
+    sink_name, sink_command = sink
+    source_result = PipelineProcessResult(name=source_name)
+    sink_result = PipelineProcessResult(name=sink_name)
+
+    # Without a throttle the processes are connected directly, so the stream
+    # never passes through this process.
+    pipe_fds = create_pipe(pipe_size) if throttle is None else None
+    source_stdout = pipe_fds[1] if pipe_fds is not None else asyncio.subprocess.PIPE
+    sink_stdin = pipe_fds[0] if pipe_fds is not None else asyncio.subprocess.PIPE
+    try:
+        source_proc = await asyncio.create_subprocess_exec(
+            *source_command,
+            stdin=asyncio.subprocess.DEVNULL,
+            stdout=source_stdout,
+            stderr=asyncio.subprocess.PIPE,
+        )
+        try:
+            sink_proc = await asyncio.create_subprocess_exec(
+                *sink_command,
+                stdin=sink_stdin,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE,
+            )
+        except BaseException:
+            source_proc.kill()
+            await source_proc.wait()
+            raise
+    finally:
+        # The children hold their own copies; closing ours lets the source see
+        # EPIPE if the sink exits and the sink see EOF once the source exits.
+        if pipe_fds is not None:
+            for fd in pipe_fds:
+                os.close(fd)
+
+    sink_stdout_tail = OutputTail()
+
+    def on_stdout_line(line: str) -> None:
+        sink_stdout_tail.append(line)
+        if on_sink_stdout_line is not None:
+            on_sink_stdout_line(line)
+
+    async def wait_source() -> None:
+        assert source_proc.stderr is not None
+        await pump_lines(source_proc.stderr, source_result.stderr_tail.append)
+        source_result.returncode = await source_proc.wait()
+        if on_source_exit is not None:
+            on_source_exit(source_result.returncode)
+
+    async def relay() -> None:
+        assert throttle is not None
+        assert source_proc.stdout is not None and sink_proc.stdin is not None
+        try:
+            while chunk := await source_proc.stdout.read(RELAY_CHUNK_SIZE):
+                await throttle(len(chunk))
+                sink_proc.stdin.write(chunk)
+                await sink_proc.stdin.drain()
+            sink_proc.stdin.close()
+            await sink_proc.stdin.wait_closed()
+        except (BrokenPipeError, ConnectionResetError):
+            # The sink exited; stop the source as a broken pipe would.
+            if source_proc.returncode is None:
+                source_proc.kill()
+            await discard_source_stdout()
+
+    async def discard_source_stdout() -> None:
+        # The source is not waited for until its stdout is read to the end.
+        if source_proc.stdout is not None:
+            while await source_proc.stdout.read(RELAY_CHUNK_SIZE):
+                pass
+
+    assert sink_proc.stdout is not None and sink_proc.stderr is not None
+    try:
+        await asyncio.gather(
+            wait_source(),
+            pump_lines(sink_proc.stdout, on_stdout_line),
+            pump_lines(sink_proc.stderr, sink_result.stderr_tail.append),
+            *([relay()] if throttle is not None else []),
+        )
+        sink_result.returncode = await sink_proc.wait()
+    except BaseException:
+        for proc in (source_proc, sink_proc):
+            if proc.returncode is None:
+                proc.kill()
+        await asyncio.gather(
+            discard_source_stdout(), source_proc.wait(), sink_proc.wait()
+        )
+        raise
+
+    failed = [r for r in (source_result, sink_result) if r.returncode != 0]
+    if failed:
+        logger.debug(f"{sink_name} stdout: {sink_stdout_tail.text()}")
+        for result in (source_result, sink_result):
+            logger.debug(f"{result.name} stderr: {result.stderr_tail.text()}")
+        raise PipelineError("; ".join(r.describe() for r in failed), failed)
+
+    return source_result, sink_result
@@ -0,0 +1,55 @@
+"""Incremental, bounded handling of child process output."""
+
+import asyncio
+import re
+from collections import deque
+from typing import Callable
+
+DEFAULT_TAIL_LINES = 50
+
+_READ_CHUNK_SIZE = 64 * 1024
+_MAX_LINE_LENGTH = 4096
+# ffmpeg and streamlink redraw status lines with a bare carriage return.
+_LINE_SEPARATOR = re.compile(rb"\r\n|\r|\n")
+
+
+class OutputTail:
+    """Keeps the last ``max_lines`` lines of a stream for error reporting."""
+
+    def __init__(self, max_lines: int = DEFAULT_TAIL_LINES) -> None:
+        self.lines: deque[str] = deque(maxlen=max_lines)
+
+    def append(self, line: str) -> None:
+        if line:
+            self.lines.append(line)
+
+    def text(self) -> str:
+        return "\n".join(self.lines)
+
+
+async def pump_lines(
+    stream: asyncio.StreamReader, on_line: Callable[[str], None]
+) -> None:
+    """
+    Read ``stream`` until EOF and call ``on_line`` with each stripped line.
+
+    Memory use is bounded by the read chunk size: a line longer than
+    ``_MAX_LINE_LENGTH`` only keeps its last ``_MAX_LINE_LENGTH`` bytes.
+    """
+    partial = b""
+    while chunk := await stream.read(_READ_CHUNK_SIZE):
+        *lines, partial = _LINE_SEPARATOR.split(partial + chunk)
+        for line in lines:
+            on_line(line[-_MAX_LINE_LENGTH:].decode(errors="replace").strip())
+        partial = partial[-_MAX_LINE_LENGTH:]
+
+    if partial:
+        on_line(partial.decode(errors="replace").strip())
+
+
+async def read_bounded(stream: asyncio.StreamReader, max_bytes: int) -> bytes:
+    """Read ``stream`` until EOF, keeping at most the first ``max_bytes`` bytes."""
+    data = bytearray()
+    while chunk := await stream.read(_READ_CHUNK_SIZE):
+        data += chunk[: max(0, max_bytes - len(data))]
+    return bytes(data)
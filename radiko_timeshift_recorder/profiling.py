@@ -0,0 +1,68 @@
+"""Sampling profiler for a running process, reporting collapsed stacks."""
+
+import os
+import sys
+import threading
+from collections import Counter
+from types import FrameType
+from typing import Optional
+
+DEFAULT_SAMPLE_INTERVAL = 0.005
+
+
+def _frame_label(frame: FrameType) -> str:
+    code = frame.f_code
+    return (
+        f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+    )
+
+
+def collapse_stack(thread_name: str, frame: FrameType) -> str:
+    """Format a stack root first as ``thread;outer (file:line);...;inner (file:line)``."""
+    labels: list[str] = []
+    current: Optional[FrameType] = frame
+    while current is not None:
+        labels.append(_frame_label(current))
+        current = current.f_back
+    labels.append(thread_name)
+    return ";".join(reversed(labels))
+
+
+class SamplingProfiler:
+    """
+    Sample the stacks of all other threads every ``interval`` seconds.
+
+    Sampling runs in a daemon thread, so the profiled code is only paused for
+    as long as it takes to walk the stacks. ``collapsed()`` reports the counts
+    in the collapsed-stack format read by flamegraph.pl and speedscope.
+    """
+
+    def __init__(self, interval: float = DEFAULT_SAMPLE_INTERVAL) -> None:
+        self.interval = interval
+        self.samples: Counter[str] = Counter()
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(
+            target=self._run, name="sampling-profiler", daemon=True
+        )
+
+    def _run(self) -> None:
+        own_ident = threading.get_ident()
+        while not self._stopped.wait(self.interval):
+            thread_names = {t.ident: t.name for t in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own_ident:
+                    continue
+                thread_name = thread_names.get(ident, f"thread-{ident}")
+                self.samples[collapse_stack(thread_name, frame)] += 1
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stopped.set()
+        self._thread.join()
+
+    def collapsed(self) -> str:
+        return "".join(
+            f"{stack} {count}\n" for stack, count in self.samples.most_common()
+        )
@@ -0,0 +1,77 @@
+"""Progress of a running download, parsed from ``ffmpeg -progress`` output."""
+
+import datetime
+import time
+from dataclasses import dataclass, field
+from typing import Callable, Literal, Optional
+
+ProgressEventType = Literal["progress", "retried"]
+
+
+@dataclass
+class DownloadProgress:
+    total_size: int = 0
+    out_time: float = 0.0
+    speed: Optional[float] = None
+    updated_at: Optional[float] = None
+    attempt: int = 1
+    last_error: Optional[str] = None
+    # Size of the finished recording, which salvaging may have trimmed or
+    # completed after ffmpeg reported ``total_size``.
+    file_size: int = 0
+    # Called after each complete ffmpeg progress report and before each retry.
+    listeners: list[Callable[["DownloadProgress", ProgressEventType], None]] = field(
+        default_factory=list, repr=False, compare=False
+    )
+
+    def _notify(self, event_type: ProgressEventType) -> None:
+        for listener in self.listeners:
+            listener(self, event_type)
+
+    def record_retry(self, error: BaseException) -> None:
+        self.attempt += 1
+        self.last_error = str(error)
+        self._notify("retried")
+
+    def reset(self) -> None:
+        self.total_size = 0
+        self.out_time = 0.0
+        self.speed = None
+        self.updated_at = None
+
+    def update_from_ffmpeg_line(self, line: str) -> None:
+        """
+        Apply one ``key=value`` line of ``ffmpeg -progress`` output.
+
+        Values that are not available yet (``N/A``) and unknown keys are ignored.
+        ``updated_at`` is a ``time.monotonic()`` timestamp. Listeners are
+        notified on the ``progress=`` line that ends each report.
+        """
+        key, sep, value = line.partition("=")
+        if not sep or value == "N/A":
+            return
+
+        if key == "progress":
+            self._notify("progress")
+            return
+
+        try:
+            if key == "total_size":
+                self.total_size = int(value)
+            elif key == "out_time_us":
+                self.out_time = int(value) / 1_000_000
+            elif key == "speed":
+                self.speed = float(value.rstrip("x"))
+            else:
+                return
+        except ValueError:
+            return
+
+        self.updated_at = time.monotonic()
+
+
+@dataclass
+class RunningJob:
+    worker_id: int
+    started_at: datetime.datetime
+    progress: DownloadProgress = field(default_factory=DownloadProgress)
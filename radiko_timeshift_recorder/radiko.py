@@ -2,27 +2,105 @@ from __future__ import annotations
 
 import datetime
 import functools
+import os
 import re
 from typing import Annotated, Any, Optional
+from urllib.parse import urlsplit
 from zoneinfo import ZoneInfo
 
 import requests
 from logzero import logger
 from pydantic import AwareDatetime, BeforeValidator, ConfigDict
 from pydantic_xml import BaseXmlModel, attr, element, wrapped
+from requests.adapters import HTTPAdapter
+
+from radiko_timeshift_recorder import tracing
+from radiko_timeshift_recorder.upstream import TokenBucket
 
 AreaId = str
 ProgramId = str
 StationId = str
 
 
+RADIKO_BASE_URL_ENV = "RADIKO_BASE_URL"
+DEFAULT_RADIKO_BASE_URL = "https://radiko.jp"
+
+# Hosts of the web API and of the timeshift streams, as used by streamlink's
+# radiko plugin, and by the plugin as the Dockerfile patches it.
+_RADIKO_HOSTS = (
+    "radiko.jp",
+    "tf-rpaa.smartstream.ne.jp",
+    "tf-f-rpaa-radiko.smartstream.ne.jp",
+)
+
+# How long after its broadcast a program can be played back, and recorded.
+TIMESHIFT_WINDOW = datetime.timedelta(days=7)
+
+# Schedule requests per second of this process, e.g. for the eight days of
+# fetch_all_jobs. Each process has its own bucket: concurrent CLI runs are not
+# limited together, nor by the UpstreamLimiter of run-server.
+SCHEDULE_REQUEST_RATE = 1.0
+SCHEDULE_REQUESTS = TokenBucket(max_rate=SCHEDULE_REQUEST_RATE, burst=4)
+
+
 class OutOfAreaError(Exception):
     pass
 
 
+def radiko_base_url() -> str:
+    """
+    Base URL of the radiko API, overridable with the ``RADIKO_BASE_URL``
+    environment variable to point at a local stand-in.
+    """
+    return os.environ.get(RADIKO_BASE_URL_ENV, DEFAULT_RADIKO_BASE_URL).rstrip("/")
+
+
+def is_radiko_base_url_overridden() -> bool:
+    return radiko_base_url() != DEFAULT_RADIKO_BASE_URL
+
+
+def rebase_radiko_url(url: str, base_url: str) -> str:
+    """Move a URL on one of the radiko hosts to ``base_url``, keeping path and query."""
+    parts = urlsplit(url)
+    if parts.hostname not in _RADIKO_HOSTS:
+        return url
+    return (
+        base_url.rstrip("/") + parts.path + (f"?{parts.query}" if parts.query else "")
+    )
+
+
+class RadikoBaseUrlAdapter(HTTPAdapter):
+    def __init__(self, base_url: str) -> None:
+        self.base_url = base_url
+        super().__init__()
+
+    def send(
+        self, request: requests.PreparedRequest, *args: Any, **kwargs: Any
+    ) -> requests.Response:
+        assert request.url is not None
+        request.url = rebase_radiko_url(request.url, self.base_url)
+        return super().send(request, *args, **kwargs)
+
+
+def mount_radiko_base_url(session: requests.Session) -> None:
+    """
+    Send the session's requests for radiko hosts to ``radiko_base_url()``.
+
+    This redirects third-party code such as streamlink's radiko plugin, which
+    has the hosts built in. Does nothing unless the base URL is overridden.
+    """
+    if not is_radiko_base_url_overridden():
+        return
+
+    adapter = RadikoBaseUrlAdapter(radiko_base_url())
+    for host in _RADIKO_HOSTS:
+        for scheme in ("http", "https"):
+            session.mount(f"{scheme}://{host}/", adapter)
+
+
 @functools.cache
 def fetch_area_id() -> AreaId:
-    response = requests.get("https://radiko.jp/area", timeout=10)
+    response = requests.get(f"{radiko_base_url()}/area", timeout=10)
 
     response.encoding = response.apparent_encoding
     match = re.search(r'class="(.+)"', response.text)
@@ -82,10 +160,16 @@ class Schedule(BaseXmlModel, tag="radiko", search_mode="unordered"):
 
 
 def fetch_schedule(date: datetime.date) -> Schedule:
-    area_id = fetch_area_id()
-
-    response = requests.get(
-        f"https://radiko.jp/v3/program/date/{date.strftime('%Y%m%d')}/{area_id}.xml"
-    )
-
-    return Schedule.from_xml(response.content)
+    with tracing.span("fetch_schedule", date=date.isoformat()):
+        area_id = fetch_area_id()
+
+        SCHEDULE_REQUESTS.acquire_blocking()
+        response = requests.get(
+            f"{radiko_base_url()}/v3/program/date/{date.strftime('%Y%m%d')}/{area_id}.xml"
+        )
+        if response.status_code == 429 or response.status_code >= 500:
+            SCHEDULE_REQUESTS.slow_down()
+        else:
+            SCHEDULE_REQUESTS.speed_up()
+
+        return Schedule.from_xml(response.content)
@@ -0,0 +1,124 @@
+"""On-disk cache of HLS segments shared by concurrent and later downloads."""
+
+import os
+import re
+import tempfile
+from pathlib import Path
+from typing import Optional
+
+from logzero import logger
+
+from radiko_timeshift_recorder.radiko import StationId
+
+DEFAULT_MAX_BYTES = 2 * 1024**3
+
+# Segment timestamp in the cache key, e.g. 20250101050000.
+SegmentTimestamp = str
+
+_SEGMENT_SUFFIX = ".seg"
+_URI_TIMESTAMP_PATTERN = re.compile(r"(?<!\d)(\d{8})_?(\d{6})(?!\d)")
+
+
+def segment_timestamp_from_uri(uri: str) -> Optional[SegmentTimestamp]:
+    """
+    Extract a ``YYYYmmddHHMMSS`` timestamp from a segment URI.
+
+    Accepts both ``20250101050000`` and ``20250101_050000`` forms and returns
+    ``None`` if the URI carries no timestamp.
+    """
+    match = _URI_TIMESTAMP_PATTERN.search(uri.rsplit("?", 1)[0])
+    if not match:
+        return None
+    return SegmentTimestamp(match.group(1) + match.group(2))
+
+
+class SegmentCache:
+    """
+    Bounded cache of segments keyed by ``(station_id, segment timestamp)``.
+
+    Each segment is a file under ``root/<station_id>/``. Several recorder
+    processes may share the same root, so writes go through a temporary file
+    and an atomic rename, and recency is tracked with the file mtime, which is
+    bumped on every hit. ``evict`` removes the least recently used segments
+    until the total size fits in ``max_bytes``.
+    """
+
+    def __init__(self, root: Path, max_bytes: int = DEFAULT_MAX_BYTES) -> None:
+        if max_bytes <= 0:
+            raise ValueError(f"max_bytes must be positive, got {max_bytes}")
+
+        self.root = root
+        self.max_bytes = max_bytes
+        self._bytes_since_eviction = 0
+
+    def _path(self, station_id: StationId, timestamp: SegmentTimestamp) -> Path:
+        return self.root / station_id / f"{timestamp}{_SEGMENT_SUFFIX}"
+
+    def get(
+        self, station_id: StationId, timestamp: SegmentTimestamp
+    ) -> Optional[bytes]:
+        path = self._path(station_id, timestamp)
+        try:
+            data = path.read_bytes()
+        except FileNotFoundError:
+            return None
+
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            # Evicted by another process after we read it.
+            pass
+
+        return data
+
+    def put(
+        self, station_id: StationId, timestamp: SegmentTimestamp, data: bytes
+    ) -> None:
+        path = self._path(station_id, timestamp)
+        path.parent.mkdir(parents=True, exist_ok=True)
+
+        with tempfile.NamedTemporaryFile(
+            mode="w+b",
+            suffix=".tmp",
+            dir=path.parent,
+            delete=False,
+        ) as tmp_file:
+            tmp_file.write(data)
+        Path(tmp_file.name).replace(path)
+
+        # Scanning the whole cache on every put is too costly, so only evict
+        # once a tenth of the budget has been written since the last scan.
+        self._bytes_since_eviction += len(data)
+        if self._bytes_since_eviction >= self.max_bytes // 10:
+            self.evict()
+
+    def evict(self) -> int:
+        """Remove least recently used segments until the cache fits. Returns bytes freed."""
+        self._bytes_since_eviction = 0
+
+        entries: list[tuple[float, int, Path]] = []
+        for station_dir in self.root.glob("*"):
+            if not station_dir.is_dir():
+                continue
+            for path in station_dir.glob(f"*{_SEGMENT_SUFFIX}"):
+                try:
+                    stat = path.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+
+        total = sum(size for _, size, _ in entries)
+        freed = 0
+        for _, size, path in sorted(entries):
+            if total - freed <= self.max_bytes:
+                break
+            try:
+                path.unlink()
+            except FileNotFoundError:
+                continue
+            freed += size
+
+        if freed:
+            logger.debug(f"Evicted {freed} bytes from segment cache {self.root}")
+
+        return freed
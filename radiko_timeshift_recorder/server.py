@@ -1,76 +1,407 @@
 import asyncio
+import datetime
 import functools
-from contextlib import asynccontextmanager
-from typing import Awaitable, Callable
+import time
+from contextlib import asynccontextmanager, nullcontext
+from pathlib import Path
+from typing import Any, AsyncIterator, Awaitable, Callable, Coroutine, Optional
+from zoneinfo import ZoneInfo
 
-from fastapi import Depends, FastAPI, HTTPException, status
+from fastapi import (
+    Depends,
+    FastAPI,
+    Header,
+    HTTPException,
+    Query,
+    Request,
+    Response,
+    status,
+)
+from fastapi.responses import PlainTextResponse, StreamingResponse
 from logzero import logger
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
 
+from radiko_timeshift_recorder import metrics, tracing
+from radiko_timeshift_recorder.admission import DiskSpaceAdmission
+from radiko_timeshift_recorder.bandwidth import BandwidthShaper, BandwidthStatus
+from radiko_timeshift_recorder.checkpoint import load_checkpoint, save_checkpoint
+from radiko_timeshift_recorder.events import EventBus
 from radiko_timeshift_recorder.job import Job
-from radiko_timeshift_recorder.job_queue import JobAlreadyExistsError, JobQueue
+from radiko_timeshift_recorder.job_queue import (
+    JobAlreadyExistsError,
+    JobQueue,
+    JobQueueBackend,
+    Priority,
+)
+from radiko_timeshift_recorder.job_store import SqliteJobQueue
+from radiko_timeshift_recorder.library import LibraryEntry, LibraryIndex
+from radiko_timeshift_recorder.profiling import (
+    DEFAULT_SAMPLE_INTERVAL,
+    SamplingProfiler,
+)
+from radiko_timeshift_recorder.progress import (
+    DownloadProgress,
+    ProgressEventType,
+    RunningJob,
+)
+from radiko_timeshift_recorder.status import (
+    JobQueueStatus,
+    JobStatus,
+    find_job_status,
+    job_queue_status,
+)
+from radiko_timeshift_recorder.worker_pool import (
+    WorkerPool,
+    WorkerPoolBounds,
+    WorkerPoolStatus,
+)
 
 
 @functools.cache
-def get_job_queue() -> JobQueue[Job]:
+def get_job_queue() -> JobQueueBackend[Job]:
+    # Replaced through app.dependency_overrides to share jobs between nodes.
     return JobQueue()
 
 
+@functools.cache
+def get_running_jobs() -> dict[Job, RunningJob]:
+    return {}
+
+
+@functools.cache
+def get_event_bus() -> EventBus:
+    return EventBus()
+
+
+@functools.cache
+def get_profiler_lock() -> asyncio.Lock:
+    return asyncio.Lock()
+
+
+@functools.cache
+def get_library_rebuild_lock() -> asyncio.Lock:
+    return asyncio.Lock()
+
+
+def get_library(request: Request) -> LibraryIndex:
+    library: Optional[LibraryIndex] = getattr(request.app.state, "library", None)
+    if library is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Library index is not enabled",
+        )
+    return library
+
+
+# ffmpeg reports progress twice a second; subscribers get it less often.
+PROGRESS_EVENT_INTERVAL = 5.0
+SSE_KEEPALIVE_INTERVAL = 15.0
+MAX_PROFILE_SECONDS = 600.0
+# Suggested to clients whose job was rejected because the queue was full.
+QUEUE_FULL_RETRY_AFTER_SECONDS = 600
+DRAINING_RETRY_AFTER_SECONDS = 60
+DEFAULT_DRAIN_TIMEOUT = 300.0
+
+
+def publish_progress_events(
+    events: EventBus, job: Job
+) -> Callable[[DownloadProgress, ProgressEventType], None]:
+    last_published_at: Optional[float] = None
+
+    def listener(progress: DownloadProgress, event_type: ProgressEventType) -> None:
+        nonlocal last_published_at
+
+        if event_type == "retried":
+            events.publish(
+                "retried", job, attempt=progress.attempt, error=progress.last_error
+            )
+            return
+
+        now = time.monotonic()
+        if (
+            last_published_at is not None
+            and now - last_published_at < PROGRESS_EVENT_INTERVAL
+        ):
+            return
+        last_published_at = now
+        events.publish(
+            "progress",
+            job,
+            bytes_written=progress.total_size,
+            out_time=progress.out_time,
+            duration=job.program.dur,
+            speed=progress.speed,
+        )
+
+    return listener
+
+
+async def run_job(
+    id: int,
+    job: Job,
+    process_job: Callable[[Job, DownloadProgress], Awaitable[None]],
+    running_jobs: dict[Job, RunningJob],
+    events: EventBus,
+    admission: Optional[DiskSpaceAdmission] = None,
+) -> None:
+    running_job = running_jobs[job] = RunningJob(
+        worker_id=id, started_at=datetime.datetime.now(ZoneInfo("Asia/Tokyo"))
+    )
+    running_job.progress.listeners.append(publish_progress_events(events, job))
+    events.publish("started", job, worker_id=id)
+    started_at = time.monotonic()
+    try:
+        await process_job(job, running_job.progress)
+    except Exception as e:
+        cause = metrics.failure_cause(e)
+        metrics.JOB_FAILURES.labels(cause=cause).inc()
+        events.publish("failed", job, cause=cause, error=str(e))
+        logger.exception(f"Worker-{id} failed to process job: {job}")
+    else:
+        events.publish("completed", job, elapsed_seconds=time.monotonic() - started_at)
+        if admission is not None:
+            admission.observe(job, running_job.progress.file_size)
+    finally:
+        metrics.JOB_PROCESSING_SECONDS.observe(time.monotonic() - started_at)
+        del running_jobs[job]
+
+
 async def worker(
     id: int,
-    job_queue: JobQueue[Job],
-    process_job: Callable[[Job], Awaitable[None]],
+    job_queue: JobQueueBackend[Job],
+    process_job: Callable[[Job, DownloadProgress], Awaitable[None]],
+    running_jobs: dict[Job, RunningJob],
+    events: EventBus,
+    admission: Optional[DiskSpaceAdmission] = None,
+    pool: Optional[WorkerPool] = None,
 ) -> None:
     logger.info(f"Worker-{id} started")
+    # Job given back for lack of disk space, which is waited for before the next.
+    returned_job: Optional[Job] = None
 
     while True:
+        if pool is not None and pool.should_retire(id):
+            logger.info(f"Worker-{id} retired")
+            return
+        # Jobs stay queued, and can be taken by other nodes, while there is no
+        # disk space for them here.
+        if admission is not None:
+            await admission.wait_for_space(returned_job)
         job = await job_queue.get()
+        # Other workers may have taken the space in the meantime, or the job
+        # may need more than there is.
+        if admission is not None and not admission.has_space(job):
+            logger.info(f"Worker-{id} gave back job for lack of disk space: {job}")
+            await job_queue.requeue(job)
+            returned_job = job
+            continue
+        returned_job = None
+        if pool is not None:
+            pool.busy.add(id)
         logger.debug(f"Worker-{id} received job: {job}")
+        # A job store may not have seen the job in its copy of the queue yet.
+        enqueued_at = job_queue.enqueued_at.get(job, time.time())
+        metrics.JOB_QUEUE_WAIT_SECONDS.observe(time.time() - enqueued_at)
 
-        try:
-            await process_job(job)
-        except Exception:
-            logger.exception(f"Worker-{id} failed to process job: {job}")
+        # The trace of a job starts when it was put, so queue wait is its first stage.
+        enqueued_at_ns = int(enqueued_at * 1_000_000_000)
+        with (
+            # Reserved with nothing awaited since the check above.
+            admission.reserve(job) if admission is not None else nullcontext(),
+            tracing.span(
+                "job", start_time_ns=enqueued_at_ns, job_key=job.key, worker_id=id
+            ),
+        ):
+            tracing.record_span("queue_wait", start_time_ns=enqueued_at_ns)
+            await run_job(id, job, process_job, running_jobs, events, admission)
 
-        job_queue.mark_done(job)
+        await job_queue.mark_done(job)
+        if pool is not None:
+            pool.busy.discard(id)
         logger.debug(f"Worker-{id} finished job: {job}")
 
 
+def checkpoint_unfinished_jobs(path: Path, job_queue: JobQueueBackend[Job]) -> None:
+    # Jobs in progress are recorded again unless they finish first.
+    unfinished = sorted(job_queue.in_progress) + job_queue.pending_in_order()
+    count = save_checkpoint(path, unfinished)
+    logger.info(f"Saved {count} unfinished jobs to {path}")
+
+
+async def restore_checkpoint(path: Path, job_queue: JobQueueBackend[Job]) -> None:
+    jobs = load_checkpoint(path)
+    restored = 0
+    for job in jobs:
+        try:
+            await job_queue.put(job)
+            restored += 1
+        except JobAlreadyExistsError:
+            pass
+    path.unlink(missing_ok=True)
+    if jobs:
+        logger.info(f"Restored {restored} unfinished jobs from {path}")
+
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    app.state.worker_tasks = []
-
-    for i in range(app.state.num_workers):
-        logger.info(f"Starting worker-{i}")
-        app.state.worker_tasks.append(
-            asyncio.create_task(
-                worker(
-                    id=i, job_queue=get_job_queue(), process_job=app.state.process_job
-                )
-            )
+    job_queue = app.dependency_overrides.get(get_job_queue, get_job_queue)()
+
+    lease_renewal = None
+    if isinstance(job_queue, SqliteJobQueue):
+        logger.info(f"Sharing jobs in {job_queue.path} as node {job_queue.node_id}")
+        lease_renewal = asyncio.create_task(job_queue.renew_leases())
+
+    def spawn(worker_id: int) -> Coroutine[Any, Any, None]:
+        return worker(
+            id=worker_id,
+            job_queue=job_queue,
+            process_job=app.state.process_job,
+            running_jobs=get_running_jobs(),
+            events=get_event_bus(),
+            admission=getattr(app.state, "admission", None),
+            pool=pool,
         )
 
+    shaper: Optional[BandwidthShaper] = getattr(app.state, "bandwidth_shaper", None)
+    # A fixed pool of num_workers unless max_workers is larger. Workers are
+    # not added beyond what the current total bandwidth limit can feed.
+    pool = app.state.worker_pool = WorkerPool(
+        spawn,
+        WorkerPoolBounds(
+            min_workers=app.state.num_workers,
+            max_workers=max(
+                app.state.num_workers,
+                getattr(app.state, "max_workers", None) or 0,
+            ),
+        ),
+        pending=lambda: len(job_queue.pending),
+        bandwidth=shaper.current_limit if shaper is not None else lambda: None,
+        limiter=getattr(app.state, "worker_stream_limiter", None),
+    )
+    checkpoint_path: Optional[Path] = getattr(app.state, "checkpoint_path", None)
+    if checkpoint_path is not None:
+        await restore_checkpoint(checkpoint_path, job_queue)
+
+    app.state.draining = False
+    pool.scale()
+    autoscaling = asyncio.create_task(pool.autoscale())
+
     yield
 
-    for task in app.state.worker_tasks:
-        logger.info(f"Cancelling worker-{task.get_name()}")
-        task.cancel()
+    # Jobs put from now on would not be processed.
+    app.state.draining = True
+    if checkpoint_path is not None and lease_renewal is None:
+        # Saved before the drain as well, in case the process is killed before
+        # the drain ends.
+        checkpoint_unfinished_jobs(checkpoint_path, job_queue)
+    autoscaling.cancel()
+    await asyncio.gather(autoscaling, return_exceptions=True)
+    await pool.drain(getattr(app.state, "drain_timeout", 0.0))
+
+    get_event_bus().close()
 
-    await asyncio.gather(*app.state.worker_tasks, return_exceptions=True)
+    if lease_renewal is not None:
+        lease_renewal.cancel()
+        await asyncio.gather(lease_renewal, return_exceptions=True)
+        assert isinstance(job_queue, SqliteJobQueue)
+        # Other nodes need not wait for the leases of unfinished jobs to expire.
+        await job_queue.release()
+    elif checkpoint_path is not None:
+        # Without the jobs finished by the drain; those of cancelled workers
+        # are still in progress.
+        checkpoint_unfinished_jobs(checkpoint_path, job_queue)
 
 
 app = FastAPI(lifespan=lifespan)
 
 
+@app.get("/job_queue", response_model=JobQueueStatus)
+async def get_job_queue_status(
+    job_queue: JobQueueBackend[Job] = Depends(get_job_queue),
+    running_jobs: dict[Job, RunningJob] = Depends(get_running_jobs),
+) -> JobQueueStatus:
+    return job_queue_status(job_queue, running_jobs)
+
+
+@app.get(
+    "/job_queue/{key}",
+    response_model=JobStatus,
+    responses={status.HTTP_404_NOT_FOUND: {"description": "Job not found"}},
+)
+async def get_job_status(
+    key: str,
+    job_queue: JobQueueBackend[Job] = Depends(get_job_queue),
+    running_jobs: dict[Job, RunningJob] = Depends(get_running_jobs),
+) -> JobStatus:
+    job_status = find_job_status(job_queue, running_jobs, key)
+    if job_status is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Job not found in queue",
+        )
+
+    return job_status
+
+
 @app.post(
     "/job_queue",
     response_model=Job,
     status_code=status.HTTP_201_CREATED,
-    responses={status.HTTP_409_CONFLICT: {"description": "Job already exists"}},
+    responses={
+        status.HTTP_200_OK: {"description": "Pending job moved to a higher lane"},
+        status.HTTP_409_CONFLICT: {"description": "Job already exists"},
+        status.HTTP_429_TOO_MANY_REQUESTS: {"description": "Job queue is full"},
+        status.HTTP_503_SERVICE_UNAVAILABLE: {"description": "Shutting down"},
+    },
 )
-async def put_job(job: Job, job_queue: JobQueue[Job] = Depends(get_job_queue)) -> Job:
+async def put_job(
+    job: Job,
+    request: Request,
+    response: Response,
+    job_queue: JobQueueBackend[Job] = Depends(get_job_queue),
+    events: EventBus = Depends(get_event_bus),
+    priority: Priority = Query(default=Priority.RULES),
+) -> Job:
+    """
+    Queue ``job`` in the lane of ``priority``. Interactive jobs are taken
+    ahead of the other lanes and are accepted even when the queue is full.
+
+    A job that is already pending in a lower lane is moved to that of
+    ``priority``; otherwise an existing job is a conflict.
+    """
+    if getattr(request.app.state, "draining", False):
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Server is shutting down",
+            headers={"Retry-After": str(DRAINING_RETRY_AFTER_SECONDS)},
+        )
+
+    max_queue_size: Optional[int] = getattr(request.app.state, "max_queue_size", None)
+    if (
+        max_queue_size is not None
+        and priority != Priority.INTERACTIVE
+        and len(job_queue.pending) >= max_queue_size
+        and job not in job_queue.pending
+    ):
+        metrics.JOBS_REJECTED.inc()
+        logger.warning(f"Job queue is full, rejecting job: {job}")
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail="Job queue is full",
+            headers={"Retry-After": str(QUEUE_FULL_RETRY_AFTER_SECONDS)},
+        )
+
     try:
-        await job_queue.put(job)
-        logger.info(f"Put job to queue: {job}")
+        if not await job_queue.put(job, priority):
+            logger.info(f"Moved pending job to the {priority.value} lane: {job}")
+            response.status_code = status.HTTP_200_OK
+            return job
+        events.publish("enqueued", job, station_id=job.station_id, program=job.program)
+        logger.info(f"Put job to the {priority.value} lane of the queue: {job}")
+        # Start a worker for the job now rather than at the next autoscaling.
+        pool: Optional[WorkerPool] = getattr(request.app.state, "worker_pool", None)
+        if pool is not None:
+            pool.scale()
     except JobAlreadyExistsError:
         logger.debug(f"Job already exists in queue: {job}")
         raise HTTPException(
@@ -79,3 +410,187 @@ async def put_job(job: Job, job_queue: JobQueue[Job] = Depends(get_job_queue)) -
         )
 
     return job
+
+
+@app.get("/events", response_class=StreamingResponse)
+async def get_events(
+    request: Request,
+    last_event_id_header: Optional[int] = Header(default=None, alias="Last-Event-ID"),
+    last_event_id: Optional[int] = Query(default=None),
+    events: EventBus = Depends(get_event_bus),
+) -> StreamingResponse:
+    """
+    Server-sent events of the job lifecycle.
+
+    Clients resume with the standard ``Last-Event-ID`` header, or with the
+    ``last_event_id`` query parameter.
+    """
+    resume_from = (
+        last_event_id_header if last_event_id_header is not None else last_event_id
+    )
+
+    async def stream() -> AsyncIterator[str]:
+        with events.subscribe(last_event_id=resume_from) as subscription:
+            while not await request.is_disconnected():
+                try:
+                    event = await subscription.get(timeout=SSE_KEEPALIVE_INTERVAL)
+                except TimeoutError:
+                    yield ": keepalive\n\n"
+                    continue
+
+                if event is None:
+                    break
+                yield event.to_sse()
+
+    return StreamingResponse(stream(), media_type="text/event-stream")
+
+
+@app.get("/metrics", response_class=Response)
+async def get_metrics(
+    request: Request,
+    job_queue: JobQueueBackend[Job] = Depends(get_job_queue),
+) -> Response:
+    # Queue and worker gauges are sampled on scrape instead of being updated
+    # on every queue operation.
+    pool: Optional[WorkerPool] = getattr(request.app.state, "worker_pool", None)
+    num_workers = len(pool) if pool is not None else 0
+    # With a job store, jobs in progress include those of other nodes.
+    num_busy = len(pool.busy) if pool is not None else 0
+    metrics.JOB_QUEUE_SIZE.set(job_queue.qsize())
+    metrics.JOBS_PENDING.set(len(job_queue.pending))
+    metrics.JOBS_IN_PROGRESS.set(len(job_queue.in_progress))
+    metrics.WORKERS.set(num_workers)
+    metrics.WORKERS_BUSY.set(num_busy)
+    metrics.WORKER_BUSY_RATIO.set(num_busy / num_workers if num_workers else 0)
+    shaper: Optional[BandwidthShaper] = getattr(
+        request.app.state, "bandwidth_shaper", None
+    )
+    if shaper is not None:
+        bandwidth = shaper.status()
+        metrics.BANDWIDTH_BYTES_PER_SECOND.set(bandwidth.bytes_per_second)
+        metrics.BANDWIDTH_LIMIT.set(
+            bandwidth.limit if bandwidth.limit is not None else float("inf")
+        )
+
+    return Response(
+        content=generate_latest(metrics.REGISTRY), media_type=CONTENT_TYPE_LATEST
+    )
+
+
+@app.get(
+    "/library",
+    response_model=list[LibraryEntry],
+    responses={status.HTTP_404_NOT_FOUND: {"description": "Library not enabled"}},
+)
+async def get_library_entries(
+    library: LibraryIndex = Depends(get_library),
+) -> list[LibraryEntry]:
+    return sorted(library.entries.values(), key=lambda e: (e.ft, e.station_id))
+
+
+@app.post(
+    "/library/rebuild",
+    responses={
+        status.HTTP_404_NOT_FOUND: {"description": "Library not enabled"},
+        status.HTTP_409_CONFLICT: {"description": "Already rebuilding"},
+    },
+)
+async def rebuild_library(
+    library: LibraryIndex = Depends(get_library),
+    rebuild_lock: asyncio.Lock = Depends(get_library_rebuild_lock),
+) -> dict[str, int]:
+    """Rescan the output directory, e.g. after recordings were moved by hand."""
+    if rebuild_lock.locked():
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="The library is already being rebuilt",
+        )
+
+    async with rebuild_lock:
+        num_entries = await asyncio.to_thread(library.rebuild)
+
+    return {"entries": num_entries}
+
+
+def get_worker_pool(request: Request) -> WorkerPool:
+    pool: Optional[WorkerPool] = getattr(request.app.state, "worker_pool", None)
+    if pool is None:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Workers are not running",
+        )
+    return pool
+
+
+@app.get("/admin/workers", response_model=WorkerPoolStatus)
+async def get_workers(pool: WorkerPool = Depends(get_worker_pool)) -> WorkerPoolStatus:
+    return pool.status()
+
+
+@app.put("/admin/workers", response_model=WorkerPoolStatus)
+async def set_workers(
+    bounds: WorkerPoolBounds, pool: WorkerPool = Depends(get_worker_pool)
+) -> WorkerPoolStatus:
+    """
+    Change the bounds of the worker pool. Workers over the new maximum stop
+    after their current job.
+    """
+    await pool.set_bounds(bounds)
+    logger.info(f"Worker pool bounds set to {bounds.min_workers}..{bounds.max_workers}")
+    return pool.status()
+
+
+def get_bandwidth_shaper(request: Request) -> BandwidthShaper:
+    shaper: Optional[BandwidthShaper] = getattr(
+        request.app.state, "bandwidth_shaper", None
+    )
+    if shaper is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Bandwidth shaping is not enabled",
+        )
+    return shaper
+
+
+@app.get(
+    "/admin/bandwidth",
+    response_model=BandwidthStatus,
+    responses={status.HTTP_404_NOT_FOUND: {"description": "Shaping not enabled"}},
+)
+async def get_bandwidth(
+    shaper: BandwidthShaper = Depends(get_bandwidth_shaper),
+) -> BandwidthStatus:
+    """Current bandwidth limits and the total rate of the shaped downloads."""
+    return shaper.status()
+
+
+@app.post(
+    "/admin/profile",
+    response_class=PlainTextResponse,
+    responses={status.HTTP_409_CONFLICT: {"description": "Already profiling"}},
+)
+async def profile(
+    seconds: float = Query(default=10.0, gt=0, le=MAX_PROFILE_SECONDS),
+    interval: float = Query(default=DEFAULT_SAMPLE_INTERVAL, gt=0, le=1),
+    profiler_lock: asyncio.Lock = Depends(get_profiler_lock),
+) -> str:
+    """
+    Sample the stacks of the running server for ``seconds`` and return them
+    in the collapsed-stack format, e.g. for flamegraph.pl or speedscope.
+    """
+    if profiler_lock.locked():
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="A profile is already running",
+        )
+
+    async with profiler_lock:
+        profiler = SamplingProfiler(interval=interval)
+        profiler.start()
+        try:
+            await asyncio.sleep(seconds)
+        finally:
+            await asyncio.to_thread(profiler.stop)
+
+    logger.info(f"Profiled the server for {seconds} seconds")
+    return profiler.collapsed()
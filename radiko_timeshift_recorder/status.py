@@ -0,0 +1,140 @@
+"""Status of queued and running jobs, built from in-memory server state."""
+
+import datetime
+from typing import Literal, Optional
+from zoneinfo import ZoneInfo
+
+from pydantic import AwareDatetime, BaseModel
+
+from radiko_timeshift_recorder.job import Job
+from radiko_timeshift_recorder.job_queue import JobQueueBackend, Priority
+from radiko_timeshift_recorder.progress import RunningJob
+
+
+class JobProgressStatus(BaseModel):
+    worker_id: int
+    started_at: AwareDatetime
+    bytes_written: int
+    out_time: float
+    duration: int
+    speed: Optional[float]
+    eta_seconds: Optional[float]
+
+
+class JobStatus(BaseModel):
+    key: str
+    job: Job
+    state: Literal["pending", "in_progress"]
+    enqueued_at: Optional[AwareDatetime]
+    priority: Optional[Priority] = None
+    progress: Optional[JobProgressStatus] = None
+
+
+class JobQueueStatus(BaseModel):
+    pending: list[JobStatus]
+    in_progress: list[JobStatus]
+
+
+def estimate_eta_seconds(
+    running_job: RunningJob, duration: int, now: datetime.datetime
+) -> Optional[float]:
+    """
+    Estimate the wall-clock seconds left until the recording covers ``duration``.
+
+    Uses ffmpeg's reported speed, or the average speed since the job started if
+    ffmpeg has not reported one yet.
+    """
+    progress = running_job.progress
+    remaining = max(0.0, duration - progress.out_time)
+
+    speed = progress.speed
+    if not speed:
+        elapsed = (now - running_job.started_at).total_seconds()
+        speed = progress.out_time / elapsed if elapsed > 0 else None
+
+    if not speed:
+        return None
+
+    return remaining / speed
+
+
+def _enqueued_at(
+    job_queue: JobQueueBackend[Job], job: Job
+) -> Optional[datetime.datetime]:
+    timestamp = job_queue.enqueued_at.get(job)
+    if timestamp is None:
+        return None
+    return datetime.datetime.fromtimestamp(timestamp, tz=ZoneInfo("Asia/Tokyo"))
+
+
+def pending_job_status(job_queue: JobQueueBackend[Job], job: Job) -> JobStatus:
+    return JobStatus(
+        key=job.key,
+        job=job,
+        state="pending",
+        enqueued_at=_enqueued_at(job_queue, job),
+        priority=job_queue.priorities.get(job),
+    )
+
+
+def in_progress_job_status(
+    job_queue: JobQueueBackend[Job],
+    job: Job,
+    running_job: Optional[RunningJob],
+    now: datetime.datetime,
+) -> JobStatus:
+    progress_status = None
+    if running_job is not None:
+        progress_status = JobProgressStatus(
+            worker_id=running_job.worker_id,
+            started_at=running_job.started_at,
+            bytes_written=running_job.progress.total_size,
+            out_time=running_job.progress.out_time,
+            duration=job.program.dur,
+            speed=running_job.progress.speed,
+            eta_seconds=estimate_eta_seconds(running_job, job.program.dur, now),
+        )
+
+    return JobStatus(
+        key=job.key,
+        job=job,
+        state="in_progress",
+        enqueued_at=_enqueued_at(job_queue, job),
+        priority=job_queue.priorities.get(job),
+        progress=progress_status,
+    )
+
+
+def job_queue_status(
+    job_queue: JobQueueBackend[Job], running_jobs: dict[Job, RunningJob]
+) -> JobQueueStatus:
+    now = datetime.datetime.now(ZoneInfo("Asia/Tokyo"))
+
+    return JobQueueStatus(
+        pending=[
+            pending_job_status(job_queue, job) for job in job_queue.pending_in_order()
+        ],
+        in_progress=[
+            in_progress_job_status(job_queue, job, running_jobs.get(job), now)
+            for job in sorted(job_queue.in_progress)
+        ],
+    )
+
+
+def find_job_status(
+    job_queue: JobQueueBackend[Job], running_jobs: dict[Job, RunningJob], key: str
+) -> Optional[JobStatus]:
+    for job in job_queue.in_progress:
+        if job.key == key:
+            return in_progress_job_status(
+                job_queue,
+                job,
+                running_jobs.get(job),
+                datetime.datetime.now(ZoneInfo("Asia/Tokyo")),
+            )
+
+    for job in job_queue.pending:
+        if job.key == key:
+            return pending_job_status(job_queue, job)
+
+    return None
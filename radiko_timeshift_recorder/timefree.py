@@ -0,0 +1,44 @@
+"""Streamlink's radiko plugin, starting timefree programs partway through."""
+
+import datetime
+from typing import Any, Mapping, Optional
+from urllib.parse import parse_qsl, urlencode, urlsplit
+
+from streamlink import Streamlink
+from streamlink.plugins.radiko import Radiko
+
+_TIMESTAMP_FORMAT = "%Y%m%d%H%M%S"
+
+
+def seek_timefree_url(url: str, seconds: float) -> str:
+    """
+    Timefree playlist ``url`` of a program, starting ``seconds`` after its
+    beginning, as radiko's player asks for it with ``seek``.
+
+    Timefree playlists of ``l=15`` seconds move on while they are played, like
+    a live stream, and streamlink applies ``--hls-start-offset`` to those as a
+    jump back from the end of the window instead of skipping ahead.
+    """
+    parts = urlsplit(url)
+    params = dict(parse_qsl(parts.query))
+    ft = datetime.datetime.strptime(params["ft"], _TIMESTAMP_FORMAT)
+    params["seek"] = (ft + datetime.timedelta(seconds=seconds)).strftime(
+        _TIMESTAMP_FORMAT
+    )
+    return parts._replace(query=urlencode(params)).geturl()
+
+
+class SeekingRadiko(Radiko):
+    def __init__(
+        self,
+        session: Streamlink,
+        url: str,
+        seek_seconds: float,
+        options: Optional[Mapping[str, Any]] = None,
+    ) -> None:
+        super().__init__(session, url, options)
+        self.seek_seconds = seek_seconds
+
+    def _timefree(self, station_id: str, start_at: str) -> tuple[str, str]:
+        url, token = super()._timefree(station_id, start_at)
+        return seek_timefree_url(url, self.seek_seconds), token
@@ -0,0 +1,225 @@
+"""
+Lightweight spans of job stages, exported as OTLP/JSON lines.
+
+Each finished span is appended to a file as one ``ExportTraceServiceRequest``
+in the OTLP/JSON encoding, the format of the OpenTelemetry Collector's file
+exporter and receiver. Tracing is off until ``configure`` is called; until
+then ``span`` returns a shared no-op span.
+"""
+
+import json
+import secrets
+import time
+from contextvars import ContextVar, Token
+from pathlib import Path
+from types import TracebackType
+from typing import IO, Any, Optional
+
+SERVICE_NAME = "radiko-timeshift-recorder"
+SCOPE_NAME = "radiko_timeshift_recorder"
+
+# Enum values of the OTLP protocol.
+_SPAN_KIND_INTERNAL = 1
+_STATUS_CODE_UNSET = 0
+_STATUS_CODE_ERROR = 2
+
+AttributeValue = str | bool | int | float
+
+
+def _otlp_value(value: AttributeValue) -> dict[str, Any]:
+    # bool is checked first since it is a subclass of int. 64-bit integers are
+    # strings in OTLP/JSON.
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+def _otlp_attributes(attributes: dict[str, AttributeValue]) -> list[dict[str, Any]]:
+    return [
+        {"key": key, "value": _otlp_value(value)} for key, value in attributes.items()
+    ]
+
+
+class JsonlSpanExporter:
+    def __init__(self, path: Path, service_name: str = SERVICE_NAME) -> None:
+        self.path = path
+        self.resource = {"attributes": _otlp_attributes({"service.name": service_name})}
+        self._file: IO[str] = path.open("a", encoding="utf-8")
+
+    def export(self, span: "Span") -> None:
+        request = {
+            "resourceSpans": [
+                {
+                    "resource": self.resource,
+                    "scopeSpans": [
+                        {"scope": {"name": SCOPE_NAME}, "spans": [span.to_otlp()]}
+                    ],
+                }
+            ]
+        }
+        # One write per line, so that lines from concurrent jobs don't interleave.
+        self._file.write(json.dumps(request, ensure_ascii=False) + "\n")
+        self._file.flush()
+
+    def close(self) -> None:
+        self._file.close()
+
+
+_exporter: Optional[JsonlSpanExporter] = None
+_current_span: ContextVar[Optional["Span"]] = ContextVar("current_span", default=None)
+
+
+class Span:
+    """
+    A timed stage of work, used as a context manager.
+
+    Spans entered while another span is current become its children. An
+    exception leaving the span marks it as failed and is re-raised.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        exporter: JsonlSpanExporter,
+        attributes: dict[str, AttributeValue],
+        start_time_ns: Optional[int] = None,
+    ) -> None:
+        parent = _current_span.get()
+        self.name = name
+        self.exporter = exporter
+        self.trace_id: str = parent.trace_id if parent else secrets.token_hex(16)
+        self.span_id = secrets.token_hex(8)
+        self.parent_span_id = parent.span_id if parent else None
+        self.attributes = attributes
+        self.events: list[dict[str, Any]] = []
+        self.start_time_ns = (
+            start_time_ns if start_time_ns is not None else time.time_ns()
+        )
+        self.end_time_ns: Optional[int] = None
+        self.status_code = _STATUS_CODE_UNSET
+        self.status_message = ""
+        self._token: Optional[Token[Optional[Span]]] = None
+
+    def set_attribute(self, key: str, value: AttributeValue) -> None:
+        self.attributes[key] = value
+
+    def add_event(self, name: str, **attributes: AttributeValue) -> None:
+        self.events.append(
+            {
+                "timeUnixNano": str(time.time_ns()),
+                "name": name,
+                "attributes": _otlp_attributes(attributes),
+            }
+        )
+
+    def end(self, end_time_ns: Optional[int] = None) -> None:
+        self.end_time_ns = end_time_ns if end_time_ns is not None else time.time_ns()
+        self.exporter.export(self)
+
+    def __enter__(self) -> "Span":
+        self._token = _current_span.set(self)
+        return self
+
+    def __exit__(
+        self,
+        exc_type: Optional[type[BaseException]],
+        exc: Optional[BaseException],
+        tb: Optional[TracebackType],
+    ) -> None:
+        if exc is not None:
+            self.status_code = _STATUS_CODE_ERROR
+            self.status_message = str(exc)
+            self.add_event(
+                "exception",
+                **{
+                    "exception.type": type(exc).__name__,
+                    "exception.message": str(exc),
+                },
+            )
+        if self._token is not None:
+            _current_span.reset(self._token)
+        self.end()
+
+    def to_otlp(self) -> dict[str, Any]:
+        otlp: dict[str, Any] = {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "name": self.name,
+            "kind": _SPAN_KIND_INTERNAL,
+            "startTimeUnixNano": str(self.start_time_ns),
+            "endTimeUnixNano": str(self.end_time_ns),
+            "attributes": _otlp_attributes(self.attributes),
+            "events": self.events,
+            "status": {"code": self.status_code},
+        }
+        if self.parent_span_id is not None:
+            otlp["parentSpanId"] = self.parent_span_id
+        if self.status_message:
+            otlp["status"]["message"] = self.status_message
+        return otlp
+
+
+class _NoopSpan(Span):
+    def __init__(self) -> None:
+        pass
+
+    def set_attribute(self, key: str, value: AttributeValue) -> None:
+        pass
+
+    def add_event(self, name: str, **attributes: AttributeValue) -> None:
+        pass
+
+    def end(self, end_time_ns: Optional[int] = None) -> None:
+        pass
+
+    def __enter__(self) -> Span:
+        return self
+
+    def __exit__(
+        self,
+        exc_type: Optional[type[BaseException]],
+        exc: Optional[BaseException],
+        tb: Optional[TracebackType],
+    ) -> None:
+        pass
+
+
+_NOOP_SPAN = _NoopSpan()
+
+
+def configure(path: Path, service_name: str = SERVICE_NAME) -> None:
+    """Start exporting spans to ``path``, appending if it exists."""
+    global _exporter
+    shutdown()
+    _exporter = JsonlSpanExporter(path, service_name)
+
+
+def shutdown() -> None:
+    global _exporter
+    if _exporter is not None:
+        _exporter.close()
+        _exporter = None
+
+
+def span(
+    name: str, *, start_time_ns: Optional[int] = None, **attributes: AttributeValue
+) -> Span:
+    """
+    Create a span to be used in a ``with`` statement.
+
+    ``start_time_ns`` backdates the span, e.g. to when a job was enqueued.
+    """
+    if _exporter is None:
+        return _NOOP_SPAN
+    return Span(name, _exporter, attributes, start_time_ns=start_time_ns)
+
+
+def record_span(name: str, start_time_ns: int, **attributes: AttributeValue) -> None:
+    """Record a child of the current span that started earlier and ends now."""
+    if _exporter is None:
+        return
+    Span(name, _exporter, attributes, start_time_ns=start_time_ns).end()
@@ -0,0 +1,194 @@
+"""Limits on how hard the recorder hits radiko, which back off when radiko fails."""
+
+import asyncio
+import re
+import threading
+import time
+from collections import Counter
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Optional
+
+from radiko_timeshift_recorder import metrics
+
+DEFAULT_STREAM_START_RATE = 0.5
+DEFAULT_STREAM_START_BURST = 3
+# On an upstream error the rate and the stream limit are halved, and on each
+# success they grow back by a tenth of their maximum and by one respectively.
+BACKOFF_FACTOR = 0.5
+RECOVERY_FRACTION = 0.1
+# Fraction of the maximum rate the rate never backs off below.
+MIN_RATE_FRACTION = 0.05
+
+# How requests and urllib3, under streamlink, report too many requests, server
+# errors and failed connections. Other errors, such as 403 for programs out of
+# the area, are not radiko being overloaded.
+_UPSTREAM_ERROR_PATTERN = re.compile(
+    r"\b(?:429 Client|5\d\d Server) Error\b"
+    r"|\b(?:ConnectionError|ConnectTimeout|ReadTimeout|ChunkedEncodingError)\b"
+    r"|Max retries exceeded|Read timed out|Connection (?:aborted|refused|reset)"
+)
+
+
+class UpstreamError(RuntimeError):
+    """radiko refused or failed a stream, e.g. with HTTP 429 or 5xx."""
+
+
+def is_upstream_error(output: str) -> bool:
+    """Whether the error output of streamlink shows an error of radiko itself."""
+    return _UPSTREAM_ERROR_PATTERN.search(output) is not None
+
+
+class TokenBucket:
+    """
+    Token bucket of ``rate`` tokens per second, holding at most ``burst``.
+
+    ``rate`` adapts between ``max_rate * MIN_RATE_FRACTION`` and ``max_rate``
+    with ``slow_down`` and ``speed_up``. Safe to share between threads, and
+    between an event loop and threads.
+    """
+
+    def __init__(self, max_rate: float, burst: float = 1) -> None:
+        self.max_rate = max_rate
+        self.rate = max_rate
+        self.burst = burst
+        self._tokens = burst
+        self._updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _take(self, amount: float = 1) -> float:
+        """
+        Take ``amount`` tokens if there are enough, or return the seconds until
+        there are. More than ``burst`` tokens are taken once the bucket is full,
+        leaving it in debt.
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(
+                self.burst, self._tokens + (now - self._updated_at) * self.rate
+            )
+            self._updated_at = now
+            needed = min(amount, self.burst)
+            if self._tokens >= needed:
+                self._tokens -= amount
+                return 0.0
+            return (needed - self._tokens) / self.rate
+
+    def acquire_blocking(self, amount: float = 1) -> None:
+        while (wait := self._take(amount)) > 0:
+            time.sleep(wait)
+
+    async def acquire(self, amount: float = 1) -> None:
+        while (wait := self._take(amount)) > 0:
+            await asyncio.sleep(wait)
+
+    def set_max_rate(self, max_rate: float, burst: Optional[float] = None) -> None:
+        with self._lock:
+            self.max_rate = self.rate = max_rate
+            if burst is not None:
+                self.burst = burst
+                self._tokens = min(self._tokens, burst)
+
+    def slow_down(self) -> None:
+        with self._lock:
+            self.rate = max(
+                self.max_rate * MIN_RATE_FRACTION, self.rate * BACKOFF_FACTOR
+            )
+
+    def speed_up(self) -> None:
+        with self._lock:
+            self.rate = min(
+                self.max_rate, self.rate + self.max_rate * RECOVERY_FRACTION
+            )
+
+
+class UpstreamLimiter:
+    """
+    Limits the streams the workers download from radiko at once.
+
+    A stream may start when fewer than ``max_streams`` streams run in total
+    and fewer than ``max_streams_per_station`` on its station, and a token of
+    ``stream_starts`` is available. Each start makes several requests to
+    radiko, such as authentication and playlists, so the bucket limits the
+    request rate. Downloads report how their stream went, and the limits back
+    off on ``UpstreamError`` and recover on successes. Without
+    ``max_streams`` there is no stream limit to back off, only the start rate.
+    """
+
+    def __init__(
+        self,
+        *,
+        max_streams: Optional[int] = None,
+        max_streams_per_station: Optional[int] = None,
+        stream_starts: Optional[TokenBucket] = None,
+    ) -> None:
+        self.max_streams = max_streams
+        self.max_streams_per_station = max_streams_per_station
+        self.stream_starts = stream_starts
+        # Lowered from max_streams after upstream errors.
+        self.stream_limit = max_streams
+        self.streams: Counter[str] = Counter()
+        self._changed = asyncio.Condition()
+
+    def _can_start(self, station_id: str) -> bool:
+        if self.stream_limit is not None and self.streams.total() >= self.stream_limit:
+            return False
+        if (
+            self.max_streams_per_station is not None
+            and self.streams[station_id] >= self.max_streams_per_station
+        ):
+            return False
+        return True
+
+    @asynccontextmanager
+    async def stream(self, station_id: str) -> AsyncIterator[None]:
+        started_at = time.monotonic()
+        async with self._changed:
+            await self._changed.wait_for(lambda: self._can_start(station_id))
+            self.streams[station_id] += 1
+        try:
+            if self.stream_starts is not None:
+                await self.stream_starts.acquire()
+            metrics.UPSTREAM_WAIT_SECONDS.observe(time.monotonic() - started_at)
+            metrics.UPSTREAM_STREAMS.set(self.streams.total())
+            yield
+        finally:
+            async with self._changed:
+                self.streams[station_id] -= 1
+                if self.streams[station_id] <= 0:
+                    del self.streams[station_id]
+                metrics.UPSTREAM_STREAMS.set(self.streams.total())
+                self._changed.notify_all()
+
+    async def set_max_streams(self, max_streams: int) -> None:
+        """Change ``max_streams``, keeping the stream limit backed off if it is."""
+        if self.stream_limit is None or self.stream_limit == self.max_streams:
+            self.stream_limit = max_streams
+        else:
+            self.stream_limit = min(self.stream_limit, max_streams)
+        self.max_streams = max_streams
+        self._set_metrics()
+        async with self._changed:
+            self._changed.notify_all()
+
+    def _set_metrics(self) -> None:
+        if self.stream_starts is not None:
+            metrics.UPSTREAM_STREAM_START_RATE.set(self.stream_starts.rate)
+        if self.stream_limit is not None:
+            metrics.UPSTREAM_STREAM_LIMIT.set(self.stream_limit)
+
+    async def record_failure(self) -> None:
+        if self.stream_starts is not None:
+            self.stream_starts.slow_down()
+        if self.stream_limit is not None:
+            self.stream_limit = max(1, int(self.stream_limit * BACKOFF_FACTOR))
+        self._set_metrics()
+
+    async def record_success(self) -> None:
+        if self.stream_starts is not None:
+            self.stream_starts.speed_up()
+        if self.stream_limit is not None and self.max_streams is not None:
+            self.stream_limit = min(self.max_streams, self.stream_limit + 1)
+            # A stream that was held back by the lower limit may start now.
+            async with self._changed:
+                self._changed.notify_all()
+        self._set_metrics()
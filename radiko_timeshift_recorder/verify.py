@@ -0,0 +1,219 @@
+"""Verification of recorded files against the durations of their programs."""
+
+import asyncio
+import datetime
+import os
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Iterable, Literal, Mapping, Optional
+from zoneinfo import ZoneInfo
+
+from logzero import logger
+from pydantic import BaseModel, ValidationError
+
+from radiko_timeshift_recorder.download import DURATION_TOLERANCE_SECONDS
+from radiko_timeshift_recorder.get_duration import get_duration_with_ffprobe
+from radiko_timeshift_recorder.job import Job
+from radiko_timeshift_recorder.library import LibraryEntry, LibraryKey
+from radiko_timeshift_recorder.mp4 import Mp4Error, read_audio_duration
+from radiko_timeshift_recorder.radiko import TIMESHIFT_WINDOW
+
+DEFAULT_MAX_WORKERS = 8
+# Suffix broken recordings are renamed with before they are recorded again.
+BROKEN_SUFFIX = ".broken"
+
+VerifyState = Literal["ok", "truncated", "unreadable", "unknown"]
+
+
+class CachedDuration(BaseModel):
+    path: str
+    size: int
+    mtime_ns: int
+    duration: float
+
+
+class DurationCache:
+    """
+    Durations of files, valid while their size and mtime are unchanged.
+
+    Persisted as a JSON lines file, so that verifying a library again only
+    reads the files that were added or changed since.
+    """
+
+    def __init__(self, path: Optional[Path] = None) -> None:
+        self.path = path
+        self.entries: dict[str, CachedDuration] = {}
+
+    @classmethod
+    def open(cls, path: Optional[Path]) -> "DurationCache":
+        cache = cls(path)
+        if path is not None and path.exists():
+            with path.open(encoding="utf-8") as f:
+                for line_number, line in enumerate(f, start=1):
+                    try:
+                        entry = CachedDuration.model_validate_json(line)
+                    except ValidationError:
+                        logger.warning(f"Skipping invalid line {line_number} of {path}")
+                        continue
+                    cache.entries[entry.path] = entry
+        return cache
+
+    def get(self, path: Path, stat: os.stat_result) -> Optional[float]:
+        entry = self.entries.get(str(path))
+        if (
+            entry is None
+            or entry.size != stat.st_size
+            or entry.mtime_ns != stat.st_mtime_ns
+        ):
+            return None
+        return entry.duration
+
+    def put(self, path: Path, stat: os.stat_result, duration: float) -> None:
+        self.entries[str(path)] = CachedDuration(
+            path=str(path),
+            size=stat.st_size,
+            mtime_ns=stat.st_mtime_ns,
+            duration=duration,
+        )
+
+    def save(self, paths: Optional[Iterable[Path]] = None) -> None:
+        """Replace the file with the entries of ``paths``, or all of them."""
+        if self.path is None:
+            return
+        keep = None if paths is None else {str(path) for path in paths}
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with tempfile.NamedTemporaryFile(
+            mode="w",
+            encoding="utf-8",
+            dir=self.path.parent,
+            prefix=f".{self.path.name}.",
+            delete=False,
+        ) as f:
+            for entry in self.entries.values():
+                if keep is None or entry.path in keep:
+                    f.write(entry.model_dump_json() + "\n")
+        os.replace(f.name, self.path)
+
+
+class VerifyResult(BaseModel):
+    entry: LibraryEntry
+    state: VerifyState
+    duration: Optional[float] = None
+    expected_duration: Optional[int] = None
+    error: Optional[str] = None
+
+    @property
+    def is_broken(self) -> bool:
+        return self.state in ("truncated", "unreadable")
+
+
+def read_duration(path: Path) -> float:
+    """Duration of a recording, from its MP4 boxes or else by ffprobe."""
+    try:
+        return read_audio_duration(path)
+    except Mp4Error as e:
+        logger.debug(f"Falling back to ffprobe for {path}: {e}")
+    # Each thread of the pool runs its own event loop for the subprocess.
+    return asyncio.run(get_duration_with_ffprobe(path))
+
+
+def expected_durations(
+    entries: Iterable[LibraryEntry], jobs: Iterable[Job]
+) -> dict[LibraryKey, int]:
+    """Program durations by library key, from the schedule or else the index."""
+    durations = {
+        (entry.station_id, entry.ft): entry.dur
+        for entry in entries
+        if entry.dur is not None
+    }
+    durations.update(
+        {(job.station_id, job.program.ft): job.program.dur for job in jobs}
+    )
+    return durations
+
+
+def _measure(
+    entry: LibraryEntry, cache: DurationCache
+) -> tuple[Optional[os.stat_result], Optional[float], Optional[Exception]]:
+    path = Path(entry.path)
+    try:
+        stat = path.stat()
+        cached = cache.get(path, stat)
+        if cached is not None:
+            return stat, cached, None
+        return stat, read_duration(path), None
+    except Exception as e:
+        return None, None, e
+
+
+def verify_entries(
+    entries: Iterable[LibraryEntry],
+    expected: Mapping[LibraryKey, int],
+    cache: DurationCache,
+    max_workers: int = DEFAULT_MAX_WORKERS,
+) -> list[VerifyResult]:
+    """
+    Read the duration of each recording in a pool of ``max_workers`` threads,
+    unless ``cache`` has it, and compare it with ``expected``.
+    """
+    entries = list(entries)
+    results = []
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        measured = executor.map(lambda entry: _measure(entry, cache), entries)
+        for entry, (stat, duration, error) in zip(entries, measured):
+            expected_duration = expected.get((entry.station_id, entry.ft))
+            if error is not None or duration is None:
+                state: VerifyState = "unreadable"
+            else:
+                assert stat is not None
+                cache.put(Path(entry.path), stat, duration)
+                if expected_duration is None:
+                    state = "unknown"
+                elif abs(duration - expected_duration) > DURATION_TOLERANCE_SECONDS:
+                    state = "truncated"
+                else:
+                    state = "ok"
+            results.append(
+                VerifyResult(
+                    entry=entry,
+                    state=state,
+                    duration=duration,
+                    expected_duration=expected_duration,
+                    error=str(error) if error is not None else None,
+                )
+            )
+    return results
+
+
+def recordable_jobs(
+    results: Iterable[VerifyResult],
+    jobs: Iterable[Job],
+    now: Optional[datetime.datetime] = None,
+) -> list[tuple[VerifyResult, Job]]:
+    """Broken recordings whose programs can still be played back, with their jobs."""
+    if now is None:
+        now = datetime.datetime.now(ZoneInfo("Asia/Tokyo"))
+    jobs_by_key = {(job.station_id, job.program.ft): job for job in jobs}
+    recordable = []
+    for result in results:
+        job = jobs_by_key.get((result.entry.station_id, result.entry.ft))
+        if (
+            result.is_broken
+            and job is not None
+            and job.program.to < now
+            and job.program.ft > now - TIMESHIFT_WINDOW
+        ):
+            recordable.append((result, job))
+    return recordable
+
+
+def set_aside(path: Path) -> Path:
+    """Rename a broken recording, so it is neither skipped nor overwritten."""
+    broken_path = path.with_name(path.name + BROKEN_SUFFIX)
+    os.replace(path, broken_path)
+    return broken_path
+
+
+def restore(broken_path: Path, path: Path) -> None:
+    os.replace(broken_path, path)
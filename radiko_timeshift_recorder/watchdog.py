@@ -0,0 +1,109 @@
+"""Watchdog that aborts downloads which stop making progress."""
+
+import asyncio
+import time
+from dataclasses import dataclass
+from typing import Awaitable, NoReturn, Optional, TypeVar
+
+from radiko_timeshift_recorder.progress import DownloadProgress
+
+T = TypeVar("T")
+
+DEFAULT_STALL_TIMEOUT = 300.0
+DEFAULT_DEADLINE_FACTOR = 1.0
+DEFAULT_DEADLINE_MARGIN = 600.0
+_POLL_INTERVAL = 1.0
+
+
+class DownloadStalledError(RuntimeError):
+    pass
+
+
+class DownloadDeadlineExceededError(RuntimeError):
+    pass
+
+
+@dataclass(frozen=True)
+class WatchdogConfig:
+    """
+    ``stall_timeout`` is the longest time without new bytes or output time.
+    The hard deadline of a download is ``deadline_factor`` times the program
+    duration plus ``deadline_margin`` seconds.
+    """
+
+    stall_timeout: float = DEFAULT_STALL_TIMEOUT
+    deadline_factor: float = DEFAULT_DEADLINE_FACTOR
+    deadline_margin: float = DEFAULT_DEADLINE_MARGIN
+
+    def deadline_for(self, dur: int) -> float:
+        return dur * self.deadline_factor + self.deadline_margin
+
+
+async def watch_progress(
+    progress: DownloadProgress,
+    *,
+    stall_timeout: float,
+    deadline: Optional[float] = None,
+    poll_interval: Optional[float] = None,
+) -> NoReturn:
+    """Raise once ``progress`` stalls for ``stall_timeout`` or ``deadline`` passes."""
+    if poll_interval is None:
+        poll_interval = min(_POLL_INTERVAL, stall_timeout / 2)
+
+    started_at = last_progress_at = time.monotonic()
+    last_seen = (progress.total_size, progress.out_time)
+
+    while True:
+        await asyncio.sleep(poll_interval)
+        now = time.monotonic()
+
+        seen = (progress.total_size, progress.out_time)
+        if seen != last_seen:
+            last_seen = seen
+            last_progress_at = now
+
+        if now - last_progress_at > stall_timeout:
+            raise DownloadStalledError(
+                f"No progress for {now - last_progress_at:.0f} seconds "
+                f"(total_size={progress.total_size}, out_time={progress.out_time})"
+            )
+
+        if deadline is not None and now - started_at > deadline:
+            raise DownloadDeadlineExceededError(
+                f"Download did not finish within {deadline:.0f} seconds "
+                f"(total_size={progress.total_size}, out_time={progress.out_time})"
+            )
+
+
+async def run_with_watchdog(
+    aw: Awaitable[T],
+    progress: DownloadProgress,
+    *,
+    stall_timeout: float,
+    deadline: Optional[float] = None,
+    poll_interval: Optional[float] = None,
+) -> T:
+    """Await ``aw``, cancelling it if ``watch_progress`` gives up on it."""
+    task = asyncio.ensure_future(aw)
+    watchdog = asyncio.create_task(
+        watch_progress(
+            progress,
+            stall_timeout=stall_timeout,
+            deadline=deadline,
+            poll_interval=poll_interval,
+        )
+    )
+
+    try:
+        await asyncio.wait({task, watchdog}, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        for t in (task, watchdog):
+            if not t.done():
+                t.cancel()
+        await asyncio.gather(task, watchdog, return_exceptions=True)
+
+    if not task.cancelled():
+        return task.result()
+
+    # The task was cancelled because the watchdog gave up on it.
+    return watchdog.result()
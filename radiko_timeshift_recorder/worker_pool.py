@@ -0,0 +1,209 @@
+"""Pool of worker tasks that grows and shrinks with the work to do."""
+
+import asyncio
+import itertools
+import math
+import time
+from typing import Any, Callable, Coroutine, Optional
+
+from logzero import logger
+from pydantic import BaseModel, Field, model_validator
+
+from radiko_timeshift_recorder import metrics
+from radiko_timeshift_recorder.upstream import UpstreamLimiter
+
+DEFAULT_AUTOSCALE_INTERVAL = 30.0
+
+
+class WorkerPoolBounds(BaseModel):
+    min_workers: int = Field(ge=1)
+    max_workers: int = Field(ge=1)
+
+    @model_validator(mode="after")
+    def check_min_le_max(self) -> "WorkerPoolBounds":
+        if self.min_workers > self.max_workers:
+            raise ValueError("min_workers must not be greater than max_workers")
+        return self
+
+
+class WorkerPoolStatus(WorkerPoolBounds):
+    workers: int
+    busy: int
+    retiring: int
+    # Bytes per second of one download, as observed since the last scaling.
+    download_bytes_per_second: Optional[float]
+
+
+def desired_workers(
+    *,
+    pending: int,
+    busy: int,
+    bounds: WorkerPoolBounds,
+    download_bytes_per_second: Optional[float] = None,
+    bandwidth: Optional[float] = None,
+) -> int:
+    """
+    One worker per pending or running job, but no more than ``bandwidth``
+    bytes per second can feed at the observed speed of one download.
+    """
+    desired = pending + busy
+    if bandwidth is not None and download_bytes_per_second:
+        desired = min(desired, math.floor(bandwidth / download_bytes_per_second))
+    return max(bounds.min_workers, min(bounds.max_workers, desired))
+
+
+class WorkerPool:
+    """
+    Worker tasks made by ``spawn(worker_id)``, between ``bounds``.
+
+    Idle workers are cancelled when the pool shrinks. Busy workers are only
+    marked to retire and stop after their current job, so running downloads
+    are never interrupted. ``bandwidth()`` is the current total bandwidth,
+    in bytes per second, that the pool does not grow beyond.
+
+    The stream limit of ``limiter``, if given, follows ``max_workers``, so
+    that workers added at runtime can stream.
+    """
+
+    def __init__(
+        self,
+        spawn: Callable[[int], Coroutine[Any, Any, None]],
+        bounds: WorkerPoolBounds,
+        *,
+        pending: Callable[[], int] = lambda: 0,
+        bandwidth: Callable[[], Optional[float]] = lambda: None,
+        limiter: Optional[UpstreamLimiter] = None,
+    ) -> None:
+        self.spawn = spawn
+        self.bounds = bounds
+        self.pending = pending
+        self.bandwidth = bandwidth
+        self.limiter = limiter
+        self.tasks: dict[int, asyncio.Task[None]] = {}
+        self.busy: set[int] = set()
+        self.retiring: set[int] = set()
+        self.download_bytes_per_second: Optional[float] = None
+        # Set by drain; the pool no longer starts workers.
+        self.draining = False
+        self._ids = itertools.count()
+
+    def __len__(self) -> int:
+        return len(self.tasks) - len(self.retiring)
+
+    def should_retire(self, worker_id: int) -> bool:
+        return worker_id in self.retiring
+
+    def _start(self) -> None:
+        worker_id = next(self._ids)
+        logger.info(f"Starting worker-{worker_id}")
+        task = asyncio.create_task(self.spawn(worker_id), name=f"worker-{worker_id}")
+        self.tasks[worker_id] = task
+        task.add_done_callback(lambda _: self._forget(worker_id))
+
+    def _forget(self, worker_id: int) -> None:
+        self.tasks.pop(worker_id, None)
+        self.busy.discard(worker_id)
+        self.retiring.discard(worker_id)
+
+    def resize(self, size: int) -> None:
+        size = max(self.bounds.min_workers, min(self.bounds.max_workers, size))
+        if self.draining or size == len(self):
+            return
+
+        logger.info(f"Resizing the worker pool from {len(self)} to {size} workers")
+        # Workers retiring after their job are kept rather than started anew.
+        while len(self) < size and self.retiring:
+            self.retiring.remove(max(self.retiring))
+        while len(self) < size:
+            self._start()
+
+        active = [i for i in self.tasks if i not in self.retiring]
+        idle = [i for i in active if i not in self.busy]
+        busy = [i for i in active if i in self.busy]
+        for worker_id in (idle + busy)[: len(self) - size]:
+            if worker_id in self.busy:
+                self.retiring.add(worker_id)
+            else:
+                self.tasks[worker_id].cancel()
+                self._forget(worker_id)
+
+    async def set_bounds(self, bounds: WorkerPoolBounds) -> None:
+        self.bounds = bounds
+        if self.limiter is not None:
+            await self.limiter.set_max_streams(bounds.max_workers)
+        self.scale()
+
+    def status(self) -> WorkerPoolStatus:
+        return WorkerPoolStatus(
+            min_workers=self.bounds.min_workers,
+            max_workers=self.bounds.max_workers,
+            workers=len(self),
+            busy=len(self.busy),
+            retiring=len(self.retiring),
+            download_bytes_per_second=self.download_bytes_per_second,
+        )
+
+    def scale(self) -> None:
+        self.resize(
+            desired_workers(
+                pending=self.pending(),
+                busy=len(self.busy),
+                bounds=self.bounds,
+                download_bytes_per_second=self.download_bytes_per_second,
+                bandwidth=self.bandwidth(),
+            )
+        )
+
+    async def autoscale(self, interval: float = DEFAULT_AUTOSCALE_INTERVAL) -> None:
+        """Scale the pool every ``interval`` seconds, until cancelled."""
+        downloaded = _downloaded_bytes()
+        sampled_at = time.monotonic()
+        while True:
+            await asyncio.sleep(interval)
+
+            # Downloads write to DOWNLOAD_BYTES as they go, so its rate divided
+            # by the busy workers is the speed of one download.
+            now = time.monotonic()
+            bytes_since = _downloaded_bytes() - downloaded
+            if self.busy and bytes_since > 0:
+                self.download_bytes_per_second = (
+                    bytes_since / (now - sampled_at) / len(self.busy)
+                )
+            downloaded, sampled_at = downloaded + bytes_since, now
+
+            self.scale()
+
+    async def drain(self, timeout: float) -> None:
+        """
+        Stop idle workers, give busy ones up to ``timeout`` seconds to finish
+        their job, then cancel those still running.
+        """
+        self.draining = True
+        for worker_id, task in list(self.tasks.items()):
+            if worker_id in self.busy:
+                self.retiring.add(worker_id)
+            else:
+                task.cancel()
+
+        busy_tasks = [self.tasks[i] for i in self.retiring if i in self.tasks]
+        if busy_tasks and timeout > 0:
+            logger.info(
+                f"Waiting up to {timeout} seconds for {len(busy_tasks)} running jobs"
+            )
+            _, unfinished = await asyncio.wait(busy_tasks, timeout=timeout)
+            if unfinished:
+                logger.warning(
+                    f"Cancelling {len(unfinished)} jobs still running after {timeout} seconds"
+                )
+        await self.stop()
+
+    async def stop(self) -> None:
+        tasks = list(self.tasks.values())
+        for task in tasks:
+            logger.info(f"Cancelling {task.get_name()}")
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+def _downloaded_bytes() -> float:
+    return metrics.REGISTRY.get_sample_value("radiko_download_bytes_total") or 0.0
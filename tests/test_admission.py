@@ -0,0 +1,113 @@
+import asyncio
+import shutil
+from pathlib import Path
+from typing import NamedTuple
+
+import pytest
+from pytest_mock import MockerFixture
+
+from radiko_timeshift_recorder.admission import ESTIMATE_MARGIN, DiskSpaceAdmission
+from radiko_timeshift_recorder.job import Job
+
+
+class _Usage(NamedTuple):
+    total: int
+    used: int
+    free: int
+
+
+def fake_free_bytes(mocker: MockerFixture, free: dict[Path, int]) -> None:
+    mocker.patch(
+        "radiko_timeshift_recorder.admission.shutil.disk_usage",
+        side_effect=lambda path: _Usage(0, 0, free[path]),
+    )
+
+
+def test_estimate_bytes(sample_job: Job):
+    admission = DiskSpaceAdmission([Path(".")], byte_rate=100)
+
+    assert admission.estimate_bytes(sample_job) == int(900 * 100 * ESTIMATE_MARGIN)
+
+
+def test_available_bytes_uses_fullest_path_and_reservations(
+    mocker: MockerFixture, sample_job: Job
+):
+    fake_free_bytes(mocker, {Path("a"): 10_000_000, Path("b"): 5_000_000})
+    admission = DiskSpaceAdmission([Path("a"), Path("b")], byte_rate=100)
+
+    assert admission.available_bytes() == 5_000_000
+    with admission.reserve(sample_job):
+        assert admission.available_bytes() == 5_000_000 - 108_000
+    assert admission.available_bytes() == 5_000_000
+
+
+def test_observe_moves_byte_rate_towards_recordings(sample_job: Job):
+    admission = DiskSpaceAdmission([Path(".")], byte_rate=1000)
+
+    admission.observe(sample_job, 900 * 2000)
+    assert 1000 < admission.byte_rate < 2000
+
+    byte_rate = admission.byte_rate
+    admission.observe(sample_job, 0)
+    assert admission.byte_rate == byte_rate
+
+
+@pytest.mark.asyncio
+async def test_wait_for_space_waits_for_reservations_to_be_released(
+    mocker: MockerFixture, sample_job: Job
+):
+    fake_free_bytes(mocker, {Path("a"): 1_000_000})
+    admission = DiskSpaceAdmission(
+        [Path("a")], min_free_bytes=950_000, byte_rate=100, poll_interval=60
+    )
+
+    with admission.reserve(sample_job):
+        waiter = asyncio.create_task(admission.wait_for_space())
+        await asyncio.sleep(0.01)
+        assert not waiter.done()
+
+    await asyncio.wait_for(waiter, timeout=1)
+
+
+@pytest.mark.asyncio
+async def test_wait_for_space_polls_free_space(mocker: MockerFixture):
+    free = {Path("a"): 0}
+    fake_free_bytes(mocker, free)
+    admission = DiskSpaceAdmission([Path("a")], min_free_bytes=1, poll_interval=0.01)
+
+    waiter = asyncio.create_task(admission.wait_for_space())
+    await asyncio.sleep(0.05)
+    assert not waiter.done()
+
+    free[Path("a")] = 1
+    await asyncio.wait_for(waiter, timeout=1)
+
+
+@pytest.mark.asyncio
+async def test_has_space_counts_the_job_and_reservations(
+    mocker: MockerFixture, sample_job: Job
+):
+    fake_free_bytes(mocker, {Path("a"): 1_200_000})
+    admission = DiskSpaceAdmission(
+        [Path("a")], min_free_bytes=1_000_000, byte_rate=100, poll_interval=60
+    )
+    other_job = sample_job.model_copy(update={"station_id": "OTHER"})
+    # 108,000 bytes each: there is room for one more job, not two.
+    assert admission.has_space()
+    assert admission.has_space(sample_job)
+
+    with admission.reserve(sample_job):
+        assert not admission.has_space(other_job)
+        waiter = asyncio.create_task(admission.wait_for_space(other_job))
+        await asyncio.sleep(0.01)
+        assert not waiter.done()
+
+    await asyncio.wait_for(waiter, timeout=1)
+    assert admission.has_space(other_job)
+
+
+def test_real_disk_usage(tmp_path: Path):
+    admission = DiskSpaceAdmission([tmp_path], min_free_bytes=0)
+
+    assert admission.available_bytes() == shutil.disk_usage(tmp_path).free
+    assert admission.has_space()
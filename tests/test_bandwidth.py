@@ -0,0 +1,91 @@
+import datetime
+import time
+from zoneinfo import ZoneInfo
+
+import pytest
+
+from radiko_timeshift_recorder.bandwidth import (
+    BandwidthShaper,
+    BandwidthWindow,
+    parse_bandwidth_window,
+)
+
+
+def at(hour: int, minute: int = 0) -> datetime.datetime:
+    return datetime.datetime(2025, 1, 1, hour, minute, tzinfo=ZoneInfo("Asia/Tokyo"))
+
+
+def test_parse_bandwidth_window():
+    assert parse_bandwidth_window("09:00-18:30=500000") == BandwidthWindow(
+        start=datetime.time(9, 0), end=datetime.time(18, 30), limit=500000
+    )
+    assert parse_bandwidth_window("22:00-24:00=unlimited") == BandwidthWindow(
+        start=datetime.time(22, 0), end=datetime.time(0, 0), limit=None
+    )
+
+
+@pytest.mark.parametrize("value", ["09:00-18:00", "9-18=100", "09:00-18:00=fast"])
+def test_parse_bandwidth_window_rejects_invalid(value: str):
+    with pytest.raises(ValueError, match="Invalid bandwidth window"):
+        parse_bandwidth_window(value)
+
+
+def test_limit_follows_schedule():
+    shaper = BandwidthShaper(
+        limit=1000,
+        schedule=[
+            parse_bandwidth_window("22:00-06:00=unlimited"),
+            parse_bandwidth_window("09:00-18:00=500"),
+        ],
+    )
+
+    assert shaper.limit_at(at(23)) is None
+    assert shaper.limit_at(at(5, 59)) is None
+    assert shaper.limit_at(at(6)) == 1000
+    assert shaper.limit_at(at(12)) == 500
+    assert shaper.limit_at(at(18)) == 1000
+
+
+@pytest.mark.asyncio
+async def test_stream_throttles_each_job_and_reports_rate():
+    shaper = BandwidthShaper(job_limit=10_000)
+
+    start = time.monotonic()
+    with shaper.stream() as throttle:
+        assert shaper.streams == 1
+        # The first 5000 bytes are the burst; the rest pass at 10000 per second.
+        for _ in range(10):
+            await throttle(1000)
+    assert time.monotonic() - start >= 0.45
+
+    status = shaper.status()
+    assert status.streams == 0
+    assert status.bytes_per_second > 0
+
+
+@pytest.mark.asyncio
+async def test_stream_shares_total_limit():
+    shaper = BandwidthShaper(limit=10_000)
+
+    start = time.monotonic()
+    with shaper.stream() as first, shaper.stream() as second:
+        for _ in range(5):
+            await first(1000)
+            await second(1000)
+    assert time.monotonic() - start >= 0.45
+
+
+@pytest.mark.asyncio
+async def test_stream_has_no_throttle_while_unlimited():
+    shaper = BandwidthShaper(
+        limit=1000, schedule=[parse_bandwidth_window("00:00-24:00=unlimited")]
+    )
+
+    with shaper.stream() as throttle:
+        assert throttle is None
+        assert shaper.streams == 1
+    assert shaper.streams == 0
+
+    shaper.job_limit = 10_000
+    with shaper.stream() as throttle:
+        assert throttle is not None
@@ -0,0 +1,63 @@
+import datetime
+from typing import Optional
+from zoneinfo import ZoneInfo
+
+import pytest
+from streamlink.stream.hls.segment import HLSSegment
+
+from radiko_timeshift_recorder.cached_hls import segment_timestamp, station_id_from_url
+
+
+def make_segment(uri: str, date: Optional[datetime.datetime]) -> HLSSegment:
+    return HLSSegment(
+        num=0,
+        uri=uri,
+        duration=5.0,
+        title=None,
+        key=None,
+        byterange=None,
+        date=date,
+        map=None,
+    )
+
+
+@pytest.mark.parametrize(
+    "url, expected",
+    [
+        pytest.param(
+            "https://radiko.jp/#!/ts/TBS/20250101050000", "TBS", id="timeshift"
+        ),
+        pytest.param("https://radiko.jp/live/qrr", "QRR", id="live_lowercase"),
+    ],
+)
+def test_station_id_from_url(url: str, expected: str):
+    assert station_id_from_url(url) == expected
+
+
+def test_station_id_from_url_invalid():
+    with pytest.raises(ValueError, match="Failed to parse station ID"):
+        station_id_from_url("https://example.com/")
+
+
+def test_segment_timestamp_prefers_program_date_time():
+    segment = make_segment(
+        "https://example.com/20250101_000000.aac",
+        datetime.datetime(2025, 1, 1, 5, 0, 5, tzinfo=ZoneInfo("Asia/Tokyo")),
+    )
+
+    assert segment_timestamp(segment) == "20250101050005"
+
+
+def test_segment_timestamp_converts_to_japan_time():
+    segment = make_segment(
+        "https://example.com/segment.aac",
+        datetime.datetime(2024, 12, 31, 20, 0, 5, tzinfo=datetime.timezone.utc),
+    )
+
+    assert segment_timestamp(segment) == "20250101050005"
+
+
+def test_segment_timestamp_falls_back_to_uri():
+    segment = make_segment("https://example.com/20250101_050005.aac", None)
+
+    assert segment_timestamp(segment) == "20250101050005"
@@ -0,0 +1,25 @@
+from pathlib import Path
+
+from radiko_timeshift_recorder.checkpoint import load_checkpoint, save_checkpoint
+from radiko_timeshift_recorder.job import Job
+
+
+def test_save_and_load_checkpoint(tmp_path: Path, sample_job: Job):
+    path = tmp_path / "state" / "checkpoint.jsonl"
+
+    assert save_checkpoint(path, [sample_job]) == 1
+    assert load_checkpoint(path) == [sample_job]
+
+    assert save_checkpoint(path, []) == 0
+    assert load_checkpoint(path) == []
+
+
+def test_load_missing_checkpoint(tmp_path: Path):
+    assert load_checkpoint(tmp_path / "checkpoint.jsonl") == []
+
+
+def test_load_checkpoint_skips_invalid_lines(tmp_path: Path, sample_job: Job):
+    path = tmp_path / "checkpoint.jsonl"
+    path.write_text(f'{{"program": \n{sample_job.model_dump_json()}\n')
+
+    assert load_checkpoint(path) == [sample_job]
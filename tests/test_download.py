@@ -1,5 +1,8 @@
+import asyncio
 import datetime
 import errno
+import json
+import sys
 from pathlib import Path
 from unittest.mock import AsyncMock
 from zoneinfo import ZoneInfo
@@ -7,14 +10,26 @@ from zoneinfo import ZoneInfo
 import pytest
 from pytest_mock import MockerFixture
 
+from radiko_timeshift_recorder import tracing
 from radiko_timeshift_recorder.download import (
     DEFAULT_OUTPUT_FILE_MODE,
+    concat_list,
     download,
+    download_stream,
     generate_filename_candidates,
+    move_with_candidates,
+    rename_without_overwriting,
+    streamlink_command,
     try_rename_with_candidates,
 )
 from radiko_timeshift_recorder.job import Job
-from radiko_timeshift_recorder.radiko import Program
+from radiko_timeshift_recorder.library import LibraryIndex
+from radiko_timeshift_recorder.pipeline import PipelineError, PipelineProcessResult
+from radiko_timeshift_recorder.progress import DownloadProgress
+from radiko_timeshift_recorder.radiko import RADIKO_BASE_URL_ENV, Program
+from radiko_timeshift_recorder.segment_cache import SegmentCache
+from radiko_timeshift_recorder.upstream import UpstreamError, UpstreamLimiter
+from radiko_timeshift_recorder.watchdog import DownloadStalledError
 
 
 @pytest.mark.parametrize(
@@ -99,6 +114,198 @@ def test_generate_filename_candidates(
     assert generate_filename_candidates(program) == expected_candidates
 
 
+def test_streamlink_command_without_segment_cache(
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    monkeypatch.delenv(RADIKO_BASE_URL_ENV, raising=False)
+
+    assert streamlink_command("https://radiko.jp/#!/ts/TEST/20250101050000") == [
+        sys.executable,
+        "-m",
+        "streamlink",
+        "https://radiko.jp/#!/ts/TEST/20250101050000",
+        "best",
+        "--stdout",
+    ]
+
+
+def test_streamlink_command_with_segment_cache(tmp_path: Path) -> None:
+    segment_cache = SegmentCache(tmp_path, max_bytes=1024)
+
+    command = streamlink_command(
+        "https://radiko.jp/#!/ts/TEST/20250101050000", segment_cache=segment_cache
+    )
+
+    assert command[:4] == [
+        sys.executable,
+        "-m",
+        "radiko_timeshift_recorder",
+        "fetch-stream",
+    ]
+    assert command[command.index("--segment-cache-dir") + 1] == str(tmp_path)
+    assert command[command.index("--segment-cache-max-bytes") + 1] == "1024"
+
+
+def test_streamlink_command_uses_fetcher_for_radiko_base_url(
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    monkeypatch.setenv(RADIKO_BASE_URL_ENV, "http://127.0.0.1:8080")
+
+    command = streamlink_command("https://radiko.jp/#!/ts/TEST/20250101050000")
+
+    assert command[1:5] == [
+        "-m",
+        "radiko_timeshift_recorder",
+        "fetch-stream",
+        "https://radiko.jp/#!/ts/TEST/20250101050000",
+    ]
+    assert "--segment-cache-dir" not in command
+
+
+@pytest.mark.parametrize("base_url", [None, "http://127.0.0.1:8080"])
+def test_streamlink_command_starts_fetcher_at_start_offset(
+    monkeypatch: pytest.MonkeyPatch, base_url: str | None
+) -> None:
+    if base_url is None:
+        monkeypatch.delenv(RADIKO_BASE_URL_ENV, raising=False)
+    else:
+        monkeypatch.setenv(RADIKO_BASE_URL_ENV, base_url)
+
+    command = streamlink_command(
+        "https://radiko.jp/#!/ts/TEST/20250101050000", start_offset=880
+    )
+
+    assert command[2:4] == ["radiko_timeshift_recorder", "fetch-stream"]
+    assert command[command.index("--start-offset") + 1] == "880"
+    assert "--hls-start-offset" not in command
+
+
+def test_concat_list_quotes_paths(tmp_path: Path) -> None:
+    assert concat_list([tmp_path / "a.mp4", tmp_path / "it's.mp4"]) == (
+        f"file '{tmp_path}/a.mp4'\nfile '{tmp_path}/it'\\''s.mp4'\n"
+    )
+
+
+@pytest.mark.asyncio
+async def test_download_stream_reports_progress(
+    tmp_path: Path, mocker: MockerFixture
+) -> None:
+    async def fake_run_pipeline(source, sink, *, on_sink_stdout_line, **kwargs) -> None:
+        for line in ["total_size=2048", "out_time_us=5000000", "speed=10x"]:
+            on_sink_stdout_line(line)
+
+    run_pipeline_spy = mocker.patch(
+        "radiko_timeshift_recorder.download.run_pipeline",
+        side_effect=fake_run_pipeline,
+    )
+    progress = DownloadProgress(total_size=1)
+
+    await download_stream(
+        "https://radiko.jp/#!/ts/TEST/20250101050000",
+        tmp_path / "out.mp4",
+        progress=progress,
+    )
+
+    (source, sink), _ = run_pipeline_spy.call_args
+    assert source[0] == "streamlink"
+    assert sink[0] == "ffmpeg"
+    assert sink[1][-1] == str((tmp_path / "out.mp4").resolve())
+    assert progress.total_size == 2048
+    assert progress.out_time == 5.0
+    assert progress.speed == 10.0
+
+
+@pytest.mark.asyncio
+async def test_download_stream_traces_stages(
+    tmp_path: Path, mocker: MockerFixture
+) -> None:
+    async def fake_run_pipeline(
+        source, sink, *, on_sink_stdout_line, on_source_exit, **kwargs
+    ) -> None:
+        on_sink_stdout_line("total_size=1024")
+        on_sink_stdout_line("total_size=2048")
+        on_source_exit(0)
+
+    mocker.patch(
+        "radiko_timeshift_recorder.download.run_pipeline",
+        side_effect=fake_run_pipeline,
+    )
+    trace_file = tmp_path / "trace.jsonl"
+    tracing.configure(trace_file)
+    try:
+        await download_stream(
+            "https://radiko.jp/#!/ts/TEST/20250101050000", tmp_path / "out.mp4"
+        )
+    finally:
+        tracing.shutdown()
+
+    [line] = trace_file.read_text().splitlines()
+    [span] = json.loads(line)["resourceSpans"][0]["scopeSpans"][0]["spans"]
+    assert span["name"] == "download_stream"
+    assert [e["name"] for e in span["events"]] == ["first_output", "source_exited"]
+
+
+@pytest.mark.asyncio
+async def test_download_stream_wraps_pipeline_error(
+    tmp_path: Path, mocker: MockerFixture
+) -> None:
+    mocker.patch(
+        "radiko_timeshift_recorder.download.run_pipeline",
+        side_effect=PipelineError("streamlink exited with 1: error: No streams"),
+    )
+
+    with pytest.raises(
+        RuntimeError,
+        match="Failed to download stream .+: streamlink exited with 1: error: No streams",
+    ):
+        await download_stream(
+            "https://radiko.jp/#!/ts/TEST/20250101050000", tmp_path / "out.mp4"
+        )
+
+
+@pytest.mark.asyncio
+async def test_download_stream_raises_upstream_error_for_radiko_errors(
+    tmp_path: Path, mocker: MockerFixture
+) -> None:
+    streamlink = PipelineProcessResult("streamlink", returncode=1)
+    streamlink.stderr_tail.append(
+        "error: Unable to open URL: https://radiko.jp/v2/api/ts/playlist.m3u8 "
+        "(503 Server Error: Service Unavailable for url: https://radiko.jp/)"
+    )
+    mocker.patch(
+        "radiko_timeshift_recorder.download.run_pipeline",
+        side_effect=PipelineError(streamlink.describe(), [streamlink]),
+    )
+
+    with pytest.raises(UpstreamError, match="503 Server Error"):
+        await download_stream(
+            "https://radiko.jp/#!/ts/TEST/20250101050000", tmp_path / "out.mp4"
+        )
+
+
+@pytest.mark.asyncio
+async def test_download_stream_aborts_stalled_pipeline(
+    tmp_path: Path, mocker: MockerFixture
+) -> None:
+    async def hanging_run_pipeline(
+        source, sink, *, on_sink_stdout_line, **kwargs
+    ) -> None:
+        on_sink_stdout_line("total_size=1024")
+        await asyncio.Event().wait()
+
+    mocker.patch(
+        "radiko_timeshift_recorder.download.run_pipeline",
+        side_effect=hanging_run_pipeline,
+    )
+
+    with pytest.raises(DownloadStalledError):
+        await download_stream(
+            "https://radiko.jp/#!/ts/TEST/20250101050000",
+            tmp_path / "out.mp4",
+            stall_timeout=0.05,
+        )
+
+
 def test_try_rename_with_candidates_success_first_try(mocker: MockerFixture) -> None:
     """Test case where renaming succeeds on the first try."""
     temp_filepath = Path("/tmp/tempfile")
@@ -106,11 +313,13 @@ def test_try_rename_with_candidates_success_first_try(mocker: MockerFixture) ->
         Path("/path/to/output1.mp4"),
         Path("/path/to/output2.mp4"),
     ]
-    mock_replace = mocker.patch.object(Path, "replace")
+    mock_rename = mocker.patch(
+        "radiko_timeshift_recorder.download.rename_without_overwriting"
+    )
 
     returned_path = try_rename_with_candidates(temp_filepath, out_filepath_candidates)
 
-    mock_replace.assert_called_once_with(out_filepath_candidates[0])
+    mock_rename.assert_called_once_with(temp_filepath, out_filepath_candidates[0])
     assert returned_path == out_filepath_candidates[0]
 
 
@@ -121,19 +330,21 @@ def test_try_rename_with_candidates_success_second_try(mocker: MockerFixture) ->
         Path("/path/to/long_name.mp4"),
         Path("/path/to/short_name.mp4"),
     ]
-    mock_replace = mocker.patch.object(Path, "replace")
-    mock_replace.side_effect = [
+    mock_rename = mocker.patch(
+        "radiko_timeshift_recorder.download.rename_without_overwriting"
+    )
+    mock_rename.side_effect = [
         OSError(errno.ENAMETOOLONG, "File name too long"),
         None,  # Second call succeeds
     ]
 
     returned_path = try_rename_with_candidates(temp_filepath, out_filepath_candidates)
 
-    assert mock_replace.call_count == 2
-    mock_replace.assert_has_calls(
+    assert mock_rename.call_count == 2
+    mock_rename.assert_has_calls(
         [
-            mocker.call(out_filepath_candidates[0]),
-            mocker.call(out_filepath_candidates[1]),
+            mocker.call(temp_filepath, out_filepath_candidates[0]),
+            mocker.call(temp_filepath, out_filepath_candidates[1]),
         ]
     )
     assert returned_path == out_filepath_candidates[1]
@@ -145,15 +356,19 @@ def test_try_rename_with_candidates_fail_all_name_too_long(
     """Test case where all candidates fail with ENAMETOOLONG."""
     temp_filepath = Path("/tmp/tempfile")
     out_filepath_candidates = [Path("/path/to/long1.mp4"), Path("/path/to/long2.mp4")]
-    mock_replace = mocker.patch.object(Path, "replace")
-    mock_replace.side_effect = OSError(errno.ENAMETOOLONG, "File name too long")
+    mock_rename = mocker.patch(
+        "radiko_timeshift_recorder.download.rename_without_overwriting"
+    )
+    mock_rename.side_effect = OSError(errno.ENAMETOOLONG, "File name too long")
 
     with pytest.raises(OSError) as excinfo:
         try_rename_with_candidates(temp_filepath, out_filepath_candidates)
 
     assert excinfo.value.errno == errno.ENAMETOOLONG
-    assert mock_replace.call_count == len(out_filepath_candidates)
-    mock_replace.assert_has_calls([mocker.call(p) for p in out_filepath_candidates])
+    assert mock_rename.call_count == len(out_filepath_candidates)
+    mock_rename.assert_has_calls(
+        [mocker.call(temp_filepath, p) for p in out_filepath_candidates]
+    )
 
 
 def test_try_rename_with_candidates_empty_list() -> None:
@@ -173,9 +388,11 @@ def test_try_rename_with_candidates_fail_other_oserror(mocker: MockerFixture) ->
         Path("/path/to/output1.mp4"),
         Path("/path/to/output2.mp4"),
     ]
-    mock_replace = mocker.patch.object(Path, "replace")
+    mock_rename = mocker.patch(
+        "radiko_timeshift_recorder.download.rename_without_overwriting"
+    )
     permission_error = OSError(errno.EACCES, "Permission denied")
-    mock_replace.side_effect = permission_error
+    mock_rename.side_effect = permission_error
 
     with pytest.raises(OSError) as excinfo:
         try_rename_with_candidates(temp_filepath, out_filepath_candidates)
@@ -184,7 +401,27 @@ def test_try_rename_with_candidates_fail_other_oserror(mocker: MockerFixture) ->
     assert (
         excinfo.value is permission_error
     )  # Verify that the same exception object is re-raised
-    mock_replace.assert_called_once_with(out_filepath_candidates[0])
+    mock_rename.assert_called_once_with(temp_filepath, out_filepath_candidates[0])
+
+
+def test_rename_without_overwriting_keeps_existing_target(tmp_path: Path) -> None:
+    source = tmp_path / "tmp.mp4"
+    source.write_bytes(b"new")
+    target = tmp_path / "out.mp4"
+    target.write_bytes(b"recorded before")
+
+    with pytest.raises(FileExistsError) as excinfo:
+        rename_without_overwriting(source, target)
+
+    assert excinfo.value.filename == str(target)
+
+    assert target.read_bytes() == b"recorded before"
+
+    target.unlink()
+    rename_without_overwriting(source, target)
+
+    assert target.read_bytes() == b"new"
+    assert not source.exists()
 
 
 @pytest.mark.asyncio
@@ -195,7 +432,7 @@ async def test_download_applies_output_file_mode(
     mocker: MockerFixture,
     mode: int,
 ) -> None:
-    async def fake_download_stream(url: str, out_filepath: Path) -> None:
+    async def fake_download_stream(url: str, out_filepath: Path, **kwargs) -> None:
         out_filepath.write_bytes(b"x")
 
     mocker.patch(
@@ -241,11 +478,381 @@ async def test_download_retries_stream_after_transient_failure(
 
     out_dir = tmp_path / "out"
     out_dir.mkdir()
+    progress = DownloadProgress()
 
-    await download(sample_job, out_dir)
+    await download(sample_job, out_dir, progress=progress)
 
     assert download_stream_spy.call_count == 2
+    assert progress.attempt == 2
+    assert progress.last_error == "transient stream failure"
     mp4s = list(
         (out_dir / sample_job.station_id / sample_job.program.title).glob("*.mp4")
     )
     assert len(mp4s) == 1
+
+
+@pytest.mark.asyncio
+async def test_download_skips_and_adds_to_library(
+    tmp_path: Path,
+    sample_job: Job,
+    mocker: MockerFixture,
+) -> None:
+    download_stream_spy = mocker.patch(
+        "radiko_timeshift_recorder.download.download_stream",
+        new_callable=AsyncMock,
+        side_effect=lambda url, out_filepath, **kwargs: out_filepath.write_bytes(b"x"),
+    )
+    mocker.patch(
+        "radiko_timeshift_recorder.download.get_duration",
+        new_callable=AsyncMock,
+        return_value=float(sample_job.program.dur),
+    )
+
+    out_dir = tmp_path / "out"
+    out_dir.mkdir()
+    library = LibraryIndex.open(tmp_path / "library.jsonl", out_dir)
+
+    await download(sample_job, out_dir, library=library)
+    assert library.contains(sample_job)
+
+    # Skipped by the index alone, even though the recording is gone.
+    for path in out_dir.rglob("*.mp4"):
+        path.unlink()
+    await download(sample_job, out_dir, library=library)
+
+    assert download_stream_spy.call_count == 1
+
+
+@pytest.mark.asyncio
+async def test_download_does_not_overwrite_recording_missing_from_library(
+    tmp_path: Path,
+    sample_job: Job,
+    mocker: MockerFixture,
+) -> None:
+    download_stream_spy = mocker.patch(
+        "radiko_timeshift_recorder.download.download_stream",
+        new_callable=AsyncMock,
+    )
+
+    out_dir = tmp_path / "out"
+    program_dir = out_dir / sample_job.station_id / sample_job.program.title
+    program_dir.mkdir(parents=True)
+    recording = program_dir.joinpath(
+        generate_filename_candidates(sample_job.program)[0]
+    ).with_suffix(".mp4")
+    recording.write_bytes(b"recorded before the index was lost")
+    library = LibraryIndex(tmp_path / "library.jsonl", out_dir)
+
+    await download(sample_job, out_dir, library=library)
+
+    download_stream_spy.assert_not_called()
+    assert recording.read_bytes() == b"recorded before the index was lost"
+
+
+@pytest.mark.asyncio
+async def test_download_keeps_recording_added_after_library_scan(
+    tmp_path: Path,
+    sample_job: Job,
+    mocker: MockerFixture,
+) -> None:
+    mocker.patch(
+        "radiko_timeshift_recorder.download.download_stream",
+        new_callable=AsyncMock,
+        side_effect=lambda url, out_filepath, **kwargs: out_filepath.write_bytes(b"x"),
+    )
+    mocker.patch(
+        "radiko_timeshift_recorder.download.get_duration",
+        new_callable=AsyncMock,
+        return_value=float(sample_job.program.dur),
+    )
+    out_dir = tmp_path / "out"
+    out_dir.mkdir()
+    library = LibraryIndex.open(tmp_path / "library.jsonl", out_dir)
+    program_dir = out_dir / sample_job.station_id / sample_job.program.title
+    program_dir.mkdir(parents=True)
+    recording = program_dir.joinpath(
+        generate_filename_candidates(sample_job.program)[0]
+    ).with_suffix(".mp4")
+    recording.write_bytes(b"added by hand")
+    exists = mocker.spy(Path, "exists")
+
+    await download(sample_job, out_dir, library=library)
+
+    # The complete index is trusted, and the rename finds the recording.
+    assert exists.call_count == 0
+    assert recording.read_bytes() == b"added by hand"
+    assert list(program_dir.iterdir()) == [recording]
+    assert library.entries[(sample_job.station_id, sample_job.program.ft)].path == str(
+        recording
+    )
+
+
+def test_move_with_candidates_copies_across_filesystems(
+    tmp_path: Path, mocker: MockerFixture
+) -> None:
+    scratch_dir = tmp_path / "scratch"
+    scratch_dir.mkdir()
+    program_dir = tmp_path / "out"
+    program_dir.mkdir()
+    temp_filepath = scratch_dir / "tmp.mp4"
+    temp_filepath.write_bytes(b"recording")
+    out_filepath_candidates = [program_dir / "long.mp4", program_dir / "short.mp4"]
+
+    hardlink_to = Path.hardlink_to
+
+    def fake_hardlink_to(self: Path, target: Path) -> None:
+        if target.parent == scratch_dir:
+            raise OSError(errno.EXDEV, "Invalid cross-device link")
+        if self.name == "long.mp4":
+            raise OSError(errno.ENAMETOOLONG, "File name too long")
+        hardlink_to(self, target)
+
+    mocker.patch.object(
+        Path, "hardlink_to", autospec=True, side_effect=fake_hardlink_to
+    )
+
+    out_filepath = move_with_candidates(temp_filepath, out_filepath_candidates)
+
+    assert out_filepath == program_dir / "short.mp4"
+    assert out_filepath.read_bytes() == b"recording"
+    assert not temp_filepath.exists()
+    assert list(program_dir.iterdir()) == [out_filepath]
+
+
+@pytest.mark.asyncio
+async def test_download_records_in_scratch_dir(
+    tmp_path: Path,
+    sample_job: Job,
+    mocker: MockerFixture,
+) -> None:
+    scratch_dir = tmp_path / "scratch"
+    scratch_dir.mkdir()
+    recorded_in: list[Path] = []
+
+    async def fake_download_stream(url: str, out_filepath: Path, **kwargs) -> None:
+        recorded_in.append(out_filepath.parent)
+        out_filepath.write_bytes(b"x")
+
+    mocker.patch(
+        "radiko_timeshift_recorder.download.download_stream",
+        side_effect=fake_download_stream,
+    )
+    mocker.patch(
+        "radiko_timeshift_recorder.download.get_duration",
+        new_callable=AsyncMock,
+        return_value=float(sample_job.program.dur),
+    )
+
+    out_dir = tmp_path / "out"
+    out_dir.mkdir()
+
+    await download(sample_job, out_dir, scratch_dir=scratch_dir)
+
+    assert recorded_in == [scratch_dir]
+    assert list(scratch_dir.iterdir()) == []
+    assert len(list(out_dir.rglob("*.mp4"))) == 1
+
+
+@pytest.mark.asyncio
+async def test_download_reports_stream_failures_to_limiter(
+    tmp_path: Path,
+    sample_job: Job,
+    mocker: MockerFixture,
+) -> None:
+    mocker.patch("asyncio.sleep", new_callable=AsyncMock)
+    mocker.patch(
+        "radiko_timeshift_recorder.download.download_stream",
+        new_callable=AsyncMock,
+        side_effect=[UpstreamError("429 Client Error: Too Many Requests"), None],
+    )
+    mocker.patch(
+        "radiko_timeshift_recorder.download.get_duration",
+        new_callable=AsyncMock,
+        return_value=float(sample_job.program.dur),
+    )
+    limiter = UpstreamLimiter(max_streams=4)
+    record_failure = mocker.spy(limiter, "record_failure")
+    record_success = mocker.spy(limiter, "record_success")
+
+    out_dir = tmp_path / "out"
+    out_dir.mkdir()
+
+    await download(sample_job, out_dir, limiter=limiter)
+
+    assert record_failure.call_count == 1
+    assert record_success.call_count == 1
+    assert limiter.stream_limit == 3
+    assert not limiter.streams
+
+
+@pytest.mark.asyncio
+async def test_download_does_not_back_off_on_other_failures(
+    tmp_path: Path,
+    sample_job: Job,
+    mocker: MockerFixture,
+) -> None:
+    mocker.patch("asyncio.sleep", new_callable=AsyncMock)
+    mocker.patch(
+        "radiko_timeshift_recorder.download.download_stream",
+        new_callable=AsyncMock,
+        side_effect=[RuntimeError("ffmpeg exited with 1: No space left"), None],
+    )
+    mocker.patch(
+        "radiko_timeshift_recorder.download.get_duration",
+        new_callable=AsyncMock,
+        return_value=float(sample_job.program.dur),
+    )
+    limiter = UpstreamLimiter(max_streams=4)
+    record_failure = mocker.spy(limiter, "record_failure")
+
+    out_dir = tmp_path / "out"
+    out_dir.mkdir()
+
+    await download(sample_job, out_dir, limiter=limiter)
+
+    assert record_failure.call_count == 0
+    assert limiter.stream_limit == 4
+
+
+def _fake_ffmpeg(commands: list[list[str]]):
+    async def run_ffmpeg(command: list[str]) -> None:
+        commands.append(command)
+        Path(command[-1]).write_bytes(b"salvaged")
+
+    return run_ffmpeg
+
+
+@pytest.mark.asyncio
+async def test_download_trims_over_long_recording(
+    tmp_path: Path,
+    sample_job: Job,
+    mocker: MockerFixture,
+) -> None:
+    async def fake_download_stream(url: str, out_filepath: Path, **kwargs) -> None:
+        out_filepath.write_bytes(b"x")
+
+    download_stream_spy = mocker.patch(
+        "radiko_timeshift_recorder.download.download_stream",
+        side_effect=fake_download_stream,
+    )
+    mocker.patch(
+        "radiko_timeshift_recorder.download.get_duration",
+        new_callable=AsyncMock,
+        side_effect=[sample_job.program.dur + 4.5, float(sample_job.program.dur)],
+    )
+    commands: list[list[str]] = []
+    mocker.patch(
+        "radiko_timeshift_recorder.download.run_ffmpeg",
+        side_effect=_fake_ffmpeg(commands),
+    )
+
+    out_dir = tmp_path / "out"
+    out_dir.mkdir()
+
+    await download(sample_job, out_dir)
+
+    assert download_stream_spy.call_count == 1
+    assert len(commands) == 1
+    assert commands[0][commands[0].index("-t") + 1] == "900.000"
+    assert commands[0][commands[0].index("-codec") + 1] == "copy"
+    (mp4,) = out_dir.rglob("*.mp4")
+    assert mp4.read_bytes() == b"salvaged"
+    assert not list(out_dir.rglob(".salvage-*"))
+
+
+@pytest.mark.asyncio
+async def test_download_fetches_missing_tail_of_short_recording(
+    tmp_path: Path,
+    sample_job: Job,
+    mocker: MockerFixture,
+) -> None:
+    async def fake_download_stream(url: str, out_filepath: Path, **kwargs) -> None:
+        out_filepath.write_bytes(b"x")
+
+    download_stream_spy = mocker.patch(
+        "radiko_timeshift_recorder.download.download_stream",
+        side_effect=fake_download_stream,
+    )
+    mocker.patch(
+        "radiko_timeshift_recorder.download.get_duration",
+        new_callable=AsyncMock,
+        side_effect=[sample_job.program.dur - 10.0, float(sample_job.program.dur)],
+    )
+    commands: list[list[str]] = []
+    mocker.patch(
+        "radiko_timeshift_recorder.download.run_ffmpeg",
+        side_effect=_fake_ffmpeg(commands),
+    )
+
+    out_dir = tmp_path / "out"
+    out_dir.mkdir()
+    progress = DownloadProgress()
+
+    await download(sample_job, out_dir, progress=progress)
+
+    assert download_stream_spy.call_count == 2
+    assert download_stream_spy.call_args_list[0].kwargs["progress"] is progress
+    assert download_stream_spy.call_args_list[0].kwargs["start_offset"] == 0
+    tail_call = download_stream_spy.call_args_list[1]
+    assert tail_call.kwargs["progress"] is None
+    assert tail_call.kwargs["start_offset"] == sample_job.program.dur - 11
+    assert len(commands) == 1
+    assert "concat" in commands[0]
+    (mp4,) = out_dir.rglob("*.mp4")
+    assert mp4.read_bytes() == b"salvaged"
+    assert progress.file_size == len(b"salvaged")
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize(
+    ("shortfall", "salvaged_shortfall"),
+    [
+        # Short or long by too much to salvage.
+        (600.0, None),
+        (-600.0, None),
+        # Still short after fetching the tail.
+        (20.0, 20.0),
+        # The tail turned out to be the whole program.
+        (20.0, -880.0),
+    ],
+)
+async def test_download_downloads_again_when_salvage_is_not_possible(
+    tmp_path: Path,
+    sample_job: Job,
+    mocker: MockerFixture,
+    shortfall: float,
+    salvaged_shortfall: float | None,
+) -> None:
+    mocker.patch("asyncio.sleep", new_callable=AsyncMock)
+
+    async def fake_download_stream(url: str, out_filepath: Path, **kwargs) -> None:
+        out_filepath.write_bytes(b"full")
+
+    download_stream_spy = mocker.patch(
+        "radiko_timeshift_recorder.download.download_stream",
+        side_effect=fake_download_stream,
+    )
+    durations = [sample_job.program.dur - shortfall]
+    if salvaged_shortfall is not None:
+        durations.append(sample_job.program.dur - salvaged_shortfall)
+    mocker.patch(
+        "radiko_timeshift_recorder.download.get_duration",
+        new_callable=AsyncMock,
+        side_effect=durations + [float(sample_job.program.dur)],
+    )
+    commands: list[list[str]] = []
+    mocker.patch(
+        "radiko_timeshift_recorder.download.run_ffmpeg",
+        side_effect=_fake_ffmpeg(commands),
+    )
+
+    out_dir = tmp_path / "out"
+    out_dir.mkdir()
+
+    await download(sample_job, out_dir)
+
+    assert [
+        call.kwargs["start_offset"] for call in download_stream_spy.call_args_list
+    ] == ([0, 0] if salvaged_shortfall is None else [0, sample_job.program.dur - 21, 0])
+    (mp4,) = out_dir.rglob("*.mp4")
+    assert mp4.read_bytes() == b"full"
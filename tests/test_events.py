@@ -0,0 +1,96 @@
+import asyncio
+
+import pytest
+
+from radiko_timeshift_recorder.events import EventBus
+from radiko_timeshift_recorder.job import Job
+
+
+@pytest.mark.asyncio
+async def test_event_bus_delivers_published_events(sample_job: Job) -> None:
+    bus = EventBus()
+
+    with bus.subscribe() as subscription:
+        bus.publish("started", sample_job, worker_id=1)
+        event = await subscription.get(timeout=1)
+
+    assert event is not None
+    assert event.type == "started"
+    assert event.job_key == sample_job.key
+    assert event.data == {"worker_id": 1}
+    assert bus.subscriptions == set()
+
+
+@pytest.mark.asyncio
+async def test_event_bus_resumes_after_last_event_id(sample_job: Job) -> None:
+    bus = EventBus()
+    first = bus.publish("enqueued", sample_job)
+    bus.publish("started", sample_job)
+    bus.publish("completed", sample_job)
+
+    with bus.subscribe(last_event_id=first.id) as subscription:
+        events = [await subscription.get(timeout=1) for _ in range(2)]
+
+    assert [e.type for e in events if e is not None] == ["started", "completed"]
+
+
+@pytest.mark.asyncio
+async def test_event_bus_replays_history_for_unknown_newer_id(
+    sample_job: Job,
+) -> None:
+    bus = EventBus()
+    bus.publish("enqueued", sample_job)
+
+    with bus.subscribe(last_event_id=100) as subscription:
+        event = await subscription.get(timeout=1)
+
+    assert event is not None and event.type == "enqueued"
+
+
+@pytest.mark.asyncio
+async def test_event_bus_closes_slow_subscriber(sample_job: Job) -> None:
+    bus = EventBus(subscriber_buffer_size=2)
+
+    with bus.subscribe() as subscription:
+        for _ in range(5):
+            bus.publish("progress", sample_job)
+
+        events = [await subscription.get(timeout=1) for _ in range(3)]
+
+    assert subscription.overflowed
+    assert [e.id for e in events if e is not None] == [1, 2]
+    assert events[2] is None
+
+
+@pytest.mark.asyncio
+async def test_event_bus_close_ends_subscriptions(sample_job: Job) -> None:
+    bus = EventBus()
+    bus.publish("enqueued", sample_job)
+
+    with bus.subscribe() as subscription:
+        waiter = asyncio.create_task(subscription.get())
+        await asyncio.sleep(0)
+        bus.close()
+        assert await waiter is None
+
+    with bus.subscribe(last_event_id=0) as subscription:
+        assert await subscription.get() is not None
+        assert await subscription.get() is None
+
+
+@pytest.mark.asyncio
+async def test_subscription_get_times_out() -> None:
+    bus = EventBus()
+
+    with bus.subscribe() as subscription:
+        with pytest.raises(TimeoutError):
+            await subscription.get(timeout=0.01)
+
+
+def test_job_event_to_sse(sample_job: Job):
+    event = EventBus().publish("started", sample_job, worker_id=0)
+
+    sse = event.to_sse()
+
+    assert sse.startswith("id: 1\nevent: started\ndata: {")
+    assert sse.endswith("}\n\n")
@@ -37,6 +37,13 @@ no_duration_key_output_bytes = no_duration_key_output_str.encode("utf-8")
 invalid_json_bytes = b'{ "streams": [ { "duration": "900.123" } '
 
 
+def make_stream_reader(data: bytes) -> asyncio.StreamReader:
+    reader = asyncio.StreamReader()
+    reader.feed_data(data)
+    reader.feed_eof()
+    return reader
+
+
 def test_parse_ffprobe_duration_success():
     duration = parse_ffprobe_duration(valid_parse_output_bytes)
     assert duration == expected_parse_duration
@@ -70,6 +77,22 @@ def test_parse_ffprobe_duration_non_numeric_duration():
         parse_ffprobe_duration(non_numeric_duration_bytes)
 
 
+@pytest.mark.asyncio
+async def test_get_duration_reads_mp4_without_ffprobe(
+    mocker: MockerFixture, tmp_path: Path
+):
+    mocker.patch(
+        "radiko_timeshift_recorder.get_duration.read_audio_duration",
+        return_value=900.0,
+    )
+    mock_create_subprocess = mocker.patch(
+        "radiko_timeshift_recorder.get_duration.asyncio.create_subprocess_exec"
+    )
+
+    assert await get_duration(tmp_path / "audio.mp4") == 900.0
+    mock_create_subprocess.assert_not_called()
+
+
 @pytest.mark.asyncio
 async def test_get_duration_success(mocker: MockerFixture):
     # --- Arrange ---
@@ -81,9 +104,8 @@ async def test_get_duration_success(mocker: MockerFixture):
 
     mock_subprocess = mocker.AsyncMock()
     mock_subprocess.returncode = 0
-    mock_subprocess.communicate = mocker.AsyncMock(
-        return_value=(mock_stdout_bytes, mock_stderr_bytes)
-    )
+    mock_subprocess.stdout = make_stream_reader(mock_stdout_bytes)
+    mock_subprocess.stderr = make_stream_reader(mock_stderr_bytes)
 
     mock_create_subprocess = mocker.patch(
         "radiko_timeshift_recorder.get_duration.asyncio.create_subprocess_exec",
@@ -113,7 +135,7 @@ async def test_get_duration_success(mocker: MockerFixture):
         stdout=asyncio.subprocess.PIPE,
         stderr=asyncio.subprocess.PIPE,
     )
-    mock_subprocess.communicate.assert_awaited_once()
+    mock_subprocess.wait.assert_awaited_once()
 
 
 @pytest.mark.asyncio
@@ -125,9 +147,8 @@ async def test_get_duration_ffprobe_fails(mocker: MockerFixture):
 
     mock_subprocess = mocker.AsyncMock()
     mock_subprocess.returncode = 1
-    mock_subprocess.communicate = mocker.AsyncMock(
-        return_value=(mock_stdout_bytes, mock_stderr_bytes)
-    )
+    mock_subprocess.stdout = make_stream_reader(mock_stdout_bytes)
+    mock_subprocess.stderr = make_stream_reader(mock_stderr_bytes)
 
     mock_create_subprocess = mocker.patch(
         "radiko_timeshift_recorder.get_duration.asyncio.create_subprocess_exec",
@@ -142,7 +163,7 @@ async def test_get_duration_ffprobe_fails(mocker: MockerFixture):
         await get_duration(filepath)
 
     mock_create_subprocess.assert_called_once()
-    mock_subprocess.communicate.assert_awaited_once()
+    mock_subprocess.wait.assert_awaited_once()
 
 
 @pytest.mark.asyncio
@@ -154,9 +175,8 @@ async def test_get_duration_parse_fails(mocker: MockerFixture):
 
     mock_subprocess = mocker.AsyncMock()
     mock_subprocess.returncode = 0
-    mock_subprocess.communicate = mocker.AsyncMock(
-        return_value=(mock_stdout_bytes, mock_stderr_bytes)
-    )
+    mock_subprocess.stdout = make_stream_reader(mock_stdout_bytes)
+    mock_subprocess.stderr = make_stream_reader(mock_stderr_bytes)
 
     mock_create_subprocess = mocker.patch(
         "radiko_timeshift_recorder.get_duration.asyncio.create_subprocess_exec",
@@ -168,4 +188,4 @@ async def test_get_duration_parse_fails(mocker: MockerFixture):
         await get_duration(filepath)
 
     mock_create_subprocess.assert_called_once()
-    mock_subprocess.communicate.assert_awaited_once()
+    mock_subprocess.wait.assert_awaited_once()
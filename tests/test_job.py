@@ -7,3 +7,7 @@ def test_job_serialization_deserialization(sample_job: Job):
     deserialized_program = Job.model_validate_json(json_string)
 
     assert deserialized_program == sample_job
+
+
+def test_job_key(sample_job: Job):
+    assert sample_job.key == "TEST_20250101050000"
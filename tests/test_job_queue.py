@@ -1,6 +1,11 @@
 import pytest
 
-from radiko_timeshift_recorder.job_queue import JobAlreadyExistsError, JobQueue
+from radiko_timeshift_recorder.job_queue import (
+    JobAlreadyExistsError,
+    JobQueue,
+    LaneScheduler,
+    Priority,
+)
 
 
 @pytest.mark.asyncio
@@ -52,8 +57,125 @@ async def test_job_queue_done_job_can_be_reput():
     job = await job_queue.get()
     assert job == 1
 
-    job_queue.mark_done(job)
+    await job_queue.mark_done(job)
 
     await job_queue.put(1)
     job = await job_queue.get()
     assert job == 1
+
+
+@pytest.mark.asyncio
+async def test_job_queue_requeued_job_keeps_its_lane_and_enqueued_at():
+    job_queue = JobQueue[int]()
+
+    await job_queue.put(2)
+    await job_queue.put(1, Priority.INTERACTIVE)
+    enqueued_at = job_queue.enqueued_at[1]
+    job = await job_queue.get()
+    assert job == 1
+
+    await job_queue.requeue(job)
+
+    assert job_queue.pending == {1, 2}
+    assert job_queue.in_progress == set()
+    assert job_queue.enqueued_at[1] == enqueued_at
+    assert job_queue.priorities[1] == Priority.INTERACTIVE
+    assert await job_queue.get() == 1
+
+
+@pytest.mark.asyncio
+async def test_job_queue_tracks_enqueued_at_until_done():
+    job_queue = JobQueue[int]()
+
+    await job_queue.put(1)
+    assert 1 in job_queue.enqueued_at
+
+    job = await job_queue.get()
+    assert job in job_queue.enqueued_at
+
+    await job_queue.mark_done(job)
+    assert job_queue.enqueued_at == {}
+
+
+def test_lane_scheduler_picks_lanes_by_weight():
+    scheduler = LaneScheduler(
+        {Priority.INTERACTIVE: 3, Priority.RULES: 2, Priority.BACKFILL: 1}
+    )
+
+    picks = [scheduler.pick(Priority) for _ in range(6)]
+
+    assert picks.count(Priority.INTERACTIVE) == 3
+    assert picks.count(Priority.RULES) == 2
+    assert picks.count(Priority.BACKFILL) == 1
+    assert picks[0] == Priority.INTERACTIVE
+
+
+@pytest.mark.asyncio
+async def test_job_queue_takes_interactive_jobs_first_without_starving_bulk():
+    job_queue = JobQueue[int]()
+    for job in range(10, 20):
+        await job_queue.put(job, Priority.RULES)
+    await job_queue.put(99, Priority.BACKFILL)
+    await job_queue.put(50, Priority.INTERACTIVE)
+
+    expected = job_queue.pending_in_order()
+    jobs = [await job_queue.get() for _ in range(12)]
+
+    assert jobs == expected
+    assert jobs[0] == 50
+    # Rules jobs keep their own order, and the backfill job gets a turn
+    # before all of them are done.
+    assert [job for job in jobs if 10 <= job < 20] == list(range(10, 20))
+    assert jobs.index(99) < 6
+
+
+@pytest.mark.asyncio
+async def test_job_queue_moves_pending_jobs_up_to_higher_lanes():
+    job_queue = JobQueue[int](fair_key=lambda job: job // 10)
+    for job in [10, 11, 20]:
+        assert await job_queue.put(job, Priority.BACKFILL)
+
+    assert not await job_queue.put(11, Priority.INTERACTIVE)
+    assert job_queue.priorities[11] == Priority.INTERACTIVE
+    assert job_queue.pending_in_order() == [11, 10, 20]
+    # Never moved down, nor once taken.
+    with pytest.raises(JobAlreadyExistsError):
+        await job_queue.put(10, Priority.BACKFILL)
+    assert await job_queue.get() == 11
+    with pytest.raises(JobAlreadyExistsError):
+        await job_queue.put(11, Priority.INTERACTIVE)
+    assert [await job_queue.get() for _ in range(2)] == [10, 20]
+
+
+@pytest.mark.asyncio
+async def test_job_queue_tracks_priorities_until_done():
+    job_queue = JobQueue[int]()
+
+    await job_queue.put(1, Priority.BACKFILL)
+    assert job_queue.priorities == {1: Priority.BACKFILL}
+
+    await job_queue.mark_done(await job_queue.get())
+    assert job_queue.priorities == {}
+
+
+@pytest.mark.asyncio
+async def test_fair_job_queue_takes_from_each_key_in_turn():
+    # Keyed by the tens digit, like jobs by station.
+    job_queue = JobQueue[int](fair_key=lambda job: job // 10)
+    for job in [13, 12, 11, 10, 21, 20, 30]:
+        await job_queue.put(job)
+
+    expected = job_queue.pending_in_order()
+    jobs = [await job_queue.get() for _ in range(7)]
+
+    assert jobs == expected == [10, 20, 30, 11, 21, 12, 13]
+
+
+@pytest.mark.asyncio
+async def test_fair_job_queue_keeps_lanes():
+    job_queue = JobQueue[int](fair_key=lambda job: job // 10)
+    await job_queue.put(10)
+    await job_queue.put(11)
+    await job_queue.put(25, Priority.INTERACTIVE)
+
+    assert [await job_queue.get() for _ in range(3)] == [25, 10, 11]
@@ -0,0 +1,257 @@
+import asyncio
+import datetime
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Generator
+
+import pytest
+from pytest_mock import MockerFixture
+
+from radiko_timeshift_recorder.job import Job
+from radiko_timeshift_recorder.job_queue import JobAlreadyExistsError, Priority
+from radiko_timeshift_recorder.job_store import SqliteJobQueue
+
+
+def shifted(job: Job, hours: int) -> Job:
+    delta = datetime.timedelta(hours=hours)
+    return job.model_copy(
+        update={
+            "program": job.program.model_copy(
+                update={"ft": job.program.ft + delta, "to": job.program.to + delta}
+            )
+        }
+    )
+
+
+@pytest.fixture
+def nodes(tmp_path: Path) -> Generator[tuple[SqliteJobQueue, SqliteJobQueue]]:
+    a = SqliteJobQueue(tmp_path / "jobs.db", node_id="a", poll_interval=0.01)
+    b = SqliteJobQueue(tmp_path / "jobs.db", node_id="b", poll_interval=0.01)
+    yield a, b
+    a.close()
+    b.close()
+
+
+@pytest.mark.asyncio
+async def test_get_respects_priority_across_nodes(
+    nodes: tuple[SqliteJobQueue, SqliteJobQueue], sample_job: Job
+):
+    a, b = nodes
+    later_job = shifted(sample_job, 1)
+    await a.put(later_job)
+    await b.put(sample_job)
+    # Each node sees the jobs of the others once it refreshes.
+    await a.refresh()
+
+    assert a.pending_in_order() == [sample_job, later_job]
+    assert await b.get() == sample_job
+    assert await a.get() == later_job
+    await b.refresh()
+    assert a.in_progress == b.in_progress == {sample_job, later_job}
+    assert b.qsize() == 0
+
+
+@pytest.mark.asyncio
+async def test_duplicate_jobs_cant_be_put_on_any_node(
+    nodes: tuple[SqliteJobQueue, SqliteJobQueue], sample_job: Job
+):
+    a, b = nodes
+    await a.put(sample_job)
+    with pytest.raises(JobAlreadyExistsError):
+        await b.put(sample_job)
+
+    assert await a.get() == sample_job
+    with pytest.raises(JobAlreadyExistsError):
+        await b.put(sample_job)
+
+    await a.mark_done(sample_job)
+    await b.put(sample_job)
+    assert b.pending == {sample_job}
+
+
+@pytest.mark.asyncio
+async def test_get_waits_for_jobs_from_other_nodes(
+    nodes: tuple[SqliteJobQueue, SqliteJobQueue], sample_job: Job
+):
+    a, b = nodes
+    getter = asyncio.create_task(a.get())
+    await asyncio.sleep(0.02)
+    assert not getter.done()
+
+    await b.put(sample_job)
+
+    assert await asyncio.wait_for(getter, timeout=1) == sample_job
+
+
+@pytest.mark.asyncio
+async def test_expired_leases_are_reclaimed(tmp_path: Path, sample_job: Job):
+    crashed = SqliteJobQueue(tmp_path / "jobs.db", node_id="a", lease_seconds=0.05)
+    survivor = SqliteJobQueue(tmp_path / "jobs.db", node_id="b", poll_interval=0.01)
+    await crashed.put(sample_job)
+    assert await crashed.get() == sample_job
+    await survivor.refresh()
+    assert survivor.in_progress == {sample_job}
+
+    await asyncio.sleep(0.1)
+
+    assert survivor.pending == {sample_job}
+    assert await survivor.get() == sample_job
+    # The old owner can no longer finish or renew the job.
+    await crashed.mark_done(sample_job)
+    assert survivor.in_progress == {sample_job}
+
+
+@pytest.mark.asyncio
+async def test_renewed_leases_are_kept(tmp_path: Path, sample_job: Job):
+    a = SqliteJobQueue(tmp_path / "jobs.db", node_id="a", lease_seconds=0.15)
+    await a.put(sample_job)
+    await a.get()
+
+    renewal = asyncio.create_task(a.renew_leases())
+    await asyncio.sleep(0.3)
+    renewal.cancel()
+
+    assert a.in_progress == {sample_job}
+
+
+@pytest.mark.asyncio
+async def test_release_returns_jobs_to_other_nodes(
+    nodes: tuple[SqliteJobQueue, SqliteJobQueue], sample_job: Job
+):
+    a, b = nodes
+    await a.put(sample_job)
+    await a.get()
+
+    await a.release()
+
+    assert a.leased == set()
+    assert await b.get() == sample_job
+
+
+@pytest.mark.asyncio
+async def test_enqueued_at(
+    nodes: tuple[SqliteJobQueue, SqliteJobQueue], sample_job: Job
+):
+    a, b = nodes
+    await a.put(sample_job)
+    await b.refresh()
+
+    assert b.enqueued_at[sample_job] > 0
+    assert list(b.enqueued_at) == [sample_job]
+    assert b.enqueued_at.get(shifted(sample_job, 1)) is None
+
+
+@pytest.mark.asyncio
+async def test_get_takes_interactive_lane_first(
+    nodes: tuple[SqliteJobQueue, SqliteJobQueue], sample_job: Job
+):
+    a, b = nodes
+    interactive_job = shifted(sample_job, 1)
+    await a.put(sample_job)
+    await a.put(interactive_job, Priority.INTERACTIVE)
+    await b.refresh()
+
+    assert b.priorities[interactive_job] == Priority.INTERACTIVE
+    assert b.pending_in_order() == [interactive_job, sample_job]
+    assert await b.get() == interactive_job
+
+
+@pytest.mark.asyncio
+async def test_put_moves_pending_jobs_up_to_higher_lanes(
+    nodes: tuple[SqliteJobQueue, SqliteJobQueue], sample_job: Job
+):
+    a, b = nodes
+    earlier_job = shifted(sample_job, -1)
+    await a.put(earlier_job)
+    await a.put(sample_job, Priority.BACKFILL)
+
+    assert not await b.put(sample_job, Priority.INTERACTIVE)
+    assert b.priorities[sample_job] == Priority.INTERACTIVE
+    with pytest.raises(JobAlreadyExistsError):
+        await b.put(sample_job, Priority.RULES)
+    assert await a.get() == sample_job
+    with pytest.raises(JobAlreadyExistsError):
+        await b.put(sample_job, Priority.INTERACTIVE)
+
+
+@pytest.mark.asyncio
+async def test_adds_priorities_to_old_databases(tmp_path: Path, sample_job: Job):
+    with sqlite3.connect(tmp_path / "jobs.db") as connection:
+        connection.execute(
+            "CREATE TABLE jobs (job TEXT PRIMARY KEY, program_to REAL NOT NULL, "
+            "program_ft REAL NOT NULL, enqueued_at REAL NOT NULL, owner TEXT, "
+            "lease_expires_at REAL)"
+        )
+        connection.execute(
+            "INSERT INTO jobs VALUES (?, 0, 0, 0, NULL, NULL)",
+            (sample_job.model_dump_json(),),
+        )
+    connection.close()
+
+    job_queue = SqliteJobQueue(tmp_path / "jobs.db")
+    try:
+        assert job_queue.priorities[sample_job] == Priority.RULES
+        assert await job_queue.get() == sample_job
+    finally:
+        job_queue.close()
+
+
+@pytest.mark.asyncio
+async def test_locked_database_does_not_block_the_event_loop(
+    tmp_path: Path, sample_job: Job, mocker: MockerFixture
+):
+    mocker.patch("radiko_timeshift_recorder.job_store.BUSY_TIMEOUT_SECONDS", 0.01)
+    mocker.patch("radiko_timeshift_recorder.job_store.LOCK_RETRY_INTERVAL", 0.01)
+    job_queue = SqliteJobQueue(tmp_path / "jobs.db")
+    # Another node holds the write lock.
+    other_node = sqlite3.connect(tmp_path / "jobs.db", isolation_level=None)
+    other_node.execute("BEGIN IMMEDIATE")
+    try:
+        put = asyncio.create_task(job_queue.put(sample_job))
+        ticks = 0
+        while not put.done() and ticks < 10:
+            await asyncio.sleep(0.01)
+            ticks += 1
+        assert ticks == 10 and not put.done()
+        # Reads are served while the put waits for the lock.
+        assert job_queue.pending == set()
+
+        other_node.execute("COMMIT")
+        await asyncio.wait_for(put, timeout=5)
+        assert job_queue.pending == {sample_job}
+    finally:
+        other_node.close()
+        job_queue.close()
+
+
+@pytest.mark.asyncio
+async def test_cancelled_get_gives_back_the_job_it_took(
+    nodes: tuple[SqliteJobQueue, SqliteJobQueue], sample_job: Job, mocker: MockerFixture
+):
+    a, b = nodes
+    await b.put(sample_job)
+    claim = a._claim
+    claiming = threading.Event()
+
+    def slow_claim():
+        claiming.wait(timeout=5)
+        return claim()
+
+    mocker.patch.object(a, "_claim", side_effect=slow_claim)
+    get = asyncio.create_task(a.get())
+    await asyncio.sleep(0.01)
+    # E.g. an idle worker stopped by the worker pool.
+    get.cancel()
+    claiming.set()
+    with pytest.raises(asyncio.CancelledError):
+        await get
+
+    for _ in range(100):
+        await b.refresh()
+        if b.pending:
+            break
+        await asyncio.sleep(0.01)
+    assert b.pending == {sample_job}
+    assert a.leased == set()
+    assert await b.get() == sample_job
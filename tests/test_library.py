@@ -0,0 +1,124 @@
+import datetime
+from pathlib import Path
+from zoneinfo import ZoneInfo
+
+from radiko_timeshift_recorder.download import generate_filename_candidates
+from radiko_timeshift_recorder.job import Job
+from radiko_timeshift_recorder.library import (
+    LibraryEntry,
+    LibraryIndex,
+    entry_from_path,
+    scan_library,
+)
+
+
+def recording_path(out_dir: Path, job: Job) -> Path:
+    filename = generate_filename_candidates(job.program)[0]
+    return out_dir / job.station_id / job.program.title / f"{filename}.mp4"
+
+
+def write_recording(out_dir: Path, job: Job) -> Path:
+    path = recording_path(out_dir, job)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(b"x")
+    return path
+
+
+def test_entry_from_path(tmp_path: Path, sample_job: Job):
+    entry = entry_from_path(tmp_path, recording_path(tmp_path, sample_job))
+
+    assert entry is not None
+    assert entry.station_id == sample_job.station_id
+    assert entry.ft == sample_job.program.ft
+    assert entry.key == sample_job.key
+
+
+def test_entry_from_path_ignores_other_files(tmp_path: Path):
+    program_dir = tmp_path / "TEST" / "test program"
+
+    assert entry_from_path(tmp_path, program_dir / "tmpabc.mp4") is None
+    assert entry_from_path(tmp_path, program_dir / "2025-01-01 05-00-00.part") is None
+    assert entry_from_path(tmp_path, tmp_path / "2025-01-01 05-00-00.mp4") is None
+
+
+def test_scan_library(tmp_path: Path, sample_job: Job):
+    write_recording(tmp_path, sample_job)
+    (tmp_path / "TEST" / "test program" / "tmpabc.mp4").write_bytes(b"x")
+
+    assert [e.key for e in scan_library(tmp_path)] == [sample_job.key]
+
+
+def test_open_builds_missing_index(tmp_path: Path, sample_job: Job):
+    out_dir = tmp_path / "out"
+    write_recording(out_dir, sample_job)
+
+    library = LibraryIndex.open(tmp_path / "library.jsonl", out_dir)
+
+    assert library.contains(sample_job)
+    assert (tmp_path / "library.jsonl").exists()
+
+
+def test_add_persists_entries(tmp_path: Path, sample_job: Job):
+    out_dir = tmp_path / "out"
+    out_dir.mkdir()
+    library = LibraryIndex.open(tmp_path / "library.jsonl", out_dir)
+    assert not library.contains(sample_job)
+
+    library.add(sample_job, recording_path(out_dir, sample_job))
+
+    assert library.contains(sample_job)
+    reopened = LibraryIndex.open(tmp_path / "library.jsonl", out_dir)
+    assert reopened.contains(sample_job)
+    assert len(reopened) == 1
+    assert reopened.entries[(sample_job.station_id, sample_job.program.ft)].dur == 900
+
+
+def test_load_skips_invalid_lines(tmp_path: Path, sample_job: Job):
+    entry = LibraryEntry(
+        station_id=sample_job.station_id, ft=sample_job.program.ft, path="a.mp4"
+    )
+    index_path = tmp_path / "library.jsonl"
+    index_path.write_text(f'{{"station_id": "TE\n{entry.model_dump_json()}\n')
+
+    library = LibraryIndex.open(index_path, tmp_path)
+
+    assert len(library) == 1
+    assert library.contains(sample_job)
+
+
+def test_rebuild_replaces_index_with_scan(tmp_path: Path, sample_job: Job):
+    out_dir = tmp_path / "out"
+    out_dir.mkdir()
+    library = LibraryIndex.open(tmp_path / "library.jsonl", out_dir)
+    library.add(sample_job, recording_path(out_dir, sample_job))
+    other_job = sample_job.model_copy(
+        update={
+            "program": sample_job.program.model_copy(
+                update={
+                    "ft": datetime.datetime(
+                        2025, 1, 2, 5, 0, tzinfo=ZoneInfo("Asia/Tokyo")
+                    )
+                }
+            )
+        }
+    )
+    write_recording(out_dir, other_job)
+
+    assert library.rebuild() == 1
+
+    # The recording of sample_job was never written, so the scan drops it.
+    assert not library.contains(sample_job)
+    assert library.contains(other_job)
+    assert len(LibraryIndex.open(tmp_path / "library.jsonl", out_dir)) == 1
+
+
+def test_rebuild_keeps_known_durations(tmp_path: Path, sample_job: Job):
+    out_dir = tmp_path / "out"
+    out_dir.mkdir()
+    library = LibraryIndex.open(tmp_path / "library.jsonl", out_dir)
+    library.add(sample_job, write_recording(out_dir, sample_job))
+
+    library.rebuild()
+
+    entry = library.entries[(sample_job.station_id, sample_job.program.ft)]
+    assert entry.dur == sample_job.program.dur
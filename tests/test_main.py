@@ -0,0 +1,21 @@
+import pstats
+from pathlib import Path
+
+from typer.testing import CliRunner
+
+from radiko_timeshift_recorder.__main__ import app
+
+
+def test_profile_option_writes_pstats(tmp_path: Path):
+    profile = tmp_path / "gen.prof"
+
+    result = CliRunner().invoke(
+        app, ["--profile", str(profile), "gen-json-schema-for-rules"]
+    )
+
+    assert result.exit_code == 0, result.output
+    stats = pstats.Stats(str(profile))
+    assert any(
+        function_name == "gen_json_schema_for_rules"
+        for _, _, function_name in stats.stats  # type: ignore[attr-defined]
+    )
@@ -0,0 +1,24 @@
+import pytest
+import tenacity
+
+from radiko_timeshift_recorder.metrics import failure_cause
+
+
+class CustomError(Exception):
+    pass
+
+
+def test_failure_cause_names_exception_type():
+    assert failure_cause(CustomError()) == "CustomError"
+
+
+@pytest.mark.asyncio
+async def test_failure_cause_looks_through_retry_error() -> None:
+    @tenacity.retry(stop=tenacity.stop_after_attempt(1))
+    async def always_fails() -> None:
+        raise CustomError()
+
+    with pytest.raises(tenacity.RetryError) as excinfo:
+        await always_fails()
+
+    assert failure_cause(excinfo.value) == "CustomError"
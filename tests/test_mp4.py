@@ -0,0 +1,142 @@
+import asyncio
+import shutil
+import struct
+from pathlib import Path
+from typing import Optional
+
+import pytest
+
+from radiko_timeshift_recorder.get_duration import get_duration_with_ffprobe
+from radiko_timeshift_recorder.mp4 import Mp4Error, read_audio_duration
+
+
+def box(box_type: bytes, *children: bytes) -> bytes:
+    payload = b"".join(children)
+    return struct.pack(">I4s", 8 + len(payload), box_type) + payload
+
+
+def large_box(box_type: bytes, payload: bytes) -> bytes:
+    return struct.pack(">I4sQ", 1, box_type, 16 + len(payload)) + payload
+
+
+def header_box(box_type: bytes, timescale: int, duration: int, version: int = 0):
+    """mvhd or mdhd, up to their duration."""
+    if version == 1:
+        fields = struct.pack(">QQIQ", 0, 0, timescale, duration)
+    else:
+        fields = struct.pack(">IIII", 0, 0, timescale, duration)
+    return box(box_type, struct.pack(">I", version << 24) + fields)
+
+
+def trak(
+    handler: bytes, timescale: int, duration: int, edits: Optional[list] = None
+) -> bytes:
+    hdlr = box(b"hdlr", struct.pack(">II4s", 0, 0, handler) + b"\0" * 13)
+    mdia = box(b"mdia", header_box(b"mdhd", timescale, duration), hdlr)
+    if edits is None:
+        return box(b"trak", mdia)
+    elst = box(
+        b"elst",
+        struct.pack(">II", 0, len(edits)),
+        *(struct.pack(">IiI", d, t, 0x10000) for d, t in edits),
+    )
+    return box(b"trak", box(b"edts", elst), mdia)
+
+
+def write_mp4(path: Path, moov: bytes, mdat_size: int = 1000) -> Path:
+    # ffmpeg writes moov after mdat unless asked for faststart.
+    path.write_bytes(
+        box(b"ftyp", b"isom\0\0\0\0") + large_box(b"mdat", b"\0" * mdat_size) + moov
+    )
+    return path
+
+
+def test_reads_duration_of_audio_track(tmp_path: Path):
+    moov = box(
+        b"moov",
+        header_box(b"mvhd", 1000, 1_800_500),
+        trak(b"vide", 90000, 1),
+        trak(b"soun", 48000, 48000 * 1800 + 24000),
+    )
+
+    assert read_audio_duration(write_mp4(tmp_path / "a.mp4", moov)) == 1800.5
+
+
+def test_reads_64_bit_durations(tmp_path: Path):
+    mdhd = header_box(b"mdhd", 48000, 48000 * 3600, version=1)
+    hdlr = box(b"hdlr", struct.pack(">II4s", 0, 0, b"soun") + b"\0" * 13)
+    moov = box(
+        b"moov",
+        header_box(b"mvhd", 1000, 3_600_000, version=1),
+        box(b"trak", box(b"mdia", mdhd, hdlr)),
+    )
+
+    assert read_audio_duration(write_mp4(tmp_path / "a.mp4", moov)) == 3600
+
+
+def test_applies_edit_list(tmp_path: Path):
+    # An empty edit of 1 s and the media without its first 1024 samples.
+    moov = box(
+        b"moov",
+        header_box(b"mvhd", 1000, 61_000),
+        trak(b"soun", 48000, 48000 * 60 + 1024, edits=[(1000, -1), (60_000, 1024)]),
+    )
+
+    assert read_audio_duration(write_mp4(tmp_path / "a.mp4", moov)) == 60
+
+
+@pytest.mark.parametrize(
+    "content",
+    [
+        b"",
+        box(b"ftyp", b"isom") + box(b"mdat", b"\0" * 100),
+        box(b"ftyp", b"isom") + struct.pack(">I4s", 1000, b"moov") + b"\0" * 10,
+        box(b"moov", header_box(b"mvhd", 1000, 1000), trak(b"vide", 90000, 1)),
+        box(b"moov", header_box(b"mvhd", 1000, 1000), box(b"mvex")),
+        box(b"moov", header_box(b"mvhd", 1000, 1000), trak(b"soun", 0, 1)),
+        box(b"moov", struct.pack(">I4s", 4, b"mvhd")),
+    ],
+    ids=[
+        "empty",
+        "no moov",
+        "truncated moov",
+        "no audio",
+        "fragmented",
+        "no timescale",
+        "invalid box size",
+    ],
+)
+def test_raises_for_unsupported_files(tmp_path: Path, content: bytes):
+    path = tmp_path / "a.mp4"
+    path.write_bytes(content)
+
+    with pytest.raises(Mp4Error):
+        read_audio_duration(path)
+
+
+# Muxed by ffmpeg 6.0 as a recording is, from ADTS with -codec copy, and
+# encoded by ffmpeg with the priming samples of AAC cut by an edit, each of two
+# seconds of a sine. Durations are those ffprobe reports for their stream.
+@pytest.mark.parametrize(
+    ("filename", "ffprobe_duration"),
+    [("recording.mp4", 2.026667), ("encoded.m4a", 2.0)],
+)
+def test_reads_duration_of_files_muxed_by_ffmpeg(
+    filename: str, ffprobe_duration: float
+):
+    path = Path(__file__).parent / "data" / filename
+
+    assert read_audio_duration(path) == pytest.approx(ffprobe_duration, abs=1e-6)
+
+
+@pytest.mark.skipif(
+    shutil.which("ffmpeg") is None or shutil.which("ffprobe") is None,
+    reason="needs ffmpeg and ffprobe",
+)
+@pytest.mark.parametrize("filename", ["recording.mp4", "encoded.m4a"])
+def test_read_audio_duration_matches_ffprobe(filename: str):
+    path = Path(__file__).parent / "data" / filename
+
+    expected = asyncio.run(get_duration_with_ffprobe(path))
+
+    assert read_audio_duration(path) == pytest.approx(expected, abs=1e-6)
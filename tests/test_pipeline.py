@@ -0,0 +1,125 @@
+import asyncio
+import fcntl
+import os
+import sys
+
+import pytest
+
+from radiko_timeshift_recorder.pipeline import (
+    PipelineError,
+    create_pipe,
+    run_pipeline,
+)
+
+
+def python_command(code: str) -> list[str]:
+    return [sys.executable, "-c", code]
+
+
+SOURCE_CODE = "import sys; sys.stdout.buffer.write(b'x' * 1_000_000)"
+SINK_CODE = "import sys; print(f'size={len(sys.stdin.buffer.read())}')"
+
+
+@pytest.mark.skipif(
+    not hasattr(fcntl, "F_GETPIPE_SZ"), reason="pipe size is Linux-specific"
+)
+def test_create_pipe_sets_size():
+    read_fd, write_fd = create_pipe(256 * 1024)
+    try:
+        assert fcntl.fcntl(write_fd, fcntl.F_GETPIPE_SZ) == 256 * 1024
+    finally:
+        os.close(read_fd)
+        os.close(write_fd)
+
+
+@pytest.mark.asyncio
+async def test_run_pipeline_passes_data_from_source_to_sink() -> None:
+    lines: list[str] = []
+
+    source, sink = await run_pipeline(
+        ("source", python_command(SOURCE_CODE)),
+        ("sink", python_command(SINK_CODE)),
+        on_sink_stdout_line=lines.append,
+    )
+
+    assert lines == ["size=1000000"]
+    assert (source.returncode, sink.returncode) == (0, 0)
+
+
+@pytest.mark.asyncio
+async def test_run_pipeline_relays_through_throttle() -> None:
+    lines: list[str] = []
+    throttled: list[int] = []
+
+    async def throttle(size: int) -> None:
+        throttled.append(size)
+
+    await run_pipeline(
+        ("source", python_command(SOURCE_CODE)),
+        ("sink", python_command(SINK_CODE)),
+        on_sink_stdout_line=lines.append,
+        throttle=throttle,
+    )
+
+    assert lines == ["size=1000000"]
+    assert sum(throttled) == 1_000_000
+
+
+@pytest.mark.asyncio
+async def test_run_pipeline_stops_throttled_source_when_sink_fails() -> None:
+    endless_source = "import sys\nwhile True: sys.stdout.buffer.write(b'x' * 65536)"
+    failing_sink = "import sys; print('bad input', file=sys.stderr); sys.exit(1)"
+
+    async def throttle(size: int) -> None:
+        pass
+
+    with pytest.raises(PipelineError, match="sink exited with 1: bad input"):
+        await asyncio.wait_for(
+            run_pipeline(
+                ("source", python_command(endless_source)),
+                ("sink", python_command(failing_sink)),
+                throttle=throttle,
+            ),
+            timeout=10,
+        )
+
+
+@pytest.mark.asyncio
+async def test_run_pipeline_reports_failed_source() -> None:
+    failing_source = "import sys; print('no streams', file=sys.stderr); sys.exit(3)"
+
+    with pytest.raises(PipelineError, match="source exited with 3: no streams") as e:
+        await run_pipeline(
+            ("source", python_command(failing_source)),
+            ("sink", python_command(SINK_CODE)),
+        )
+
+    assert "sink" not in str(e.value)
+
+
+@pytest.mark.asyncio
+async def test_run_pipeline_reports_failed_sink() -> None:
+    failing_sink = "import sys; print('bad input', file=sys.stderr); sys.exit(1)"
+
+    with pytest.raises(PipelineError, match="sink exited with 1: bad input"):
+        await run_pipeline(
+            ("source", python_command("print('data')")),
+            ("sink", python_command(failing_sink)),
+        )
+
+
+@pytest.mark.asyncio
+async def test_run_pipeline_reports_source_exit_before_sink_finishes() -> None:
+    order: list[str] = []
+    slow_sink = (
+        "import sys, time; sys.stdin.buffer.read(); time.sleep(0.2); print('done')"
+    )
+
+    await run_pipeline(
+        ("source", python_command(SOURCE_CODE)),
+        ("sink", python_command(slow_sink)),
+        on_sink_stdout_line=order.append,
+        on_source_exit=lambda returncode: order.append(f"source={returncode}"),
+    )
+
+    assert order == ["source=0", "done"]
@@ -0,0 +1,55 @@
+import asyncio
+
+import pytest
+
+from radiko_timeshift_recorder.process_output import (
+    OutputTail,
+    pump_lines,
+    read_bounded,
+)
+
+
+def make_stream_reader(*chunks: bytes) -> asyncio.StreamReader:
+    reader = asyncio.StreamReader()
+    for chunk in chunks:
+        reader.feed_data(chunk)
+    reader.feed_eof()
+    return reader
+
+
+def test_output_tail_keeps_last_lines():
+    tail = OutputTail(max_lines=2)
+
+    for line in ["first", "", "second", "third"]:
+        tail.append(line)
+
+    assert tail.text() == "second\nthird"
+
+
+@pytest.mark.asyncio
+async def test_pump_lines_splits_on_any_line_separator() -> None:
+    lines: list[str] = []
+
+    await pump_lines(
+        make_stream_reader(b"a=1\nb=", b"2\r\nsize= 10kB\rsize= 20kB\nlast"),
+        lines.append,
+    )
+
+    assert lines == ["a=1", "b=2", "size= 10kB", "size= 20kB", "last"]
+
+
+@pytest.mark.asyncio
+async def test_pump_lines_truncates_long_lines() -> None:
+    lines: list[str] = []
+
+    await pump_lines(make_stream_reader(b"x" * 100_000 + b"\nend\n"), lines.append)
+
+    assert len(lines[0]) == 4096
+    assert lines[1] == "end"
+
+
+@pytest.mark.asyncio
+async def test_read_bounded_keeps_head():
+    data = await read_bounded(make_stream_reader(b"0123", b"4567", b"89"), 6)
+
+    assert data == b"012345"
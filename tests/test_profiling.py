@@ -0,0 +1,41 @@
+import sys
+import threading
+import time
+
+from radiko_timeshift_recorder.profiling import SamplingProfiler, collapse_stack
+
+
+def test_collapse_stack_is_root_first():
+    def inner() -> str:
+        return collapse_stack("main", sys._getframe())
+
+    stack = inner()
+
+    assert stack.startswith("main;")
+    assert stack.split(";")[-2].startswith("test_collapse_stack_is_root_first (")
+    assert stack.split(";")[-1].startswith("inner (test_profiling.py:")
+
+
+def test_sampling_profiler_samples_other_threads():
+    stop = threading.Event()
+
+    def busy_loop() -> None:
+        while not stop.is_set():
+            sum(range(1000))
+
+    thread = threading.Thread(target=busy_loop, name="busy")
+    thread.start()
+    profiler = SamplingProfiler(interval=0.001)
+    profiler.start()
+    time.sleep(0.1)
+    profiler.stop()
+    stop.set()
+    thread.join()
+
+    lines = profiler.collapsed().splitlines()
+    busy = [line for line in lines if line.startswith("busy;")]
+    assert busy
+    assert all("busy_loop (test_profiling.py:" in line for line in busy)
+    assert not any("sampling-profiler" in line for line in lines)
+    stack, count = lines[0].rsplit(" ", 1)
+    assert int(count) == max(profiler.samples.values())
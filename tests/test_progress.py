@@ -0,0 +1,51 @@
+from radiko_timeshift_recorder.progress import DownloadProgress, ProgressEventType
+
+
+def test_download_progress_update_from_ffmpeg_lines():
+    progress = DownloadProgress()
+
+    for line in [
+        "bitrate=  48.0kbits/s",
+        "total_size=1048576",
+        "out_time_us=12500000",
+        "out_time=00:00:12.500000",
+        "speed=25.5x",
+        "progress=continue",
+    ]:
+        progress.update_from_ffmpeg_line(line)
+
+    assert progress.total_size == 1048576
+    assert progress.out_time == 12.5
+    assert progress.speed == 25.5
+    assert progress.updated_at is not None
+
+
+def test_download_progress_ignores_unavailable_and_malformed_values():
+    progress = DownloadProgress()
+
+    for line in ["total_size=N/A", "out_time_us=abc", "speed=N/A", "garbage"]:
+        progress.update_from_ffmpeg_line(line)
+
+    assert progress == DownloadProgress()
+
+
+def test_download_progress_reset():
+    progress = DownloadProgress(total_size=1, out_time=2.0, speed=3.0, updated_at=4.0)
+
+    progress.reset()
+
+    assert progress == DownloadProgress()
+
+
+def test_download_progress_notifies_listeners():
+    notified: list[tuple[ProgressEventType, int]] = []
+    progress = DownloadProgress(
+        listeners=[lambda p, event_type: notified.append((event_type, p.attempt))]
+    )
+
+    progress.update_from_ffmpeg_line("total_size=1")
+    progress.update_from_ffmpeg_line("progress=continue")
+    progress.record_retry(RuntimeError("stalled"))
+
+    assert notified == [("progress", 1), ("retried", 2)]
+    assert progress.last_error == "stalled"
@@ -4,14 +4,20 @@ from pathlib import Path
 from zoneinfo import ZoneInfo
 
 import pytest
+import requests
 
 from radiko_timeshift_recorder.radiko import (
+    RADIKO_BASE_URL_ENV,
     OutOfAreaError,
     Program,
+    RadikoBaseUrlAdapter,
     Schedule,
     Station,
     fetch_area_id,
     fetch_schedule,
+    mount_radiko_base_url,
+    radiko_base_url,
+    rebase_radiko_url,
 )
 
 
@@ -127,3 +133,59 @@ def test_schedule_from_xml(schedule_xml_bytes: bytes):
 )
 def test_fetch_schedule_can_fetch_some_schedule():
     fetch_schedule(date=datetime.date.today())
+
+
+@pytest.mark.parametrize(
+    "url, expected",
+    [
+        ("https://radiko.jp/v2/api/auth1", "http://127.0.0.1:8080/v2/api/auth1"),
+        (
+            "http://radiko.jp/v3/program/station/date/20250101/TBS.xml",
+            "http://127.0.0.1:8080/v3/program/station/date/20250101/TBS.xml",
+        ),
+        (
+            "https://tf-rpaa.smartstream.ne.jp/tf/playlist.m3u8?station_id=TBS&l=15",
+            "http://127.0.0.1:8080/tf/playlist.m3u8?station_id=TBS&l=15",
+        ),
+        (
+            "https://tf-f-rpaa-radiko.smartstream.ne.jp/tf/playlist.m3u8?station_id=TBS",
+            "http://127.0.0.1:8080/tf/playlist.m3u8?station_id=TBS",
+        ),
+        ("https://example.com/segment.aac", "https://example.com/segment.aac"),
+    ],
+)
+def test_rebase_radiko_url(url: str, expected: str):
+    assert rebase_radiko_url(url, "http://127.0.0.1:8080/") == expected
+
+
+def test_radiko_base_url_defaults_to_radiko(monkeypatch: pytest.MonkeyPatch):
+    monkeypatch.delenv(RADIKO_BASE_URL_ENV, raising=False)
+
+    assert radiko_base_url() == "https://radiko.jp"
+
+
+def test_mount_radiko_base_url(monkeypatch: pytest.MonkeyPatch):
+    monkeypatch.setenv(RADIKO_BASE_URL_ENV, "http://127.0.0.1:8080/")
+    session = requests.Session()
+
+    mount_radiko_base_url(session)
+
+    adapter = session.get_adapter("https://tf-rpaa.smartstream.ne.jp/tf/playlist.m3u8")
+    assert isinstance(adapter, RadikoBaseUrlAdapter)
+    assert adapter.base_url == "http://127.0.0.1:8080"
+    assert not isinstance(
+        session.get_adapter("https://example.com/"), RadikoBaseUrlAdapter
+    )
+
+
+def test_mount_radiko_base_url_does_nothing_by_default(
+    monkeypatch: pytest.MonkeyPatch,
+):
+    monkeypatch.delenv(RADIKO_BASE_URL_ENV, raising=False)
+    session = requests.Session()
+
+    mount_radiko_base_url(session)
+
+    assert not isinstance(
+        session.get_adapter("https://radiko.jp/area"), RadikoBaseUrlAdapter
+    )
@@ -0,0 +1,76 @@
+import os
+from pathlib import Path
+
+import pytest
+
+from radiko_timeshift_recorder.segment_cache import (
+    SegmentCache,
+    segment_timestamp_from_uri,
+)
+
+
+@pytest.mark.parametrize(
+    "uri, expected",
+    [
+        pytest.param(
+            "https://example.com/segments/20250101_050005_abcd.aac",
+            "20250101050005",
+            id="underscore",
+        ),
+        pytest.param(
+            "https://example.com/TEST/20250101050005.aac?l=15",
+            "20250101050005",
+            id="plain",
+        ),
+        pytest.param(
+            "https://example.com/segment.aac?start_at=20250101050005",
+            None,
+            id="query_only",
+        ),
+        pytest.param("https://example.com/segment-1.aac", None, id="no_timestamp"),
+    ],
+)
+def test_segment_timestamp_from_uri(uri: str, expected: str | None):
+    assert segment_timestamp_from_uri(uri) == expected
+
+
+def test_segment_cache_get_returns_put_data(tmp_path: Path):
+    cache = SegmentCache(tmp_path, max_bytes=1024)
+
+    cache.put("TEST", "20250101050000", b"segment")
+
+    assert cache.get("TEST", "20250101050000") == b"segment"
+    assert cache.get("TEST", "20250101050005") is None
+    assert cache.get("OTHER", "20250101050000") is None
+
+
+def test_segment_cache_evicts_least_recently_used(tmp_path: Path):
+    cache = SegmentCache(tmp_path, max_bytes=25)
+    for i, timestamp in enumerate(["20250101050000", "20250101050005"]):
+        cache.put("TEST", timestamp, b"x" * 10)
+        path = tmp_path / "TEST" / f"{timestamp}.seg"
+        os.utime(path, (1000 + i, 1000 + i))
+
+    # A hit makes the oldest segment the most recently used one.
+    assert cache.get("TEST", "20250101050000") is not None
+    cache.put("TEST", "20250101050010", b"x" * 10)
+
+    assert cache.get("TEST", "20250101050000") is not None
+    assert cache.get("TEST", "20250101050005") is None
+    assert cache.get("TEST", "20250101050010") is not None
+
+
+def test_segment_cache_rejects_non_positive_max_bytes(tmp_path: Path):
+    with pytest.raises(ValueError, match="max_bytes must be positive"):
+        SegmentCache(tmp_path, max_bytes=0)
+
+
+def test_segment_cache_evict_returns_freed_bytes(tmp_path: Path):
+    cache = SegmentCache(tmp_path, max_bytes=1024)
+    for timestamp in ["20250101050000", "20250101050005", "20250101050010"]:
+        cache.put("TEST", timestamp, b"x" * 10)
+
+    cache.max_bytes = 15
+
+    assert cache.evict() == 20
+    assert len(list((tmp_path / "TEST").glob("*.seg"))) == 1
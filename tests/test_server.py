@@ -1,24 +1,55 @@
 import asyncio
+import datetime
+import json
+import sqlite3
+import threading
+from pathlib import Path
 from typing import Any, Generator
+from zoneinfo import ZoneInfo
 
 import pytest
 from fastapi import FastAPI
 from fastapi.encoders import jsonable_encoder
 from fastapi.testclient import TestClient
+from pytest_mock import MockerFixture
 
+from radiko_timeshift_recorder import metrics, tracing
+from radiko_timeshift_recorder.admission import DiskSpaceAdmission
+from radiko_timeshift_recorder.bandwidth import BandwidthShaper
+from radiko_timeshift_recorder.checkpoint import load_checkpoint
+from radiko_timeshift_recorder.events import EventBus
 from radiko_timeshift_recorder.job import Job
-from radiko_timeshift_recorder.job_queue import JobQueue
-from radiko_timeshift_recorder.server import app, get_job_queue, lifespan
+from radiko_timeshift_recorder.job_queue import JobQueue, Priority
+from radiko_timeshift_recorder.job_store import SqliteJobQueue
+from radiko_timeshift_recorder.library import LibraryEntry, LibraryIndex
+from radiko_timeshift_recorder.progress import DownloadProgress, RunningJob
+from radiko_timeshift_recorder.server import (
+    app,
+    get_event_bus,
+    get_job_queue,
+    get_profiler_lock,
+    get_running_jobs,
+    lifespan,
+    worker,
+)
 
 
 @pytest.fixture
-def test_client_with_override() -> Generator[tuple[TestClient, JobQueue], Any, None]:
+def test_running_jobs() -> dict[Job, RunningJob]:
+    return {}
+
+
+@pytest.fixture
+def test_client_with_override(
+    test_running_jobs: dict[Job, RunningJob],
+) -> Generator[tuple[TestClient, JobQueue], Any, None]:
     test_queue: JobQueue[Job] = JobQueue()
 
     def override_get_job_queue() -> JobQueue[Job]:
         return test_queue
 
     app.dependency_overrides[get_job_queue] = override_get_job_queue
+    app.dependency_overrides[get_running_jobs] = lambda: test_running_jobs
     client = TestClient(app)
 
     yield client, test_queue
@@ -26,6 +57,20 @@ def test_client_with_override() -> Generator[tuple[TestClient, JobQueue], Any, N
     app.dependency_overrides.clear()
 
 
+@pytest.fixture
+def app_with_workers() -> Generator[FastAPI, Any, None]:
+    """The server app with its own job queue, for tests that run its lifespan."""
+    job_queue: JobQueue[Job] = JobQueue()
+    app.dependency_overrides[get_job_queue] = lambda: job_queue
+    state = dict(app.state._state)
+
+    yield app
+
+    app.state._state.clear()
+    app.state._state.update(state)
+    app.dependency_overrides.clear()
+
+
 def test_put_job_success(
     test_client_with_override: tuple[TestClient, JobQueue], sample_job: Job
 ):
@@ -50,6 +95,67 @@ def test_put_job_conflict(
     assert test_queue.qsize() == 1
 
 
+def test_put_job_rejects_when_queue_is_full(
+    test_client_with_override: tuple[TestClient, JobQueue], sample_job: Job
+):
+    client, test_queue = test_client_with_override
+    asyncio.run(test_queue.put(sample_job))
+    other_job = sample_job.model_copy(update={"station_id": "OTHER"})
+    app.state.max_queue_size = 1
+    try:
+        rejected = client.post("/job_queue", json=jsonable_encoder(other_job))
+        duplicate = client.post("/job_queue", json=jsonable_encoder(sample_job))
+    finally:
+        app.state.max_queue_size = None
+
+    assert rejected.status_code == 429
+    assert int(rejected.headers["Retry-After"]) > 0
+    assert duplicate.status_code == 409
+    assert test_queue.qsize() == 1
+
+
+def test_put_interactive_job_to_full_queue(
+    test_client_with_override: tuple[TestClient, JobQueue], sample_job: Job
+):
+    client, test_queue = test_client_with_override
+    asyncio.run(test_queue.put(sample_job))
+    other_job = sample_job.model_copy(update={"station_id": "OTHER"})
+    app.state.max_queue_size = 1
+    try:
+        response = client.post(
+            "/job_queue",
+            params={"priority": "interactive"},
+            json=jsonable_encoder(other_job),
+        )
+    finally:
+        app.state.max_queue_size = None
+
+    assert response.status_code == 201
+    assert test_queue.priorities[other_job] == Priority.INTERACTIVE
+    status = client.get("/job_queue").json()
+    assert [(s["key"], s["priority"]) for s in status["pending"]] == [
+        (other_job.key, "interactive"),
+        (sample_job.key, "rules"),
+    ]
+
+
+def test_put_job_moves_pending_job_to_interactive_lane(
+    test_client_with_override: tuple[TestClient, JobQueue], sample_job: Job
+):
+    client, test_queue = test_client_with_override
+    asyncio.run(test_queue.put(sample_job, Priority.BACKFILL))
+
+    response = client.post(
+        "/job_queue",
+        params={"priority": "interactive"},
+        json=jsonable_encoder(sample_job),
+    )
+
+    assert response.status_code == 200
+    assert test_queue.priorities[sample_job] == Priority.INTERACTIVE
+    assert test_queue.qsize() == 1
+
+
 def test_put_job_validation_error(
     test_client_with_override: tuple[TestClient, JobQueue],
 ):
@@ -61,10 +167,135 @@ def test_put_job_validation_error(
     assert response.status_code == 422
 
 
+def test_get_job_queue_status(
+    test_client_with_override: tuple[TestClient, JobQueue],
+    test_running_jobs: dict[Job, RunningJob],
+    sample_job: Job,
+):
+    client, test_queue = test_client_with_override
+    later_job = sample_job.model_copy(
+        update={
+            "program": sample_job.program.model_copy(
+                update={"to": sample_job.program.to + datetime.timedelta(hours=1)}
+            )
+        }
+    )
+    running_job = sample_job.model_copy(update={"station_id": "RUNNING"})
+    asyncio.run(test_queue.put(running_job))
+    assert asyncio.run(test_queue.get()) == running_job
+    for job in [later_job, sample_job]:
+        asyncio.run(test_queue.put(job))
+    test_running_jobs[running_job] = RunningJob(
+        worker_id=2,
+        started_at=datetime.datetime.now(ZoneInfo("Asia/Tokyo")),
+        progress=DownloadProgress(total_size=4096, out_time=300.0, speed=20.0),
+    )
+
+    response = client.get("/job_queue")
+
+    assert response.status_code == 200
+    body = response.json()
+    assert [s["key"] for s in body["pending"]] == [sample_job.key, later_job.key]
+    assert all(s["state"] == "pending" for s in body["pending"])
+    [in_progress] = body["in_progress"]
+    assert in_progress["key"] == running_job.key
+    assert in_progress["progress"]["worker_id"] == 2
+    assert in_progress["progress"]["bytes_written"] == 4096
+    assert in_progress["progress"]["duration"] == 900
+    assert in_progress["progress"]["eta_seconds"] == 30.0
+
+
+def test_get_job_status(
+    test_client_with_override: tuple[TestClient, JobQueue], sample_job: Job
+):
+    client, test_queue = test_client_with_override
+    asyncio.run(test_queue.put(sample_job))
+
+    response = client.get(f"/job_queue/{sample_job.key}")
+
+    assert response.status_code == 200
+    assert response.json()["state"] == "pending"
+    assert response.json()["job"] == jsonable_encoder(sample_job)
+
+
+def test_get_job_status_not_found(
+    test_client_with_override: tuple[TestClient, JobQueue],
+):
+    client, _ = test_client_with_override
+
+    response = client.get("/job_queue/TEST_20250101050000")
+
+    assert response.status_code == 404
+
+
+def test_get_events_replays_from_last_event_id(sample_job: Job):
+    events = EventBus()
+    first = events.publish("enqueued", sample_job)
+    events.publish("started", sample_job, worker_id=0)
+    events.close()
+    app.dependency_overrides[get_event_bus] = lambda: events
+    try:
+        with TestClient(app).stream(
+            "GET", "/events", headers={"Last-Event-ID": str(first.id)}
+        ) as response:
+            body = response.read().decode()
+    finally:
+        app.dependency_overrides.clear()
+
+    assert response.headers["content-type"].startswith("text/event-stream")
+    assert body.startswith(f"id: {first.id + 1}\nevent: started\n")
+    assert "event: enqueued" not in body
+
+
+def test_put_job_publishes_enqueued_event(
+    test_client_with_override: tuple[TestClient, JobQueue], sample_job: Job
+):
+    client, _ = test_client_with_override
+    events = EventBus()
+    app.dependency_overrides[get_event_bus] = lambda: events
+
+    client.post("/job_queue", json=jsonable_encoder(sample_job))
+
+    [event] = events.history
+    assert event.type == "enqueued"
+    assert event.job_key == sample_job.key
+
+
+def test_get_metrics(
+    test_client_with_override: tuple[TestClient, JobQueue], sample_job: Job
+):
+    client, test_queue = test_client_with_override
+    asyncio.run(test_queue.put(sample_job))
+
+    response = client.get("/metrics")
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    assert "radiko_job_queue_size 1.0" in response.text
+    assert "radiko_jobs_pending 1.0" in response.text
+    assert "radiko_jobs_in_progress 0.0" in response.text
+    assert "radiko_job_queue_wait_seconds_bucket" in response.text
+
+
+def test_get_metrics_counts_only_busy_workers_of_this_node(
+    test_client_with_override: tuple[TestClient, JobQueue], sample_job: Job
+):
+    client, test_queue = test_client_with_override
+    asyncio.run(test_queue.put(sample_job))
+    # Taken by a worker of another node sharing the job store.
+    asyncio.run(test_queue.get())
+
+    response = client.get("/metrics")
+
+    assert "radiko_jobs_in_progress 1.0" in response.text
+    assert "radiko_workers_busy 0.0" in response.text
+    assert "radiko_worker_busy_ratio 0.0" in response.text
+
+
 @pytest.mark.asyncio
 async def test_lifespan_starts_and_cancels_workers():
     @pytest.mark.asyncio
-    async def mock_process_job(program):
+    async def mock_process_job(job, progress):
         await asyncio.sleep(0.1)
 
     app = FastAPI(lifespan=lifespan)
@@ -72,8 +303,8 @@ async def test_lifespan_starts_and_cancels_workers():
     app.state.process_job = mock_process_job
 
     with TestClient(app):
-        assert len(app.state.worker_tasks) == app.state.num_workers
-        initial_tasks = list(app.state.worker_tasks)
+        assert len(app.state.worker_pool) == app.state.num_workers
+        initial_tasks = list(app.state.worker_pool.tasks.values())
 
     for task in initial_tasks:
         assert task.cancelled()
@@ -81,3 +312,458 @@ async def test_lifespan_starts_and_cancels_workers():
     await asyncio.gather(*initial_tasks, return_exceptions=True)
     for task in initial_tasks:
         assert task.done()
+
+
+def test_lifespan_shares_jobs_through_job_store(sample_job: Job, tmp_path: Path):
+    processed: list[Job] = []
+    started = threading.Event()
+
+    async def mock_process_job(job: Job, progress: DownloadProgress) -> None:
+        processed.append(job)
+        started.set()
+        await asyncio.sleep(60)
+
+    job_store = SqliteJobQueue(tmp_path / "jobs.db", node_id="a", poll_interval=0.01)
+    other_node = SqliteJobQueue(tmp_path / "jobs.db", node_id="b")
+    app = FastAPI(lifespan=lifespan)
+    app.state.num_workers = 1
+    app.state.process_job = mock_process_job
+    app.dependency_overrides[get_job_queue] = lambda: job_store
+
+    with TestClient(app):
+        asyncio.run(other_node.put(sample_job))
+        assert started.wait(timeout=5)
+        asyncio.run(other_node.refresh())
+        assert other_node.in_progress == {sample_job}
+
+    # The unfinished job was released on shutdown for other nodes to take.
+    assert processed == [sample_job]
+    asyncio.run(other_node.refresh())
+    assert other_node.pending == {sample_job}
+
+
+@pytest.mark.asyncio
+async def test_worker_tracks_progress_while_processing(sample_job: Job):
+    job_queue: JobQueue[Job] = JobQueue()
+    running_jobs: dict[Job, RunningJob] = {}
+    events = EventBus()
+    seen: list[RunningJob] = []
+    processed = asyncio.Event()
+
+    async def mock_process_job(job: Job, progress: DownloadProgress) -> None:
+        assert running_jobs[job].progress is progress
+        seen.append(running_jobs[job])
+        processed.set()
+
+    await job_queue.put(sample_job)
+    task = asyncio.create_task(
+        worker(
+            id=0,
+            job_queue=job_queue,
+            process_job=mock_process_job,
+            running_jobs=running_jobs,
+            events=events,
+        )
+    )
+    await asyncio.wait_for(processed.wait(), timeout=1)
+    await asyncio.sleep(0)
+    task.cancel()
+    await asyncio.gather(task, return_exceptions=True)
+
+    assert len(seen) == 1
+    assert seen[0].worker_id == 0
+    assert running_jobs == {}
+    assert [e.type for e in events.history] == ["started", "completed"]
+    assert not job_queue.in_progress
+
+
+@pytest.mark.asyncio
+async def test_worker_takes_job_missing_from_stale_job_store_view(
+    sample_job: Job, tmp_path: Path, mocker: MockerFixture
+):
+    job_store = SqliteJobQueue(tmp_path / "jobs.db", node_id="a", poll_interval=0.01)
+    other_node = SqliteJobQueue(tmp_path / "jobs.db", node_id="b")
+    processed = asyncio.Event()
+
+    async def mock_process_job(job: Job, progress: DownloadProgress) -> None:
+        processed.set()
+
+    # The view of the queue cannot be refreshed while another node writes.
+    mocker.patch.object(
+        job_store,
+        "_refresh",
+        side_effect=sqlite3.OperationalError("database is locked"),
+    )
+    await other_node.put(sample_job)
+    task = asyncio.create_task(
+        worker(
+            id=0,
+            job_queue=job_store,
+            process_job=mock_process_job,
+            running_jobs={},
+            events=EventBus(),
+        )
+    )
+    try:
+        await asyncio.wait_for(processed.wait(), timeout=5)
+        await asyncio.sleep(0.1)
+        assert not task.done()
+        await other_node.refresh()
+        assert other_node.pending == other_node.in_progress == set()
+    finally:
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        job_store.close()
+        other_node.close()
+
+
+@pytest.mark.asyncio
+async def test_worker_counts_failures_by_cause(sample_job: Job):
+    job_queue: JobQueue[Job] = JobQueue()
+    processed = asyncio.Event()
+
+    def count_failures() -> float:
+        return (
+            metrics.REGISTRY.get_sample_value(
+                "radiko_job_failures_total", {"cause": "ValueError"}
+            )
+            or 0
+        )
+
+    failures_before = count_failures()
+
+    async def failing_process_job(job: Job, progress: DownloadProgress) -> None:
+        processed.set()
+        raise ValueError("boom")
+
+    await job_queue.put(sample_job)
+    task = asyncio.create_task(
+        worker(
+            id=0,
+            job_queue=job_queue,
+            process_job=failing_process_job,
+            running_jobs={},
+            events=EventBus(),
+        )
+    )
+    await asyncio.wait_for(processed.wait(), timeout=1)
+    await asyncio.sleep(0)
+    task.cancel()
+    await asyncio.gather(task, return_exceptions=True)
+
+    assert count_failures() == failures_before + 1
+    assert not job_queue.in_progress
+
+
+@pytest.mark.asyncio
+async def test_worker_traces_job_from_enqueue(sample_job: Job, tmp_path: Path):
+    job_queue: JobQueue[Job] = JobQueue()
+    processed = asyncio.Event()
+
+    async def traced_process_job(job: Job, progress: DownloadProgress) -> None:
+        with tracing.span("download"):
+            processed.set()
+
+    trace_file = tmp_path / "trace.jsonl"
+    tracing.configure(trace_file)
+    try:
+        await job_queue.put(sample_job)
+        task = asyncio.create_task(
+            worker(
+                id=0,
+                job_queue=job_queue,
+                process_job=traced_process_job,
+                running_jobs={},
+                events=EventBus(),
+            )
+        )
+        await asyncio.wait_for(processed.wait(), timeout=1)
+        await asyncio.sleep(0)
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+    finally:
+        tracing.shutdown()
+
+    spans = {
+        span["name"]: span
+        for line in trace_file.read_text().splitlines()
+        for span in json.loads(line)["resourceSpans"][0]["scopeSpans"][0]["spans"]
+    }
+    assert spans.keys() == {"job", "queue_wait", "download"}
+    assert spans["queue_wait"]["parentSpanId"] == spans["job"]["spanId"]
+    assert spans["download"]["parentSpanId"] == spans["job"]["spanId"]
+    assert spans["queue_wait"]["startTimeUnixNano"] == spans["job"]["startTimeUnixNano"]
+
+
+def test_profile_returns_collapsed_stacks():
+    response = TestClient(app).post("/admin/profile", params={"seconds": 0.05})
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    stack, count = response.text.splitlines()[0].rsplit(" ", 1)
+    assert ";" in stack
+    assert int(count) > 0
+
+
+@pytest.mark.asyncio
+async def test_profile_rejects_concurrent_profiles():
+    lock = asyncio.Lock()
+    await lock.acquire()
+    app.dependency_overrides[get_profiler_lock] = lambda: lock
+    try:
+        response = TestClient(app).post("/admin/profile", params={"seconds": 0.05})
+    finally:
+        app.dependency_overrides.clear()
+
+    assert response.status_code == 409
+
+
+def test_library_not_enabled():
+    app.state.library = None
+    client = TestClient(app)
+
+    assert client.get("/library").status_code == 404
+    assert client.post("/library/rebuild").status_code == 404
+
+
+def test_get_library_and_rebuild(tmp_path: Path, sample_job: Job):
+    library = LibraryIndex.open(tmp_path / "library.jsonl", tmp_path / "out")
+    library.add(sample_job, tmp_path / "out" / "a.mp4")
+    app.state.library = library
+    try:
+        client = TestClient(app)
+        response = client.get("/library")
+        assert response.status_code == 200
+        assert [LibraryEntry.model_validate(e).key for e in response.json()] == [
+            sample_job.key
+        ]
+
+        response = client.post("/library/rebuild")
+        assert response.status_code == 200
+        assert response.json() == {"entries": 0}
+        assert not library.contains(sample_job)
+    finally:
+        app.state.library = None
+
+
+@pytest.mark.asyncio
+async def test_worker_leaves_jobs_queued_until_there_is_disk_space(
+    sample_job: Job, tmp_path: Path, mocker: MockerFixture
+):
+    job_queue: JobQueue[Job] = JobQueue()
+    processed = asyncio.Event()
+    reserved: list[int] = []
+    free = {"bytes": 0}
+
+    admission = DiskSpaceAdmission(
+        [tmp_path], min_free_bytes=1_000_000, byte_rate=10, poll_interval=0.01
+    )
+    mocker.patch.object(
+        admission,
+        "available_bytes",
+        side_effect=lambda: free["bytes"] - sum(admission.reserved.values()),
+    )
+    expected_reservation = admission.estimate_bytes(sample_job)
+
+    async def mock_process_job(job: Job, progress: DownloadProgress) -> None:
+        reserved.append(admission.reserved[job])
+        progress.total_size = job.program.dur * 5
+        progress.file_size = job.program.dur * 20
+        processed.set()
+
+    await job_queue.put(sample_job)
+    task = asyncio.create_task(
+        worker(
+            id=0,
+            job_queue=job_queue,
+            process_job=mock_process_job,
+            running_jobs={},
+            events=EventBus(),
+            admission=admission,
+        )
+    )
+    await asyncio.sleep(0.05)
+    assert job_queue.pending == {sample_job}
+
+    # Enough for no job, but not for this one: it is taken and given back.
+    free["bytes"] = 1_000_000 + expected_reservation - 1
+    requeue = mocker.spy(job_queue, "requeue")
+    await asyncio.sleep(0.05)
+    assert requeue.call_count == 1
+    assert job_queue.pending == {sample_job}
+    assert job_queue.in_progress == set()
+    assert admission.reserved == {}
+
+    free["bytes"] = 1_000_000 + expected_reservation
+    await asyncio.wait_for(processed.wait(), timeout=1)
+    await asyncio.sleep(0)
+    task.cancel()
+    await asyncio.gather(task, return_exceptions=True)
+
+    assert reserved == [expected_reservation]
+    assert admission.reserved == {}
+    assert admission.byte_rate > 10
+
+
+def test_admin_workers_changes_pool_bounds(app_with_workers: FastAPI):
+    async def mock_process_job(job: Job, progress: DownloadProgress) -> None:
+        pass
+
+    app_with_workers.state.num_workers = 1
+    app_with_workers.state.process_job = mock_process_job
+
+    with TestClient(app_with_workers) as client:
+        response = client.get("/admin/workers")
+        assert response.status_code == 200
+        assert response.json()["workers"] == 1
+
+        response = client.put(
+            "/admin/workers", json={"min_workers": 3, "max_workers": 5}
+        )
+        assert response.status_code == 200
+        assert response.json()["min_workers"] == 3
+        assert response.json()["workers"] == 3
+
+        response = client.put(
+            "/admin/workers", json={"min_workers": 4, "max_workers": 2}
+        )
+        assert response.status_code == 422
+
+
+def test_admin_workers_without_workers():
+    app.state.worker_pool = None
+    assert TestClient(app).get("/admin/workers").status_code == 503
+
+
+def test_admin_bandwidth_reports_limits():
+    app.state.bandwidth_shaper = BandwidthShaper(limit=1000, job_limit=500)
+    try:
+        response = TestClient(app).get("/admin/bandwidth")
+    finally:
+        app.state.bandwidth_shaper = None
+
+    assert response.status_code == 200
+    assert response.json() == {
+        "limit": 1000,
+        "job_limit": 500,
+        "bytes_per_second": 0.0,
+        "streams": 0,
+    }
+
+
+def test_admin_bandwidth_without_shaping():
+    app.state.bandwidth_shaper = None
+    assert TestClient(app).get("/admin/bandwidth").status_code == 404
+
+
+def test_lifespan_drains_running_jobs(app_with_workers: FastAPI, sample_job: Job):
+    finished: list[Job] = []
+    started = threading.Event()
+
+    async def mock_process_job(job: Job, progress: DownloadProgress) -> None:
+        started.set()
+        await asyncio.sleep(0.1)
+        finished.append(job)
+
+    app_with_workers.state.num_workers = 1
+    app_with_workers.state.process_job = mock_process_job
+    app_with_workers.state.drain_timeout = 5.0
+
+    with TestClient(app_with_workers) as client:
+        client.post("/job_queue", json=jsonable_encoder(sample_job))
+        assert started.wait(timeout=5)
+
+    assert finished == [sample_job]
+    assert app_with_workers.state.draining
+
+
+def test_lifespan_checkpoints_unfinished_jobs(
+    app_with_workers: FastAPI, sample_job: Job, tmp_path: Path
+):
+    later_job = sample_job.model_copy(
+        update={
+            "program": sample_job.program.model_copy(
+                update={"to": sample_job.program.to + datetime.timedelta(hours=1)}
+            )
+        }
+    )
+    started = threading.Event()
+    processed: list[Job] = []
+
+    async def mock_process_job(job: Job, progress: DownloadProgress) -> None:
+        processed.append(job)
+        started.set()
+        await asyncio.sleep(60)
+
+    app_with_workers.state.num_workers = 1
+    app_with_workers.state.process_job = mock_process_job
+    app_with_workers.state.checkpoint_path = tmp_path / "checkpoint.jsonl"
+
+    with TestClient(app_with_workers) as client:
+        client.post("/job_queue", json=jsonable_encoder(sample_job))
+        assert started.wait(timeout=5)
+        client.post("/job_queue", json=jsonable_encoder(later_job))
+
+    assert (tmp_path / "checkpoint.jsonl").exists()
+
+    # Restart with an empty queue.
+    job_queue: JobQueue[Job] = JobQueue()
+    app_with_workers.dependency_overrides[get_job_queue] = lambda: job_queue
+    started.clear()
+    with TestClient(app_with_workers) as client:
+        assert started.wait(timeout=5)
+        assert not (tmp_path / "checkpoint.jsonl").exists()
+        response = client.get("/job_queue")
+
+    assert processed == [sample_job, sample_job]
+    assert [s["key"] for s in response.json()["pending"]] == [later_job.key]
+
+
+def test_lifespan_checkpoints_before_draining(
+    app_with_workers: FastAPI, sample_job: Job, tmp_path: Path
+):
+    later_job = sample_job.model_copy(
+        update={
+            "program": sample_job.program.model_copy(
+                update={"to": sample_job.program.to + datetime.timedelta(hours=1)}
+            )
+        }
+    )
+    checkpoint_path = tmp_path / "checkpoint.jsonl"
+    started = threading.Event()
+    checkpointed_while_draining: list[list[Job]] = []
+
+    async def mock_process_job(job: Job, progress: DownloadProgress) -> None:
+        started.set()
+        while not checkpoint_path.exists():
+            await asyncio.sleep(0.01)
+        checkpointed_while_draining.append(load_checkpoint(checkpoint_path))
+
+    app_with_workers.state.num_workers = 1
+    app_with_workers.state.process_job = mock_process_job
+    app_with_workers.state.drain_timeout = 5.0
+    app_with_workers.state.checkpoint_path = checkpoint_path
+
+    with TestClient(app_with_workers) as client:
+        client.post("/job_queue", json=jsonable_encoder(sample_job))
+        assert started.wait(timeout=5)
+        client.post("/job_queue", json=jsonable_encoder(later_job))
+
+    # Written as soon as the drain started, then without the finished job.
+    assert checkpointed_while_draining == [[sample_job, later_job]]
+    assert load_checkpoint(checkpoint_path) == [later_job]
+
+
+def test_put_job_rejected_while_draining(
+    test_client_with_override: tuple[TestClient, JobQueue], sample_job: Job
+):
+    client, test_queue = test_client_with_override
+    app.state.draining = True
+    try:
+        response = client.post("/job_queue", json=jsonable_encoder(sample_job))
+    finally:
+        app.state.draining = False
+
+    assert response.status_code == 503
+    assert "Retry-After" in response.headers
+    assert test_queue.qsize() == 0
@@ -0,0 +1,36 @@
+import datetime
+from zoneinfo import ZoneInfo
+
+import pytest
+
+from radiko_timeshift_recorder.progress import DownloadProgress, RunningJob
+from radiko_timeshift_recorder.status import estimate_eta_seconds
+
+NOW = datetime.datetime(2025, 1, 2, 12, 0, tzinfo=ZoneInfo("Asia/Tokyo"))
+
+
+@pytest.mark.parametrize(
+    "progress, started_seconds_ago, expected",
+    [
+        pytest.param(
+            DownloadProgress(out_time=600.0, speed=10.0), 60, 30.0, id="reported_speed"
+        ),
+        pytest.param(
+            DownloadProgress(out_time=300.0), 30, 60.0, id="average_speed_fallback"
+        ),
+        pytest.param(DownloadProgress(), 30, None, id="no_progress_yet"),
+        pytest.param(
+            DownloadProgress(out_time=950.0, speed=10.0), 60, 0.0, id="past_duration"
+        ),
+    ],
+)
+def test_estimate_eta_seconds(
+    progress: DownloadProgress, started_seconds_ago: int, expected: float | None
+):
+    running_job = RunningJob(
+        worker_id=0,
+        started_at=NOW - datetime.timedelta(seconds=started_seconds_ago),
+        progress=progress,
+    )
+
+    assert estimate_eta_seconds(running_job, 900, NOW) == expected
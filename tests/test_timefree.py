@@ -0,0 +1,39 @@
+from urllib.parse import parse_qs, urlsplit
+
+from pytest_mock import MockerFixture
+from streamlink import Streamlink
+from streamlink.plugins.radiko import Radiko
+
+from radiko_timeshift_recorder.timefree import SeekingRadiko, seek_timefree_url
+
+PLAYLIST_URL = (
+    "https://tf-f-rpaa-radiko.smartstream.ne.jp/tf/playlist.m3u8?station_id=TBS"
+    "&start_at=20250101050000&ft=20250101050000"
+    "&end_at=20250101051500&to=20250101051500&l=15&lsid=abc&type=b"
+)
+
+
+def test_seek_timefree_url_starts_partway_through_program():
+    url = seek_timefree_url(PLAYLIST_URL, 880)
+
+    params = parse_qs(urlsplit(url).query)
+    assert params["seek"] == ["20250101051440"]
+    # The program itself is still asked for as a whole.
+    assert params["ft"] == params["start_at"] == ["20250101050000"]
+    assert params["to"] == params["end_at"] == ["20250101051500"]
+    assert url.startswith("https://tf-f-rpaa-radiko.smartstream.ne.jp/tf/")
+
+
+def test_seeking_radiko_asks_for_the_tail(mocker: MockerFixture):
+    timefree = mocker.patch.object(
+        Radiko, "_timefree", return_value=(PLAYLIST_URL, "token")
+    )
+    plugin = SeekingRadiko(
+        Streamlink(), "https://radiko.jp/#!/ts/TBS/20250101050000", 600
+    )
+
+    url, token = plugin._timefree("TBS", "20250101050000")
+
+    timefree.assert_called_once_with("TBS", "20250101050000")
+    assert parse_qs(urlsplit(url).query)["seek"] == ["20250101051000"]
+    assert token == "token"
@@ -0,0 +1,95 @@
+import asyncio
+import json
+from pathlib import Path
+from typing import Any, Iterator
+
+import pytest
+
+from radiko_timeshift_recorder import tracing
+
+
+@pytest.fixture()
+def trace_file(tmp_path: Path) -> Iterator[Path]:
+    path = tmp_path / "trace.jsonl"
+    tracing.configure(path)
+    yield path
+    tracing.shutdown()
+
+
+def read_spans(path: Path) -> list[dict[str, Any]]:
+    spans = []
+    for line in path.read_text().splitlines():
+        [resource_spans] = json.loads(line)["resourceSpans"]
+        [scope_spans] = resource_spans["scopeSpans"]
+        spans.extend(scope_spans["spans"])
+    return spans
+
+
+def attributes(span: dict[str, Any]) -> dict[str, Any]:
+    return {a["key"]: a["value"] for a in span["attributes"]}
+
+
+def test_span_is_noop_when_not_configured(tmp_path: Path):
+    with tracing.span("stage", key="value") as span:
+        span.set_attribute("other", 1)
+        span.add_event("event")
+
+    assert span is tracing.span("another")
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_span_exports_otlp_json(trace_file: Path):
+    with tracing.span("parent", job_key="TEST_20250101050000") as parent:
+        with tracing.span("child") as child:
+            child.add_event("first_output")
+            child.set_attribute("bytes_written", 2048)
+
+    child_span, parent_span = read_spans(trace_file)
+    assert child_span["name"] == "child"
+    assert child_span["traceId"] == parent_span["traceId"] == parent.trace_id
+    assert child_span["parentSpanId"] == parent_span["spanId"]
+    assert "parentSpanId" not in parent_span
+    assert int(child_span["startTimeUnixNano"]) <= int(child_span["endTimeUnixNano"])
+    assert attributes(child_span) == {"bytes_written": {"intValue": "2048"}}
+    assert attributes(parent_span) == {
+        "job_key": {"stringValue": "TEST_20250101050000"}
+    }
+    assert [e["name"] for e in child_span["events"]] == ["first_output"]
+    assert parent_span["status"] == {"code": 0}
+
+
+def test_span_records_exception(trace_file: Path):
+    with pytest.raises(ValueError):
+        with tracing.span("failing"):
+            raise ValueError("broken")
+
+    [span] = read_spans(trace_file)
+    assert span["status"] == {"code": 2, "message": "broken"}
+    [event] = span["events"]
+    assert event["name"] == "exception"
+    assert attributes(event)["exception.type"] == {"stringValue": "ValueError"}
+
+
+def test_record_span_is_backdated_child(trace_file: Path):
+    with tracing.span("job", start_time_ns=1_000) as job:
+        tracing.record_span("queue_wait", start_time_ns=1_000)
+
+    queue_wait, job_span = read_spans(trace_file)
+    assert queue_wait["parentSpanId"] == job.span_id
+    assert queue_wait["startTimeUnixNano"] == job_span["startTimeUnixNano"] == "1000"
+
+
+@pytest.mark.asyncio
+async def test_concurrent_tasks_have_separate_traces(trace_file: Path):
+    async def job(name: str) -> None:
+        with tracing.span(name):
+            await asyncio.sleep(0)
+            with tracing.span(f"{name}.child"):
+                await asyncio.sleep(0)
+
+    await asyncio.gather(job("a"), job("b"))
+
+    spans = {span["name"]: span for span in read_spans(trace_file)}
+    assert spans["a.child"]["parentSpanId"] == spans["a"]["spanId"]
+    assert spans["b.child"]["parentSpanId"] == spans["b"]["spanId"]
+    assert spans["a"]["traceId"] != spans["b"]["traceId"]
@@ -0,0 +1,157 @@
+import asyncio
+import time
+
+import pytest
+
+from radiko_timeshift_recorder.upstream import (
+    MIN_RATE_FRACTION,
+    TokenBucket,
+    UpstreamLimiter,
+    is_upstream_error,
+)
+
+
+def test_token_bucket_allows_bursts_then_waits():
+    bucket = TokenBucket(max_rate=20, burst=2)
+
+    start = time.monotonic()
+    for _ in range(3):
+        bucket.acquire_blocking()
+
+    assert time.monotonic() - start >= 0.04
+
+
+@pytest.mark.asyncio
+async def test_token_bucket_acquire():
+    bucket = TokenBucket(max_rate=20, burst=1)
+
+    start = time.monotonic()
+    await bucket.acquire()
+    await bucket.acquire()
+
+    assert time.monotonic() - start >= 0.04
+
+
+def test_token_bucket_takes_more_than_burst_in_debt():
+    bucket = TokenBucket(max_rate=100, burst=5)
+
+    start = time.monotonic()
+    bucket.acquire_blocking(10)
+    assert time.monotonic() - start < 0.04
+    # The 5 tokens taken beyond the burst are paid back first.
+    bucket.acquire_blocking(1)
+
+    assert time.monotonic() - start >= 0.05
+
+
+def test_token_bucket_backs_off_and_recovers():
+    bucket = TokenBucket(max_rate=10)
+
+    for _ in range(20):
+        bucket.slow_down()
+    assert bucket.rate == 10 * MIN_RATE_FRACTION
+
+    for _ in range(20):
+        bucket.speed_up()
+    assert bucket.rate == 10
+
+
+async def _start(limiter: UpstreamLimiter, station_id: str) -> asyncio.Event:
+    """Hold a stream until the returned event is set."""
+    started = asyncio.Event()
+    done = asyncio.Event()
+
+    async def hold() -> None:
+        async with limiter.stream(station_id):
+            started.set()
+            await done.wait()
+
+    task = asyncio.create_task(hold())
+    try:
+        await asyncio.wait_for(started.wait(), timeout=0.05)
+    except TimeoutError:
+        task.cancel()
+        raise
+    return done
+
+
+async def _starts_soon(limiter: UpstreamLimiter, station_id: str) -> bool:
+    try:
+        done = await _start(limiter, station_id)
+    except TimeoutError:
+        return False
+    done.set()
+    return True
+
+
+@pytest.mark.asyncio
+async def test_limiter_caps_streams_in_total_and_per_station():
+    limiter = UpstreamLimiter(max_streams=2, max_streams_per_station=1)
+
+    tbs = await _start(limiter, "TBS")
+    assert not await _starts_soon(limiter, "TBS")
+
+    qrr = await _start(limiter, "QRR")
+    assert not await _starts_soon(limiter, "LFR")
+
+    tbs.set()
+    assert await _starts_soon(limiter, "LFR")
+    qrr.set()
+
+
+@pytest.mark.asyncio
+async def test_limiter_backs_off_after_failures():
+    limiter = UpstreamLimiter(max_streams=4, stream_starts=TokenBucket(max_rate=100))
+
+    await limiter.record_failure()
+    assert limiter.stream_limit == 2
+    assert limiter.stream_starts is not None
+    assert limiter.stream_starts.rate == 50
+
+    held = [await _start(limiter, "TBS"), await _start(limiter, "TBS")]
+    assert not await _starts_soon(limiter, "TBS")
+
+    await limiter.record_success()
+    assert limiter.stream_limit == 3
+    assert await _starts_soon(limiter, "TBS")
+    for done in held:
+        done.set()
+
+
+@pytest.mark.asyncio
+async def test_limiter_max_streams_can_be_raised():
+    limiter = UpstreamLimiter(max_streams=1)
+
+    held = await _start(limiter, "TBS")
+    assert not await _starts_soon(limiter, "QRR")
+
+    await limiter.set_max_streams(2)
+    assert limiter.stream_limit == 2
+    assert await _starts_soon(limiter, "QRR")
+    held.set()
+
+
+@pytest.mark.asyncio
+async def test_limiter_stays_backed_off_when_max_streams_changes():
+    limiter = UpstreamLimiter(max_streams=4)
+    await limiter.record_failure()
+
+    await limiter.set_max_streams(8)
+    assert limiter.stream_limit == 2
+    await limiter.set_max_streams(1)
+    assert limiter.stream_limit == 1
+
+
+@pytest.mark.parametrize(
+    "output, expected",
+    [
+        ("429 Client Error: Too Many Requests for url: https://radiko.jp/", True),
+        ("503 Server Error: Service Unavailable for url: https://radiko.jp/", True),
+        ("Max retries exceeded with url: /v2/api/ts/playlist.m3u8", True),
+        ("('Connection aborted.', RemoteDisconnected())", True),
+        ("404 Client Error: Not Found for url: https://radiko.jp/", False),
+        ("error: No playable streams found on this URL", False),
+    ],
+)
+def test_is_upstream_error(output: str, expected: bool):
+    assert is_upstream_error(output) == expected
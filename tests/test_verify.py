@@ -0,0 +1,115 @@
+import datetime
+from pathlib import Path
+
+from pytest_mock import MockerFixture
+
+from radiko_timeshift_recorder.job import Job
+from radiko_timeshift_recorder.library import LibraryEntry
+from radiko_timeshift_recorder.verify import (
+    DurationCache,
+    VerifyResult,
+    expected_durations,
+    recordable_jobs,
+    restore,
+    set_aside,
+    verify_entries,
+)
+
+
+def entry_for(tmp_path: Path, job: Job, name: str = "a.mp4") -> LibraryEntry:
+    path = tmp_path / name
+    path.write_bytes(b"x")
+    return LibraryEntry(station_id=job.station_id, ft=job.program.ft, path=str(path))
+
+
+def test_verify_entries_compares_durations(
+    mocker: MockerFixture, tmp_path: Path, sample_job: Job
+):
+    durations = {"ok.mp4": 900.5, "short.mp4": 600.0, "unknown.mp4": 10.0}
+    mocker.patch(
+        "radiko_timeshift_recorder.verify.read_duration",
+        side_effect=lambda path: durations[path.name],
+    )
+    other_job = sample_job.model_copy(update={"station_id": "OTHER"})
+    entries = [
+        entry_for(tmp_path, sample_job, "ok.mp4"),
+        entry_for(tmp_path, other_job, "short.mp4"),
+        entry_for(tmp_path, sample_job, "unknown.mp4").model_copy(
+            update={"station_id": "UNKNOWN"}
+        ),
+        LibraryEntry(
+            station_id="TEST", ft=sample_job.program.ft, path=str(tmp_path / "gone")
+        ),
+    ]
+
+    results = verify_entries(
+        entries, expected_durations([], [sample_job, other_job]), DurationCache()
+    )
+
+    assert [r.state for r in results] == ["ok", "truncated", "unknown", "unreadable"]
+    assert [r.is_broken for r in results] == [False, True, False, True]
+
+
+def test_expected_durations_prefer_schedule(sample_job: Job, tmp_path: Path):
+    indexed = entry_for(tmp_path, sample_job).model_copy(update={"dur": 600})
+
+    assert expected_durations([indexed], []) == {
+        (sample_job.station_id, sample_job.program.ft): 600
+    }
+    assert expected_durations([indexed], [sample_job]) == {
+        (sample_job.station_id, sample_job.program.ft): 900
+    }
+
+
+def test_duration_cache_skips_unchanged_files(
+    mocker: MockerFixture, tmp_path: Path, sample_job: Job
+):
+    read_duration = mocker.patch(
+        "radiko_timeshift_recorder.verify.read_duration", return_value=900.0
+    )
+    entry = entry_for(tmp_path, sample_job)
+    cache = DurationCache.open(tmp_path / "cache.jsonl")
+    verify_entries([entry], {}, cache)
+    cache.save()
+
+    verify_entries([entry], {}, DurationCache.open(tmp_path / "cache.jsonl"))
+    assert read_duration.call_count == 1
+
+    Path(entry.path).write_bytes(b"longer")
+    verify_entries([entry], {}, DurationCache.open(tmp_path / "cache.jsonl"))
+    assert read_duration.call_count == 2
+
+
+def test_duration_cache_save_drops_other_paths(tmp_path: Path, sample_job: Job):
+    cache = DurationCache(tmp_path / "cache.jsonl")
+    a, b = tmp_path / "a.mp4", tmp_path / "b.mp4"
+    for path in (a, b):
+        path.write_bytes(b"x")
+        cache.put(path, path.stat(), 1.0)
+
+    cache.save([a])
+
+    assert list(DurationCache.open(tmp_path / "cache.jsonl").entries) == [str(a)]
+
+
+def test_recordable_jobs_are_in_timeshift_window(sample_job: Job, tmp_path: Path):
+    result = VerifyResult(entry=entry_for(tmp_path, sample_job), state="truncated")
+    ok = result.model_copy(update={"state": "ok"})
+
+    now = sample_job.program.to + datetime.timedelta(days=1)
+    assert recordable_jobs([result, ok], [sample_job], now) == [(result, sample_job)]
+    assert recordable_jobs([result], [], now) == []
+    later = sample_job.program.ft + datetime.timedelta(days=7, seconds=1)
+    assert recordable_jobs([result], [sample_job], later) == []
+
+
+def test_set_aside_and_restore(tmp_path: Path):
+    path = tmp_path / "a.mp4"
+    path.write_bytes(b"x")
+
+    broken_path = set_aside(path)
+    assert broken_path.name == "a.mp4.broken"
+    assert not path.exists()
+
+    restore(broken_path, path)
+    assert path.read_bytes() == b"x"
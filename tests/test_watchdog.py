@@ -0,0 +1,81 @@
+import asyncio
+
+import pytest
+
+from radiko_timeshift_recorder.progress import DownloadProgress
+from radiko_timeshift_recorder.watchdog import (
+    DownloadDeadlineExceededError,
+    DownloadStalledError,
+    WatchdogConfig,
+    run_with_watchdog,
+    watch_progress,
+)
+
+
+def test_watchdog_config_deadline_for():
+    config = WatchdogConfig(deadline_factor=1.5, deadline_margin=60)
+
+    assert config.deadline_for(900) == 1410
+
+
+@pytest.mark.asyncio
+async def test_watch_progress_raises_when_stalled() -> None:
+    with pytest.raises(DownloadStalledError, match="No progress"):
+        await watch_progress(DownloadProgress(), stall_timeout=0.05)
+
+
+@pytest.mark.asyncio
+async def test_watch_progress_tolerates_steady_progress_until_deadline() -> None:
+    progress = DownloadProgress()
+
+    async def make_progress() -> None:
+        while True:
+            await asyncio.sleep(0.01)
+            progress.total_size += 1
+
+    feeder = asyncio.create_task(make_progress())
+    try:
+        with pytest.raises(DownloadDeadlineExceededError):
+            await watch_progress(
+                progress, stall_timeout=0.05, deadline=0.2, poll_interval=0.01
+            )
+    finally:
+        feeder.cancel()
+
+    assert progress.total_size > 10
+
+
+@pytest.mark.asyncio
+async def test_run_with_watchdog_returns_result() -> None:
+    async def finish() -> str:
+        return "done"
+
+    assert (
+        await run_with_watchdog(finish(), DownloadProgress(), stall_timeout=1) == "done"
+    )
+
+
+@pytest.mark.asyncio
+async def test_run_with_watchdog_propagates_task_error() -> None:
+    async def fail() -> None:
+        raise ValueError("boom")
+
+    with pytest.raises(ValueError, match="boom"):
+        await run_with_watchdog(fail(), DownloadProgress(), stall_timeout=1)
+
+
+@pytest.mark.asyncio
+async def test_run_with_watchdog_cancels_stalled_task() -> None:
+    cancelled = asyncio.Event()
+
+    async def hang() -> None:
+        try:
+            await asyncio.Event().wait()
+        except asyncio.CancelledError:
+            cancelled.set()
+            raise
+
+    with pytest.raises(DownloadStalledError):
+        await run_with_watchdog(hang(), DownloadProgress(), stall_timeout=0.05)
+
+    assert cancelled.is_set()
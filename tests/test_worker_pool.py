@@ -0,0 +1,218 @@
+import asyncio
+
+import pytest
+from pydantic import ValidationError
+
+from radiko_timeshift_recorder.upstream import UpstreamLimiter
+from radiko_timeshift_recorder.worker_pool import (
+    WorkerPool,
+    WorkerPoolBounds,
+    desired_workers,
+)
+
+
+@pytest.mark.parametrize(
+    "pending, busy, download_bytes_per_second, bandwidth, expected",
+    [
+        pytest.param(0, 0, None, None, 2, id="min"),
+        pytest.param(3, 2, None, None, 5, id="one_per_job"),
+        pytest.param(20, 2, None, None, 8, id="max"),
+        pytest.param(20, 2, 10_000, 50_000, 5, id="bandwidth"),
+        pytest.param(20, 2, 10_000, 1_000, 2, id="bandwidth_below_min"),
+        pytest.param(20, 2, None, 50_000, 8, id="bandwidth_without_observations"),
+    ],
+)
+def test_desired_workers(
+    pending: int,
+    busy: int,
+    download_bytes_per_second: float | None,
+    bandwidth: float | None,
+    expected: int,
+):
+    assert (
+        desired_workers(
+            pending=pending,
+            busy=busy,
+            bounds=WorkerPoolBounds(min_workers=2, max_workers=8),
+            download_bytes_per_second=download_bytes_per_second,
+            bandwidth=bandwidth,
+        )
+        == expected
+    )
+
+
+def test_bounds_are_validated():
+    with pytest.raises(ValidationError):
+        WorkerPoolBounds(min_workers=3, max_workers=2)
+    with pytest.raises(ValidationError):
+        WorkerPoolBounds(min_workers=0, max_workers=2)
+
+
+class FakeWorkers:
+    """Workers that finish their job when it is released, then retire if asked."""
+
+    def __init__(self) -> None:
+        self.pool: WorkerPool
+        self.started: list[int] = []
+        self.release = asyncio.Event()
+
+    async def __call__(self, worker_id: int) -> None:
+        self.started.append(worker_id)
+        while True:
+            if worker_id in self.pool.busy:
+                await self.release.wait()
+                self.pool.busy.discard(worker_id)
+            if self.pool.should_retire(worker_id):
+                return
+            await asyncio.sleep(0.01)
+
+
+@pytest.mark.asyncio
+async def test_pool_grows_with_pending_jobs_and_shrinks_idle_workers():
+    pending = 0
+    workers = FakeWorkers()
+    pool = workers.pool = WorkerPool(
+        workers,
+        WorkerPoolBounds(min_workers=1, max_workers=4),
+        pending=lambda: pending,
+    )
+
+    pool.scale()
+    assert len(pool) == 1
+
+    pending = 10
+    pool.scale()
+    await asyncio.sleep(0)
+    assert len(pool) == 4
+    assert len(workers.started) == 4
+
+    pending = 0
+    pool.scale()
+    await asyncio.sleep(0)
+    assert len(pool) == 1
+    assert len(pool.tasks) == 1
+
+    await pool.stop()
+    assert pool.tasks == {}
+
+
+@pytest.mark.asyncio
+async def test_pool_grows_only_as_far_as_the_current_bandwidth_feeds():
+    bandwidth: float | None = 20_000
+    workers = FakeWorkers()
+    pool = workers.pool = WorkerPool(
+        workers,
+        WorkerPoolBounds(min_workers=1, max_workers=8),
+        pending=lambda: 10,
+        bandwidth=lambda: bandwidth,
+    )
+    pool.download_bytes_per_second = 10_000
+
+    pool.scale()
+    assert len(pool) == 2
+
+    bandwidth = None
+    pool.scale()
+    assert len(pool) == 8
+    await pool.stop()
+
+
+@pytest.mark.asyncio
+async def test_pool_lets_busy_workers_finish_before_retiring():
+    workers = FakeWorkers()
+    pool = workers.pool = WorkerPool(
+        workers, WorkerPoolBounds(min_workers=3, max_workers=3)
+    )
+    pool.scale()
+    await asyncio.sleep(0)
+    busy = list(pool.tasks)[:2]
+    pool.busy.update(busy)
+
+    await pool.set_bounds(WorkerPoolBounds(min_workers=1, max_workers=1))
+
+    # The idle worker is cancelled and one busy worker retires after its job.
+    assert len(pool) == 1
+    assert len(pool.retiring) == 1
+    assert len(pool.tasks) == 2
+
+    retiring_task = pool.tasks[next(iter(pool.retiring))]
+    workers.release.set()
+    await asyncio.wait_for(retiring_task, timeout=1)
+    await asyncio.sleep(0)
+
+    assert len(pool.tasks) == 1
+    assert pool.retiring == set()
+    await pool.stop()
+
+
+@pytest.mark.asyncio
+async def test_pool_keeps_retiring_workers_when_growing_again():
+    workers = FakeWorkers()
+    pool = workers.pool = WorkerPool(
+        workers, WorkerPoolBounds(min_workers=2, max_workers=2)
+    )
+    pool.scale()
+    await asyncio.sleep(0)
+    pool.busy.update(pool.tasks)
+
+    await pool.set_bounds(WorkerPoolBounds(min_workers=1, max_workers=1))
+    assert len(pool.retiring) == 1
+
+    await pool.set_bounds(WorkerPoolBounds(min_workers=2, max_workers=2))
+    assert pool.retiring == set()
+    assert len(workers.started) == 2
+    await pool.stop()
+
+
+@pytest.mark.asyncio
+async def test_pool_bounds_set_the_stream_limit():
+    workers = FakeWorkers()
+    limiter = UpstreamLimiter(max_streams=2)
+    pool = workers.pool = WorkerPool(
+        workers, WorkerPoolBounds(min_workers=1, max_workers=2), limiter=limiter
+    )
+
+    await pool.set_bounds(WorkerPoolBounds(min_workers=1, max_workers=6))
+
+    assert limiter.max_streams == 6
+    assert limiter.stream_limit == 6
+    await pool.stop()
+
+
+@pytest.mark.asyncio
+async def test_drain_lets_busy_workers_finish():
+    workers = FakeWorkers()
+    pool = workers.pool = WorkerPool(
+        workers, WorkerPoolBounds(min_workers=2, max_workers=2)
+    )
+    pool.scale()
+    await asyncio.sleep(0)
+    busy_id, idle_id = list(pool.tasks)
+    busy_task, idle_task = pool.tasks[busy_id], pool.tasks[idle_id]
+    pool.busy.add(busy_id)
+
+    asyncio.get_running_loop().call_later(0.05, workers.release.set)
+    await pool.drain(timeout=5)
+
+    assert idle_task.cancelled()
+    assert busy_task.done() and not busy_task.cancelled()
+    assert pool.tasks == {}
+
+    pool.scale()
+    assert pool.tasks == {}
+
+
+@pytest.mark.asyncio
+async def test_drain_cancels_jobs_running_past_timeout():
+    workers = FakeWorkers()
+    pool = workers.pool = WorkerPool(
+        workers, WorkerPoolBounds(min_workers=1, max_workers=1)
+    )
+    pool.scale()
+    await asyncio.sleep(0)
+    (task,) = pool.tasks.values()
+    pool.busy.update(pool.tasks)
+
+    await pool.drain(timeout=0.01)
+
+    assert task.cancelled()